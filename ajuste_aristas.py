@@ -0,0 +1,106 @@
+"""
+Ajuste (snapping) de puntos a la arista más cercana de la red.
+
+El ajuste al vértice más cercano puede llevar un clic en mitad de una avenida
+larga a un vértice lejano o a una calle paralela. Aquí cada punto se proyecta
+sobre el tramo más cercano (``shapely.STRtree.query_nearest``, O(log n) y
+vectorizado para lotes de puntos) y se devuelve el parámetro ``t`` de la
+proyección a lo largo del tramo, de modo que la ruta puede empezar y terminar
+a mitad de arista con costes parciales.
+
+Cada tramo es un par no dirigido de nodos ``a < b`` con sus aristas dirigidas
+``a->b`` y ``b->a`` (-1 si la calle es de sentido único).
+"""
+import numpy as np
+import shapely
+
+
+class Ajuste:
+    """Resultado vectorizado de ``IndiceAristas.ajustar`` (un elemento por punto)."""
+
+    def __init__(self, tramo, t, x, y, distancia):
+        self.tramo = tramo
+        self.t = t
+        self.x = x
+        self.y = y
+        self.distancia = distancia
+
+    def __len__(self):
+        return len(self.tramo)
+
+
+class IndiceAristas:
+    """Índice espacial de los tramos de la red (en el CRS proyectado de la red)."""
+
+    def __init__(self, red):
+        n = red.n_nodos
+        src = np.asarray(red.edge_src, dtype=np.int64)
+        dst = np.asarray(red.edge_dst, dtype=np.int64)
+        valida = src != dst
+        a, b = np.minimum(src, dst), np.maximum(src, dst)
+        claves, inversa = np.unique((a * n + b)[valida], return_inverse=True)
+        self.a = claves // n
+        self.b = claves % n
+
+        aristas = np.flatnonzero(valida)
+        directa = src[aristas] < dst[aristas]
+        self.arista_ab = np.full(len(claves), -1, dtype=np.int64)
+        self.arista_ba = np.full(len(claves), -1, dtype=np.int64)
+        self.arista_ab[inversa[directa]] = aristas[directa]
+        self.arista_ba[inversa[~directa]] = aristas[~directa]
+
+        x, y = np.asarray(red.node_x), np.asarray(red.node_y)
+        self.ax, self.ay = x[self.a], y[self.a]
+        self.bx, self.by = x[self.b], y[self.b]
+        self.arbol = shapely.STRtree(shapely.linestrings(
+            np.stack([np.column_stack([self.ax, self.ay]), np.column_stack([self.bx, self.by])], axis=1)))
+
+    def ajustar(self, x, y):
+        """Tramo más cercano a cada punto (x, y) y proyección sobre él."""
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y, dtype=np.float64))
+        idx_punto, idx_tramo = self.arbol.query_nearest(shapely.points(x, y), all_matches=False)
+        tramo = np.empty(len(x), dtype=np.int64)
+        tramo[idx_punto] = idx_tramo
+
+        dx, dy = self.bx[tramo] - self.ax[tramo], self.by[tramo] - self.ay[tramo]
+        largo2 = dx * dx + dy * dy
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = ((x - self.ax[tramo]) * dx + (y - self.ay[tramo]) * dy) / largo2
+        t = np.clip(np.nan_to_num(t), 0.0, 1.0)
+        px, py = self.ax[tramo] + t * dx, self.ay[tramo] + t * dy
+        return Ajuste(tramo, t, px, py, np.hypot(x - px, y - py))
+
+    def salidas(self, tramo, t):
+        """``[(nodo, arista, fracción)]``: desde el punto hasta un extremo del tramo."""
+        res = []
+        if self.arista_ab[tramo] >= 0:
+            res.append((int(self.b[tramo]), int(self.arista_ab[tramo]), 1.0 - t))
+        if self.arista_ba[tramo] >= 0:
+            res.append((int(self.a[tramo]), int(self.arista_ba[tramo]), t))
+        return res
+
+    def llegadas(self, tramo, t):
+        """``[(nodo, arista, fracción)]``: desde un extremo del tramo hasta el punto."""
+        res = []
+        if self.arista_ab[tramo] >= 0:
+            res.append((int(self.a[tramo]), int(self.arista_ab[tramo]), t))
+        if self.arista_ba[tramo] >= 0:
+            res.append((int(self.b[tramo]), int(self.arista_ba[tramo]), 1.0 - t))
+        return res
+
+    def aristas_en(self, geometria):
+        """Aristas dirigidas (ambos sentidos) de los tramos que tocan ``geometria`` (CRS de la red)."""
+        tramos = self.arbol.query(geometria, predicate="intersects")
+        aristas = np.concatenate([self.arista_ab[tramos], self.arista_ba[tramos]])
+        return np.unique(aristas[aristas >= 0])
+
+    def directo(self, tramo_o, t_o, tramo_d, t_d):
+        """``(arista, fracción)`` si origen y destino están en el mismo tramo en el sentido de la marcha."""
+        if tramo_o != tramo_d:
+            return None
+        if t_o <= t_d and self.arista_ab[tramo_o] >= 0:
+            return int(self.arista_ab[tramo_o]), t_d - t_o
+        if t_d <= t_o and self.arista_ba[tramo_o] >= 0:
+            return int(self.arista_ba[tramo_o]), t_o - t_d
+        return None
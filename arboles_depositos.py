@@ -0,0 +1,298 @@
+"""
+Árboles de caminos mínimos precalculados desde depósitos fijos.
+
+Parques de bomberos y bases de ambulancias no se mueven y la mayoría de las
+rutas de ``/ruta`` salen de uno de ellos. Para cada depósito registrado y
+cada escenario de tráfico activo se calcula en segundo plano el árbol
+completo de caminos mínimos (arista predecesora + coste de llegada a cada
+nodo); una ruta depósito -> cualquier punto es entonces un recorrido de
+predecesores sin búsqueda.
+
+Cada árbol ocupa 8 bytes por nodo (``int32`` + ``float32``) y el número de
+árboles en memoria está acotado (LRU). El registro de depósitos se guarda en
+un JSON que todos los workers vuelven a leer cuando cambia.
+"""
+import fcntl
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+SALIDA = -2     # arista_pred de los nodos por los que se sale del depósito
+SIN_CAMINO = -1
+RECARGA_S = 1.0  # como mucho una comprobación del registro por segundo
+
+
+class ArbolCaminos:
+    """
+    Árbol desde un depósito: ``arista_pred[v]`` es la última arista del camino
+    mínimo hasta ``v`` (``SALIDA`` en los nodos de salida, ``SIN_CAMINO`` si no
+    se alcanza) y ``coste[v]`` el tiempo de llegada. ``salidas`` es
+    ``{nodo: (tiempo, longitud)}`` del tramo inicial desde el depósito.
+    """
+
+    def __init__(self, arista_pred, coste, salidas):
+        self.arista_pred = arista_pred
+        self.coste = coste
+        self.salidas = salidas
+        self.deposito = None  # Deposito con el que se calculó
+
+    @property
+    def nbytes(self):
+        return self.arista_pred.nbytes + self.coste.nbytes
+
+    def camino(self, nodo, edge_src):
+        """Aristas desde la salida hasta ``nodo`` y nodo de salida, o None si no se alcanza."""
+        aristas = []
+        e = int(self.arista_pred[nodo])
+        if e == SIN_CAMINO:
+            return None
+        while e >= 0:
+            aristas.append(e)
+            nodo = int(edge_src[e])
+            e = int(self.arista_pred[nodo])
+        aristas.reverse()
+        return nodo, aristas
+
+
+def construir_arbol(arista_pred, coste, salidas):
+    """Empaqueta un árbol con arrays compactos y de solo lectura."""
+    arista_pred = np.asarray(arista_pred, dtype=np.int32)
+    coste = np.asarray(coste, dtype=np.float32)
+    arista_pred.setflags(write=False)
+    coste.setflags(write=False)
+    return ArbolCaminos(arista_pred, coste, salidas)
+
+
+class Deposito:
+    def __init__(self, ident, lat, lon, clave):
+        self.id = ident
+        self.lat = lat
+        self.lon = lon
+        self.clave = clave  # clave del punto ajustado a la red
+
+
+class GestorDepositos:
+    """
+    Registro de depósitos + LRU de árboles por (depósito, escenario) con un
+    hilo que los calcula en segundo plano.
+
+    ``clave_punto(lat, lon)`` devuelve la clave del punto ajustado a la red y
+    ``calcular(lat, lon, escenario)`` el ``ArbolCaminos`` del depósito.
+    """
+
+    def __init__(self, ruta, clave_punto, calcular, max_arboles=64):
+        self.ruta = ruta
+        self.clave_punto = clave_punto
+        self.calcular = calcular
+        self.max_arboles = max(0, int(max_arboles))
+        self._depositos = {}
+        self._por_clave = {}
+        self._arboles = OrderedDict()  # (id, clave de escenario) -> ArbolCaminos
+        self._pendientes = set()
+        self._escenarios = {}  # clave de escenario -> Escenario (solo los pendientes)
+        self._lock = threading.Lock()
+        self._cola = queue.Queue()
+        self._hilo_pid = None
+        self._mtime = None
+        self._revisado = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.calculados = 0
+        self.segundos_calculo = 0.0
+
+    # -------------------------
+    # Registro (JSON compartido entre workers)
+    # -------------------------
+    def _leer_registro(self):
+        if not os.path.exists(self.ruta):
+            return {}
+        with open(self.ruta, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _escribir_registro(self, registro):
+        directorio = os.path.dirname(self.ruta) or "."
+        os.makedirs(directorio, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".depositos_", dir=directorio)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(registro, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.ruta)
+
+    @contextmanager
+    def _bloqueo_registro(self):
+        """Leer, modificar y escribir el registro sin pisar a otro worker (flock en ``<ruta>.lock``)."""
+        os.makedirs(os.path.dirname(self.ruta) or ".", exist_ok=True)
+        with self._lock, open(self.ruta + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield  # al cerrar el fichero se suelta el bloqueo
+
+    def _recargar(self, forzar=False):
+        ahora = time.monotonic()
+        if not forzar and ahora - self._revisado < RECARGA_S:
+            return
+        self._revisado = ahora
+        mtime = os.path.getmtime(self.ruta) if os.path.exists(self.ruta) else None
+        if not forzar and mtime == self._mtime:
+            return
+        registro = self._leer_registro()
+        depositos = {}
+        for ident, d in registro.items():
+            lat, lon = float(d["lat"]), float(d["lon"])
+            anterior = self._depositos.get(ident)
+            if anterior is not None and (anterior.lat, anterior.lon) == (lat, lon):
+                depositos[ident] = anterior
+            else:
+                depositos[ident] = Deposito(ident, lat, lon, self.clave_punto(lat, lon))
+        with self._lock:
+            self._depositos = depositos
+            self._por_clave = {d.clave: ident for ident, d in depositos.items()}
+            # Fuera los árboles de depósitos borrados o movidos
+            for k in [k for k, a in self._arboles.items() if depositos.get(k[0]) is not a.deposito]:
+                del self._arboles[k]
+            self._mtime = mtime
+
+    def registrar(self, ident, lat, lon, escenarios=()):
+        """Alta o modificación de un depósito; encola sus árboles para ``escenarios``."""
+        with self._bloqueo_registro():
+            registro = self._leer_registro()
+            registro[str(ident)] = {"lat": float(lat), "lon": float(lon)}
+            self._escribir_registro(registro)
+        self._recargar(forzar=True)
+        for escenario in escenarios:
+            self._encolar(str(ident), escenario)
+        return self._depositos[str(ident)]
+
+    def eliminar(self, ident):
+        with self._bloqueo_registro():
+            registro = self._leer_registro()
+            if str(ident) not in registro:
+                return False
+            del registro[str(ident)]
+            self._escribir_registro(registro)
+        self._recargar(forzar=True)
+        return True
+
+    def listar(self):
+        self._recargar()
+        with self._lock:
+            por_deposito = {}
+            for ident, _ in self._arboles:
+                por_deposito[ident] = por_deposito.get(ident, 0) + 1
+            return [{"id": d.id, "lat": d.lat, "lon": d.lon, "arboles": por_deposito.get(d.id, 0)}
+                    for d in self._depositos.values()]
+
+    def deposito(self, ident):
+        self._recargar()
+        return self._depositos.get(str(ident))
+
+    def deposito_en(self, clave):
+        """Id del depósito que se ajusta a la misma posición que ``clave`` o None."""
+        self._recargar()
+        return self._por_clave.get(clave)
+
+    # -------------------------
+    # Árboles
+    # -------------------------
+    def arbol(self, ident, escenario):
+        """Árbol del depósito para el escenario o None (y se encola su cálculo)."""
+        if not self.max_arboles:
+            return None
+        k = (ident, escenario.version)
+        with self._lock:
+            arbol = self._arboles.get(k)
+            if arbol is not None:
+                self._arboles.move_to_end(k)
+                self.hits += 1
+                return arbol
+            self.misses += 1
+            ids = list(self._depositos)
+        # Escenario nuevo: se preparan los árboles de todos los depósitos
+        for i in ids:
+            self._encolar(i, escenario)
+        return None
+
+    def _encolar(self, ident, escenario):
+        if not self.max_arboles:
+            return
+        self._arrancar_hilo()
+        k = (ident, escenario.version)
+        with self._lock:
+            if k in self._arboles or k in self._pendientes:
+                return
+            self._pendientes.add(k)
+            self._escenarios[escenario.version] = escenario
+        self._cola.put(k)
+
+    def _arrancar_hilo(self):
+        # Los hilos no sobreviven al fork de Gunicorn: uno por proceso
+        if self._hilo_pid == os.getpid():
+            return
+        with self._lock:
+            if self._hilo_pid == os.getpid():
+                return
+            if self._hilo_pid is not None:
+                # Proceso hijo: los pendientes eran del hilo del padre
+                self._cola = queue.Queue()
+                self._pendientes.clear()
+                self._escenarios.clear()
+            self._hilo_pid = os.getpid()
+        threading.Thread(target=self._trabajar, name="arboles-depositos", daemon=True).start()
+
+    def _trabajar(self):
+        while True:
+            ident, clave_esc = k = self._cola.get()
+            with self._lock:
+                deposito = self._depositos.get(ident)
+                escenario = self._escenarios.get(clave_esc)
+            try:
+                if deposito is not None and escenario is not None:
+                    t0 = time.perf_counter()
+                    arbol = self.calcular(deposito.lat, deposito.lon, escenario)
+                    arbol.deposito = deposito
+                    with self._lock:
+                        self.segundos_calculo += time.perf_counter() - t0
+                        self.calculados += 1
+                        if self._depositos.get(ident) is deposito:
+                            self._arboles[k] = arbol
+                            while len(self._arboles) > self.max_arboles:
+                                self._arboles.popitem(last=False)
+            except Exception as e:
+                print(f"❌ Error calculando el árbol del depósito {ident}: {e}")
+            finally:
+                with self._lock:
+                    self._pendientes.discard(k)
+                    if not any(p[1] == clave_esc for p in self._pendientes):
+                        self._escenarios.pop(clave_esc, None)
+
+    def esperar(self, timeout=None):
+        """Bloquea hasta que no quedan árboles pendientes (build step / pruebas)."""
+        limite = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if not self._pendientes:
+                    return True
+            if limite is not None and time.monotonic() > limite:
+                return False
+            time.sleep(0.01)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "depositos": len(self._depositos),
+                "arboles": len(self._arboles),
+                "max_arboles": self.max_arboles,
+                "bytes": int(sum(a.nbytes for a in self._arboles.values())),
+                "pendientes": len(self._pendientes),
+                "calculados": self.calculados,
+                "segundos_calculo": round(self.segundos_calculo, 3),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,100 @@
+"""
+Benchmark: Customizable Contraction Hierarchies vs ``nx.dijkstra_path``.
+
+Compara latencia por consulta y nodos asentados (settled) para pares
+origen/destino aleatorios sobre la red de ``callejero_mostoles_mod``.
+
+    python bench/bench_ch.py [--consultas 200] [--semilla 42] [--fecha 2025-12-29]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import networkx as nx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import callejero_mostoles_mod as cm  # noqa: E402
+import motor_rutas  # noqa: E402
+
+
+def _resumen(tiempos_ms):
+    t = np.asarray(tiempos_ms)
+    return f"p50={np.percentile(t, 50):8.3f} ms  p95={np.percentile(t, 95):8.3f} ms  media={t.mean():8.3f} ms"
+
+
+def settled_networkx(G, origen, destino, preds):
+    """Nodos asentados por nx.dijkstra_path (los que relajan aristas + el destino)."""
+    asentados = set()
+
+    def peso(u, v, d):
+        asentados.add(u)
+        nivel = preds.get(d.get('zona')) if preds else None
+        return d['travel_time_s'] * motor_rutas.FACTORES_TRAFICO.get(nivel, 1.0)
+
+    try:
+        nx.dijkstra_path(G, origen, destino, weight=peso)
+    except nx.NetworkXNoPath:
+        pass
+    return len(asentados | {destino})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CCH vs nx.dijkstra_path")
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--fecha", default=None, help="Fecha u hora del escenario de tráfico (YYYY-MM-DD[THH:MM])")
+    args = parser.parse_args()
+
+    preds = {}
+    if args.fecha:
+        import server
+        server.esperar_listo()  # el modelo se carga en la inicialización diferida
+        preds = server.predecir_trafico_por_fecha(args.fecha)
+
+    red = cm.red
+    rnd = random.Random(args.semilla)
+    pares = [(rnd.randrange(red.n_nodos), rnd.randrange(red.n_nodos)) for _ in range(args.consultas)]
+
+    # Preprocesado (métrica-independiente) y personalización del escenario
+    t0 = time.perf_counter()
+    jerarquia = cm.obtener_jerarquia_cch()
+    t_build = time.perf_counter() - t0
+    escenario = cm.escenarios.obtener(preds)
+    t0 = time.perf_counter()
+    pers = jerarquia.personalizar(escenario.pesos)
+    t_custom = time.perf_counter() - t0
+    G = cm.obtener_grafo()
+
+    t_nx, s_nx, t_ch, s_ch = [], [], [], []
+    discrepancias = 0
+    for o, d in pares:
+        t0 = time.perf_counter()
+        ref = cm._ruta_networkx(o, d, preds)
+        t_nx.append((time.perf_counter() - t0) * 1000)
+        s_nx.append(settled_networkx(G, o, d, preds))
+
+        stats = {}
+        t0 = time.perf_counter()
+        res = jerarquia.consulta(o, d, pers, stats)
+        t_ch.append((time.perf_counter() - t0) * 1000)
+        s_ch.append(stats.get("settled", 1))
+
+        coste = None if res is None else sum(escenario.vista[e] for e in res[1])
+        if (ref is None) != (res is None) or (ref is not None and abs(ref[2] - coste) > 1e-6):
+            discrepancias += 1
+
+    print(f"Red: {red.n_nodos} nodos, {red.n_aristas} aristas | consultas: {len(pares)}")
+    print(f"CCH: preprocesado {t_build:.2f} s (métrica-independiente, cacheado en disco), "
+          f"personalización {t_custom * 1000:.1f} ms por escenario")
+    print(f"nx.dijkstra_path  {_resumen(t_nx)}  settled medio={np.mean(s_nx):8.0f}")
+    print(f"CCH               {_resumen(t_ch)}  settled medio={np.mean(s_ch):8.0f}")
+    print(f"Aceleración media: x{np.mean(t_nx) / np.mean(t_ch):.1f} | rutas con coste distinto: {discrepancias}")
+    return 1 if discrepancias else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
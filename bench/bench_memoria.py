@@ -0,0 +1,105 @@
+"""
+Memoria única (USS) por worker con y sin precarga en el proceso maestro.
+
+Simula el modelo de Gunicorn: un maestro que hace fork de N workers y cada
+worker atiende la misma carga (rutas, matriz, isocronas y teselas).
+
+- ``precarga``: el maestro importa ``callejero_mostoles_mod``, llama a
+  ``precargar()`` y congela el GC antes del fork (``PRECARGA=1``).
+- ``sin_precarga``: cada worker importa el módulo y construye sus
+  estructuras él mismo después del fork.
+
+    python bench/bench_memoria.py [--workers 4]
+"""
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import memoria_procesos  # noqa: E402
+
+
+def _carga(cm):
+    lon, lat = cm.nodos_wgs84().T
+    for i in range(20):
+        k = (i * 7919) % len(lat)
+        cm.ruta_geojson_bytes(lat[i], lon[i], lat[k], lon[k])
+    puntos = list(zip(lat[:20], lon[:20]))
+    cm.matriz_rutas(puntos, puntos)
+    cm.isocronas_geojson(puntos[:1], [5])
+    indice = cm.obtener_teselas()
+    for z, x, y in cm.teselas_red.teselas_en_bbox(indice.bbox, 13)[:8]:
+        indice.obtener(z, x, y)
+
+
+def _worker(conn):
+    t0 = time.perf_counter()
+    import callejero_mostoles_mod as cm
+    _carga(cm)
+    conn.send((time.perf_counter() - t0, memoria_procesos.uso()))
+    conn.recv()  # sigue vivo hasta que el maestro lo diga (páginas compartidas)
+
+
+def ejecutar(modo, workers):
+    if modo == "precarga":
+        import callejero_mostoles_mod as cm
+        cm.precargar()
+        gc.collect()
+        gc.freeze()
+    ctx = multiprocessing.get_context("fork")
+    tubos, procesos = [], []
+    for _ in range(workers):
+        padre, hijo = ctx.Pipe()
+        p = ctx.Process(target=_worker, args=(hijo,))
+        p.start()
+        tubos.append(padre)
+        procesos.append(p)
+    resultados = [t.recv() for t in tubos]
+    # Medidas con todos los workers vivos a la vez
+    usos = [memoria_procesos.uso(p.pid) for p in procesos]
+    maestro = memoria_procesos.uso()
+    for t in tubos:
+        t.send(None)
+    for p in procesos:
+        p.join()
+    return {
+        "modo": modo,
+        "maestro": maestro,
+        "workers": [dict(u, primera_carga_s=round(s, 2)) for (s, _), u in zip(resultados, usos)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--modo", choices=["precarga", "sin_precarga"])
+    args = parser.parse_args()
+
+    if args.modo:
+        print(json.dumps(ejecutar(args.modo, args.workers)))
+        return 0
+
+    # Cada modo en un intérprete limpio
+    print(f"{'modo':<14}{'maestro USS':>12}{'worker USS (media)':>20}{'total USS':>11}{'1ª carga (s)':>14}")
+    for modo in ("sin_precarga", "precarga"):
+        salida = subprocess.run([sys.executable, os.path.abspath(__file__), "--modo", modo,
+                                 "--workers", str(args.workers)],
+                                capture_output=True, text=True, check=True, cwd=RAIZ).stdout
+        r = json.loads(salida.strip().splitlines()[-1])
+        uss = [w["uss_mb"] for w in r["workers"]]
+        carga = [w["primera_carga_s"] for w in r["workers"]]
+        total = r["maestro"]["uss_mb"] + sum(uss)
+        print(f"{modo:<14}{r['maestro']['uss_mb']:>10.1f}MB{sum(uss) / len(uss):>18.1f}MB"
+              f"{total:>9.1f}MB{sum(carga) / len(carga):>14.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
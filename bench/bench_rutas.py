@@ -0,0 +1,316 @@
+"""
+Benchmark de routing e inferencia con cargas de consultas reproducibles.
+
+Genera con una semilla pares origen/destino aleatorios dentro de los polígonos
+de ``data/zonas_mostoles.geojson`` (uniformes por superficie) y una fecha/hora
+de salida para cada uno, y mide por etapa:
+
+- ``carga_calles``, ``construccion_grafo``, ``carga_artefacto``: lectura del
+  GeoJSON, construcción + compilación del grafo y apertura del artefacto.
+- ``prediccion_dia``: todas las franjas de un día (caché de días vacía) y
+  ``prediccion``: la consulta por petición (``predecir_trafico_por_fecha``).
+- ``ajuste``: origen y destino a la red; ``busqueda``: camino mínimo con el
+  motor configurado; ``geojson``: geometría WGS84 + ``json.dumps``.
+- ``calibracion``: trabajo fijo que solo depende de la máquina; al comparar,
+  los tiempos se escalan por su cociente para descontar cambios de velocidad
+  entre ejecuciones.
+- ``ruta_http``: ``/ruta`` de extremo a extremo con el cliente de pruebas de
+  Flask (caché de rutas vacía) y ``ruta_http_cacheada``: la misma consulta
+  repetida (acierto de caché).
+
+Se repite en varias rondas (``--rondas``) y de cada etapa se guarda la ronda
+de menor p50: p50/p95/p99 y mínimo (ms), y el pico de memoria asignada
+(``tracemalloc``, en una pasada aparte para no falsear los tiempos), además
+del RSS máximo del proceso, en un JSON. Con ``--base`` compara con un
+resultado anterior y sale con código 1 si alguna etapa empeora por encima de
+la tolerancia.
+
+    python bench/bench_rutas.py [--consultas 200] [--semilla 42] [--salida r.json]
+    python bench/bench_rutas.py --base bench/resultados/anterior.json
+    python bench/bench_rutas.py --resultado nuevo.json --base anterior.json  # solo comparar
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+ZONAS_PATH = os.path.join(RAIZ, "data", "zonas_mostoles.geojson")
+RESULTADOS_DIR = os.path.join(RAIZ, "bench", "resultados")
+PASADA_MEMORIA = 50  # consultas de la pasada con tracemalloc
+MIN_MUESTRAS_PERCENTILES = 20
+
+
+# -------------------------
+# Carga de consultas
+# -------------------------
+def generar_consultas(n, semilla, sin_hora=0.25):
+    """
+    ``n`` consultas ``{orig_lat, orig_lon, dest_lat, dest_lon, date}``
+    reproducibles: puntos uniformes dentro de las zonas y una salida en 2025
+    en múltiplos de 15 min (una fracción ``sin_hora`` solo con la fecha).
+    """
+    import shapely
+
+    with open(ZONAS_PATH, encoding="utf-8") as f:
+        zonas = [shapely.geometry.shape(z["geometry"]) for z in json.load(f)["features"]]
+    areas = np.array([z.area for z in zonas])
+    rng = np.random.default_rng(semilla)
+
+    def punto(zona):
+        oeste, sur, este, norte = zona.bounds
+        while True:
+            lon, lat = rng.uniform(oeste, este), rng.uniform(sur, norte)
+            if shapely.contains_xy(zona, lon, lat):
+                return float(lat), float(lon)
+
+    consultas = []
+    for _ in range(n):
+        o, d = rng.choice(len(zonas), size=2, p=areas / areas.sum())
+        orig, dest = punto(zonas[o]), punto(zonas[d])
+        dia = datetime(2025, 1, 1).toordinal() + int(rng.integers(365))
+        fecha = datetime.fromordinal(dia).strftime("%Y-%m-%d")
+        if rng.random() >= sin_hora:
+            minutos = int(rng.integers(96)) * 15
+            fecha = f"{fecha}T{minutos // 60:02d}:{minutos % 60:02d}"
+        consultas.append({"orig_lat": orig[0], "orig_lon": orig[1],
+                          "dest_lat": dest[0], "dest_lon": dest[1], "date": fecha})
+    return consultas
+
+
+# -------------------------
+# Medidas
+# -------------------------
+def _percentiles(tiempos_s):
+    t = np.asarray(tiempos_s) * 1000
+    return {
+        "n": int(len(t)),
+        "p50_ms": round(float(np.percentile(t, 50)), 4),
+        "p95_ms": round(float(np.percentile(t, 95)), 4),
+        "p99_ms": round(float(np.percentile(t, 99)), 4),
+        "media_ms": round(float(t.mean()), 4),
+        "min_ms": round(float(t.min()), 4),
+        "max_ms": round(float(t.max()), 4),
+    }
+
+
+class Etapas:
+    """Tiempos por etapa; con ``memoria=True`` registra además el pico de tracemalloc."""
+
+    def __init__(self, memoria=False):
+        self.memoria = memoria
+        self.tiempos = {}
+        self.picos = {}
+
+    def medir(self, nombre, funcion, *args, **kwargs):
+        if self.memoria:
+            tracemalloc.reset_peak()
+            inicial = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
+        resultado = funcion(*args, **kwargs)
+        segundos = time.perf_counter() - t0
+        if self.memoria:
+            pico = (tracemalloc.get_traced_memory()[1] - inicial) / 2 ** 20
+            self.picos[nombre] = max(self.picos.get(nombre, 0.0), pico)
+        else:
+            self.tiempos.setdefault(nombre, []).append(segundos)
+        return resultado
+
+
+def _calibracion():
+    # Trabajo fijo (Python puro + NumPy) que solo depende de la velocidad de la máquina
+    total = 0
+    for i in range(20000):
+        total += i * i
+    return total + int(np.sort(np.arange(50000)[::-1]).sum())
+
+
+def _medir_grafo(etapas, cm, repeticiones):
+    import grafo_compilado
+
+    for _ in range(repeticiones):
+        cm._gdf_edges = None
+        gdf = etapas.medir("carga_calles", cm.cargar_calles)
+        etapas.medir("construccion_grafo",
+                     lambda: grafo_compilado.compilar_desde_aristas(cm.construir_aristas(gdf), ""))
+        etapas.medir("carga_artefacto", grafo_compilado.cargar, cm.red.meta["directorio"],
+                     cm.red.meta["source_sha256"])
+
+
+def _medir_consultas(etapas, server, cm, consultas):
+    motor, ajuste = cm._opciones_ruta(None, None)
+    cliente = server.app.test_client()
+    cm.cache_rutas_red.limpiar()
+    for q in consultas:
+        server.predicciones_dia.cache_clear()
+        etapas.medir("prediccion_dia", server.predecir_trafico_por_fecha, q["date"])
+        preds = etapas.medir("prediccion", server.predecir_trafico_por_fecha, q["date"])
+        extremos = etapas.medir("ajuste", cm._ajustar_extremos, q["orig_lat"], q["orig_lon"],
+                                q["dest_lat"], q["dest_lon"], ajuste)
+        camino = etapas.medir("busqueda", cm._camino, extremos, preds, motor, ajuste)
+        if camino is not None:
+            etapas.medir("geojson", lambda: json.dumps(cm._geojson(*camino)).encode("utf-8"))
+    url = "/ruta?orig_lat={orig_lat}&orig_lon={orig_lon}&dest_lat={dest_lat}&dest_lon={dest_lon}&date={date}"
+    for nombre in ("ruta_http", "ruta_http_cacheada"):
+        for q in consultas:
+            estado = etapas.medir(nombre, lambda: cliente.get(url.format(**q)).status_code)
+            if estado not in (200, 404):
+                raise RuntimeError(f"/ruta devolvió {estado} para {q}")
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=RAIZ, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ejecutar(consultas_n, semilla, repeticiones_grafo, n_rondas=3):
+    os.chdir(RAIZ)
+    import server
+
+    server.esperar_listo()
+    cm = server.cm
+    consultas = generar_consultas(consultas_n, semilla)
+    # Calentamiento con otra semilla: escenarios base, índices y cachés de módulo
+    _medir_consultas(Etapas(), server, cm, generar_consultas(10, semilla + 1))
+
+    # Varias rondas y, por etapa, la de menor p50: descarta interferencias puntuales de la máquina
+    rondas = []
+    for _ in range(max(1, n_rondas)):
+        etapas = Etapas()
+        for _ in range(30):
+            etapas.medir("calibracion", _calibracion)
+        if repeticiones_grafo:
+            _medir_grafo(etapas, cm, repeticiones_grafo)
+        _medir_consultas(etapas, server, cm, consultas)
+        rondas.append({nombre: _percentiles(t) for nombre, t in etapas.tiempos.items()})
+    mejores = {nombre: min((r[nombre] for r in rondas), key=lambda e: e["p50_ms"]) for nombre in rondas[0]}
+
+    memoria = Etapas(memoria=True)
+    tracemalloc.start()
+    try:
+        if repeticiones_grafo:
+            _medir_grafo(memoria, cm, 1)
+        _medir_consultas(memoria, server, cm, consultas[:PASADA_MEMORIA])
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "meta": {
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "commit": _commit(),
+            "python": platform.python_version(),
+            "semilla": semilla,
+            "consultas": consultas_n,
+            "rondas": n_rondas,
+            "motor": cm.MOTOR_RUTAS,
+            "ajuste": cm.AJUSTE_RUTAS,
+            "nodos": int(cm.red.n_nodos),
+            "aristas": int(cm.red.n_aristas),
+            "red": cm.VERSION_RED,
+        },
+        "etapas": {nombre: dict(e, pico_mb=round(memoria.picos.get(nombre, 0.0), 3))
+                   for nombre, e in mejores.items()},
+        # ru_maxrss está en KB en Linux
+        "memoria": {"max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)},
+    }
+
+
+# -------------------------
+# Informe y comparación
+# -------------------------
+def imprimir(resultado):
+    m = resultado["meta"]
+    print(f"{m['consultas']} consultas (semilla {m['semilla']}), motor {m['motor']}, ajuste {m['ajuste']}, "
+          f"{m['nodos']} nodos, commit {m['commit']}")
+    print(f"{'etapa':<20}{'n':>6}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'pico MB':>10}")
+    for nombre, e in resultado["etapas"].items():
+        print(f"{nombre:<20}{e['n']:>6}{e['p50_ms']:>11.3f}{e['p95_ms']:>11.3f}{e['p99_ms']:>11.3f}"
+              f"{e['pico_mb']:>10.2f}")
+    print(f"RSS máximo: {resultado['memoria']['max_rss_mb']} MB")
+
+
+def comparar(base, nuevo, tolerancia=0.15, umbral_ms=0.05, umbral_mb=1.0):
+    """Regresiones de ``nuevo`` frente a ``base``: lista de textos (vacía si no hay)."""
+    regresiones = []
+    for campo in ("semilla", "consultas", "motor", "ajuste", "red"):
+        if base["meta"].get(campo) != nuevo["meta"].get(campo):
+            print(f"⚠️  {campo} distinto ({base['meta'].get(campo)} -> {nuevo['meta'].get(campo)}): "
+                  "resultados no del todo comparables")
+    # Los tiempos nuevos se escalan por la diferencia de velocidad de la máquina entre ejecuciones
+    factor = 1.0
+    if "calibracion" in base["etapas"] and "calibracion" in nuevo["etapas"]:
+        factor = base["etapas"]["calibracion"]["p50_ms"] / nuevo["etapas"]["calibracion"]["p50_ms"]
+        print(f"Calibración: máquina {1 / factor:.2f}x el tiempo de la base (tiempos nuevos escalados)")
+    print(f"{'etapa':<20}{'p50 base':>10}{'p50':>10}{'Δ':>8}{'p95 base':>10}{'p95':>10}{'Δ':>8}")
+    for nombre, e in nuevo["etapas"].items():
+        b = base["etapas"].get(nombre)
+        if b is None or nombre == "calibracion":
+            continue
+        e = dict(e, **{p: e[p] * factor for p in ("p50_ms", "p95_ms", "min_ms")})
+        marcas = []
+        # Con pocas muestras (construcción del grafo) los percentiles son ruido: se compara el mínimo
+        for p in ("p50_ms", "p95_ms") if e["n"] >= MIN_MUESTRAS_PERCENTILES else ("min_ms",):
+            if e[p] > b[p] * (1 + tolerancia) and e[p] - b[p] > umbral_ms:
+                marcas.append(f"{nombre} {p[:-3]}: {b[p]:.3f} -> {e[p]:.3f} ms")
+        if e["pico_mb"] > b["pico_mb"] * (1 + tolerancia) and e["pico_mb"] - b["pico_mb"] > umbral_mb:
+            marcas.append(f"{nombre} pico de memoria: {b['pico_mb']:.2f} -> {e['pico_mb']:.2f} MB")
+        cambio = [(e[p] - b[p]) / b[p] * 100 if b[p] else 0.0 for p in ("p50_ms", "p95_ms")]
+        print(f"{nombre:<20}{b['p50_ms']:>10.3f}{e['p50_ms']:>10.3f}{cambio[0]:>+7.0f}%"
+              f"{b['p95_ms']:>10.3f}{e['p95_ms']:>10.3f}{cambio[1]:>+7.0f}%{'  ❌' if marcas else ''}")
+        regresiones += marcas
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--repeticiones-grafo", type=int, default=5,
+                        help="construcciones del grafo a medir (0 para omitirlas)")
+    parser.add_argument("--rondas", type=int, default=3, help="rondas de medida (se queda la mejor por etapa)")
+    parser.add_argument("--salida", help="JSON de resultados (por defecto en bench/resultados/)")
+    parser.add_argument("--resultado", help="usar un resultado existente en lugar de ejecutar")
+    parser.add_argument("--base", help="resultado anterior con el que comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.15, help="empeoramiento relativo admitido")
+    args = parser.parse_args()
+
+    if args.resultado:
+        with open(args.resultado, encoding="utf-8") as f:
+            resultado = json.load(f)
+    else:
+        resultado = ejecutar(args.consultas, args.semilla, args.repeticiones_grafo, args.rondas)
+        salida = args.salida or os.path.join(
+            RESULTADOS_DIR, f"bench_rutas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+        with open(salida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+        imprimir(resultado)
+        print(f"💾 Resultados en {salida}")
+
+    if not args.base:
+        return 0
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    regresiones = comparar(base, resultado, args.tolerancia)
+    for r in regresiones:
+        print(f"❌ Regresión: {r}")
+    if not regresiones:
+        print("✅ Sin regresiones")
+    return 1 if regresiones else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+Caché de respuestas de ``/ruta``.
+
+La consola de despacho repite una y otra vez las mismas rutas (parque ->
+punto caliente) con la misma fecha. La clave es la de los extremos ya
+ajustados a la red más el escenario de tráfico, así que clics distintos que
+caen en el mismo sitio comparten entrada, y el valor son los bytes ya
+serializados de la respuesta: un acierto no reproyecta, no busca y no
+vuelve a generar el GeoJSON.
+
+Cada worker tiene una LRU local acotada en entradas y en bytes, con TTL.
+Opcionalmente (``CACHE_RUTAS_REDIS`` y el paquete ``redis``) hay una segunda
+capa compartida entre workers y réplicas; si falla, se sigue solo con la
+local.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+PREFIJO = "ruta:"
+
+
+class CacheRutas:
+    """LRU con TTL de respuestas serializadas + capa compartida opcional (Redis)."""
+
+    def __init__(self, max_entradas=2048, ttl=3600, max_bytes=64 * 1024 * 1024, url_compartida=None):
+        self.max_entradas = max(0, int(max_entradas))
+        self.ttl = float(ttl)
+        self.max_bytes = int(max_bytes)
+        self._entradas = OrderedDict()  # clave -> (caduca, datos)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.hits_compartida = 0
+        self.misses = 0
+        self.caducadas = 0
+        self.expulsadas = 0
+        self.errores_compartida = 0
+
+        self._compartida = None
+        if url_compartida and self.max_entradas:
+            if not REDIS_AVAILABLE:
+                print("⚠️  CACHE_RUTAS_REDIS definido pero el paquete redis no está instalado")
+            else:
+                # Timeouts cortos: la caché nunca debe ser más lenta que calcular la ruta
+                self._compartida = redis.Redis.from_url(url_compartida, socket_timeout=0.05,
+                                                        socket_connect_timeout=0.2)
+
+    @property
+    def activa(self):
+        return self.max_entradas > 0
+
+    def obtener(self, clave):
+        """Bytes guardados para ``clave`` o None."""
+        if not self.activa:
+            return None
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                if entrada[0] > ahora:
+                    self._entradas.move_to_end(clave)
+                    self.hits += 1
+                    return entrada[1]
+                self._quitar(clave)
+                self.caducadas += 1
+
+        if self._compartida is not None:
+            try:
+                datos = self._compartida.get(PREFIJO + clave)
+            except redis.RedisError:
+                datos = None
+                self.errores_compartida += 1
+            if datos is not None:
+                self._guardar_local(clave, datos, ahora)
+                with self._lock:
+                    self.hits_compartida += 1
+                return datos
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def guardar(self, clave, datos):
+        if not self.activa:
+            return
+        self._guardar_local(clave, datos, time.monotonic())
+        if self._compartida is not None:
+            try:
+                self._compartida.set(PREFIJO + clave, datos, ex=max(1, int(self.ttl)))
+            except redis.RedisError:
+                self.errores_compartida += 1
+
+    def _tamano(self, clave, datos):
+        return len(clave) + len(datos)
+
+    def _quitar(self, clave):
+        _, datos = self._entradas.pop(clave)
+        self._bytes -= self._tamano(clave, datos)
+
+    def _guardar_local(self, clave, datos, ahora):
+        tamano = self._tamano(clave, datos)
+        if tamano > self.max_bytes:
+            return
+        with self._lock:
+            if clave in self._entradas:
+                self._quitar(clave)
+            self._entradas[clave] = (ahora + self.ttl, datos)
+            self._bytes += tamano
+            while len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes:
+                self._quitar(next(iter(self._entradas)))
+                self.expulsadas += 1
+
+    def stats(self):
+        with self._lock:
+            consultas = self.hits + self.hits_compartida + self.misses
+            return {
+                "entradas": len(self._entradas),
+                "max_entradas": self.max_entradas,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "hits_compartida": self.hits_compartida,
+                "misses": self.misses,
+                "caducadas": self.caducadas,
+                "expulsadas": self.expulsadas,
+                "hit_rate": round((self.hits + self.hits_compartida) / consultas, 4) if consultas else 0.0,
+                "compartida": self._compartida is not None,
+                "errores_compartida": self.errores_compartida,
+            }
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
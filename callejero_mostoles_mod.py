@@ -1,10 +1,26 @@
+import json
 import os
-import geopandas as gpd
+import shutil
 import numpy as np
-import networkx as nx
-from shapely.geometry import Point, LineString
+import shapely
+from shapely.geometry import Polygon, mapping, shape
 from scipy.spatial import cKDTree
-import json
+from pyproj import Transformer
+
+import grafo_compilado
+import motor_rutas
+import escenarios_trafico
+import trafico_tramos
+import contraccion_jerarquica
+import grafo_compacto
+import payload_red
+import teselas_red
+import isocronas
+import ajuste_aristas
+import cache_rutas
+import arboles_depositos
+import incidencias
+import metricas
 
 # -------------------------
 # Parámetros / archivos
@@ -13,17 +29,11 @@ GEOJSON_CALLES = "data/callesconzonas.geojson"
 CRS_PROJECTED = 25830   # ETRS89 / UTM zone 30N (m)
 
 # -------------------------
-# Carga y Validación
+# Validación
 # -------------------------
 if not os.path.exists(GEOJSON_CALLES):
     raise FileNotFoundError(f"❌ No encuentro {GEOJSON_CALLES}")
 
-print(f"🔄 Cargando red viaria exacta desde {GEOJSON_CALLES}...")
-gdf_edges = gpd.read_file(GEOJSON_CALLES)
-
-if gdf_edges.crs and gdf_edges.crs.to_epsg() != CRS_PROJECTED:
-    gdf_edges = gdf_edges.to_crs(epsg=CRS_PROJECTED)
-
 # -------------------------
 # Funciones de ayuda 
 # -------------------------
@@ -49,164 +59,862 @@ def interpret_oneway(val):
     if v == '-1': return '-1'
     return 'no'
 
-# Asegurar columna zona
-if 'zona' not in gdf_edges.columns:
-    gdf_edges['zona'] = 'Desconocida'
-else:
-    gdf_edges['zona'] = gdf_edges['zona'].astype(str).str.strip()
-
-gdf_edges['oneway_norm'] = gdf_edges['oneway'].apply(interpret_oneway)
-
-# -------------------------
-# Construcción del Grafo 
-# -------------------------
-G = nx.DiGraph()
-node_id_map = {} # Mapeo de coordenadas (x,y) -> ID entero
-
-def get_node_id(coord):
-    # Redondeamos para asegurar que puntos muy cercanos se unan (conectar calles)
-    key = (round(coord[0], 3), round(coord[1], 3))
-    if key not in node_id_map:
-        node_id_map[key] = len(node_id_map)
-        # Guardamos coords reales para luego recuperar geometría
-        G.add_node(node_id_map[key], x=coord[0], y=coord[1])
-    return node_id_map[key]
-
-print("⚙️ Construyendo grafo detallado segmento a segmento...")
-
-for idx, row in gdf_edges.iterrows():
-    geom = row.geometry
-    speed_kph = speed_for_row(row)
-    zona = row['zona']
-    
-    # 1. Analizar dirección
-    raw_oneway = row.get('oneway')
-    raw_junction = str(row.get('junction', '')).lower()
-    
-    # LÓGICA CORREGIDA:
-    # Si es rotonda, SIEMPRE es oneway 
-    if 'roundabout' in raw_junction:
-        oneway = 'yes'
-    else:
-        oneway = interpret_oneway(raw_oneway)
+# -------------------------
+# Carga de calles (perezosa)
+# -------------------------
+# Solo hace falta leer el GeoJSON con GeoPandas para compilar el grafo o
+# para servir la geometría completa; el routing trabaja sobre el artefacto.
+_gdf_edges = None
+
+def cargar_calles():
+    global _gdf_edges
+    if _gdf_edges is None:
+        import geopandas as gpd  # solo al compilar: no pesa en el arranque del servidor
+        print(f"🔄 Cargando red viaria exacta desde {GEOJSON_CALLES}...")
+        gdf = gpd.read_file(GEOJSON_CALLES)
+
+        if gdf.crs and gdf.crs.to_epsg() != CRS_PROJECTED:
+            gdf = gdf.to_crs(epsg=CRS_PROJECTED)
+
+        # Asegurar columna zona
+        if 'zona' not in gdf.columns:
+            gdf['zona'] = 'Desconocida'
+        else:
+            gdf['zona'] = gdf['zona'].astype(str).str.strip()
+
+        gdf['oneway_norm'] = gdf['oneway'].apply(interpret_oneway)
+        _gdf_edges = gdf
+    return _gdf_edges
+
+# -------------------------
+# Construcción vectorizada
+# -------------------------
+def _clave_redondeo(v):
+    """
+    ``round(v, 3)`` como entero (milímetros), vectorizado. Los casos a menos
+    de 1e-6 de un empate se resuelven con ``round`` de Python para unir
+    exactamente los mismos nodos que ``get_node_id``.
+    """
+    escalado = v * 1000.0
+    clave = np.rint(escalado)
+    for i in np.flatnonzero(np.abs(escalado - np.floor(escalado) - 0.5) < 1e-6):
+        clave[i] = round(round(float(v[i]), 3) * 1000)
+    return clave.astype(np.int64)
+
+def construir_aristas(gdf_edges):
+    """
+    Equivalente vectorizado del constructor original con ``iterrows`` (que se
+    conserva en ``tests/test_construccion.py``): misma topología, mismos
+    atributos y mismo orden de adyacencia, pero sin ``iterrows`` ni un
+    ``LineString`` por segmento. Devuelve una tabla de aristas (dict de arrays)
+    que se compila con ``grafo_compilado.compilar_desde_aristas``.
+    """
+    print("⚙️ Construyendo grafo detallado (vectorizado)...")
+    columnas = [c for c in ('maxspeed', 'highway') if c in gdf_edges.columns]
+    velocidad = np.array([speed_for_row(r) for r in gdf_edges[columnas].to_dict('records')], dtype=np.float64)
+    oneway = gdf_edges['oneway'].tolist() if 'oneway' in gdf_edges.columns else [None] * len(gdf_edges)
+    junction = gdf_edges['junction'].tolist() if 'junction' in gdf_edges.columns else [''] * len(gdf_edges)
+    # 1 = sentido de la geometría, -1 = contrario, 0 = doble sentido (las rotondas siempre oneway)
+    sentido = np.array([
+        1 if 'roundabout' in str(j).lower() else {'yes': 1, '-1': -1}.get(interpret_oneway(o), 0)
+        for o, j in zip(oneway, junction)
+    ], dtype=np.int8)
+    zona = np.asarray(gdf_edges['zona'].tolist(), dtype=object)
+    highway = np.asarray(gdf_edges['highway'].tolist() if 'highway' in gdf_edges.columns else [None] * len(gdf_edges),
+                         dtype=object)
+
+    # Todas las coordenadas en un único array; un segmento = dos puntos seguidos de la misma parte
+    partes, fila_parte = shapely.get_parts(np.asarray(gdf_edges.geometry.array), return_index=True)
+    coords, parte = shapely.get_coordinates(partes, return_index=True)
+    seg = np.flatnonzero(parte[1:] == parte[:-1])
+    fila = fila_parte[parte[seg]]
+
+    # Nodos: coordenadas redondeadas a mm, numeradas por orden de primera aparición
+    visitado = np.zeros(len(coords), dtype=bool)
+    visitado[seg] = visitado[seg + 1] = True
+    idx_vis = np.flatnonzero(visitado)
+    claves = np.column_stack([_clave_redondeo(coords[idx_vis, 0]), _clave_redondeo(coords[idx_vis, 1])])
+    _, primera, inversa = np.unique(claves, axis=0, return_index=True, return_inverse=True)
+    orden = np.argsort(primera)
+    rango = np.empty_like(orden)
+    rango[orden] = np.arange(len(orden))
+    nodo = np.full(len(coords), -1, dtype=np.int64)
+    nodo[idx_vis] = rango[inversa.ravel()]
+    node_xy = coords[idx_vis[primera[orden]]]
+
+    # Longitud y tiempo base de cada segmento
+    d = coords[seg + 1] - coords[seg]
+    longitud = np.sqrt(d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1])
+    tiempo = longitud / (velocidad[fila] / 3.6)
+
+    # Aristas dirigidas en el orden en que las añadía add_edge (doble sentido: u->v y luego v->u)
+    u, v, s_seg = nodo[seg], nodo[seg + 1], sentido[fila]
+    n_ev = np.where(s_seg == 0, 2, 1)
+    ev_seg = np.repeat(np.arange(len(seg)), n_ev)
+    segunda = np.zeros(len(ev_seg), dtype=bool)
+    segunda[np.cumsum(n_ev)[n_ev == 2] - 1] = True
+    invertida = (s_seg[ev_seg] == -1) | segunda
+    src = np.where(invertida, v[ev_seg], u[ev_seg])
+    dst = np.where(invertida, u[ev_seg], v[ev_seg])
+
+    # Aristas repetidas: posición de la primera inserción, atributos de la última
+    n = len(node_xy)
+    clave_arista = src * n + dst
+    unicas, primera_ev, inv_ev = np.unique(clave_arista, return_index=True, return_inverse=True)
+    ultima_ev = np.zeros(len(unicas), dtype=np.int64)
+    np.maximum.at(ultima_ev, inv_ev, np.arange(len(ev_seg)))
+    src_u = unicas // n
+    orden_csr = np.lexsort((primera_ev, src_u))
+    ultima = ev_seg[ultima_ev[orden_csr]]
 
-    # Manejar MultiLineStrings si las hubiera
-    lines = [geom] if geom.geom_type == 'LineString' else list(geom.geoms)
+    tabla = {
+        "node_x": node_xy[:, 0].copy(),
+        "node_y": node_xy[:, 1].copy(),
+        "edge_src": src_u[orden_csr],
+        "edge_dst": (unicas % n)[orden_csr],
+        "edge_len": longitud[ultima],
+        "edge_time": tiempo[ultima],
+        "edge_zona": zona[fila[ultima]],
+        "edge_highway": highway[fila[ultima]],
+    }
+    print(f"✅ Grafo cargado: {n} nodos, {len(unicas)} aristas.")
+    return tabla
+
+# -------------------------
+# Artefacto compilado (CSR memory-mapped)
+# -------------------------
+_G = None
 
-    for ls in lines:
-        coords = list(ls.coords)
-        # Iteramos segmento a segmento (Esto preserva las curvas)
-        for i in range(len(coords) - 1):
-            a, b = coords[i], coords[i+1]
-            u = get_node_id(a)
-            v = get_node_id(b)
+def obtener_red(forzar=False):
+    """
+    Abre el artefacto compilado de la red. Si no existe o el GeoJSON ha
+    cambiado (hash distinto), reconstruye el grafo y lo publica en disco.
+    """
+    source_hash = grafo_compilado.hash_fuente(GEOJSON_CALLES)
+    directorio = grafo_compilado.ruta_artefacto(source_hash)
+    if not forzar:
+        red_mm = grafo_compilado.cargar(directorio, source_hash)
+        if red_mm is not None:
+            return red_mm
+    elif os.path.isdir(directorio):
+        shutil.rmtree(directorio)
 
-            # Distancia y tiempo base de este pequeño segmento
-            seg_len = LineString([a, b]).length
-            seg_time = seg_len / (speed_kph / 3.6)
+    tabla = construir_aristas(cargar_calles())
+    grafo_compilado.guardar(grafo_compilado.compilar_desde_aristas(tabla, source_hash), directorio)
+    # Reabrimos desde disco para que el proceso use las páginas compartidas
+    return grafo_compilado.cargar(directorio, source_hash)
 
-            attr = {
-                'length_m': seg_len,
-                'travel_time_s': seg_time,
-                'zona': zona
-            }
+def obtener_grafo():
+    """DiGraph de NetworkX reconstruido desde el artefacto (solo si se pide)."""
+    global _G
+    if _G is None:
+        import networkx as nx
+        G = nx.DiGraph()
+        G.add_nodes_from(
+            (u, {'x': x, 'y': y})
+            for u, (x, y) in enumerate(zip(red.node_x.tolist(), red.node_y.tolist()))
+        )
+        zonas = red.zonas
+        G.add_edges_from(
+            (u, v, {'length_m': l, 'travel_time_s': t, 'zona': zonas[z], 'arista': e})
+            for e, (u, v, l, t, z) in enumerate(zip(red.edge_src.tolist(), red.edge_dst.tolist(),
+                                                    red.edge_len.tolist(), red.edge_time.tolist(),
+                                                    red.edge_zona.tolist()))
+        )
+        _G = G
+    return _G
 
-            if oneway == 'yes':
-                G.add_edge(u, v, **attr)
-            elif oneway == '-1':
-                G.add_edge(v, u, **attr)
-            else:
-                G.add_edge(u, v, **attr)
-                G.add_edge(v, u, **attr)
+def __getattr__(name):
+    # Compatibilidad: `G` y `gdf_edges` siguen accesibles como atributos del módulo
+    if name == 'G':
+        return obtener_grafo()
+    if name == 'gdf_edges':
+        return cargar_calles()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-print(f"✅ Grafo cargado: {len(G.nodes)} nodos, {len(G.edges)} aristas.")
+red = obtener_red()
+print(f"✅ Red compilada: {red.n_nodos} nodos, {red.n_aristas} aristas.")
 
 # -------------------------
 # KDTree (Búsqueda rápida)
 # -------------------------
-node_items = list(G.nodes(data=True))
-# Extraemos coordenadas (x, y) de los datos del nodo
-coords_list = np.array([[d['x'], d['y']] for _, d in node_items])
+coords_list = np.column_stack([red.node_x, red.node_y])
 kdtree = cKDTree(coords_list)
 
+# Motor de rutas sobre arrays (ver motor_rutas.MOTORES)
+MOTOR_RUTAS = os.environ.get("MOTOR_RUTAS", "compacto")
+motor_csr = motor_rutas.MotorRutas(red)
+
+# Factor de tráfico de cada arista: el de su zona ("zona") o el del modelo por tramo ("tramo")
+PESOS_TRAFICO = os.environ.get("PESOS_TRAFICO", "zona")
+tabla_tramos = trafico_tramos.cargar_tabla(red) if PESOS_TRAFICO == "tramo" else None
+
+# Vectores de pesos por escenario de tráfico (LRU)
+CACHE_ESCENARIOS = int(os.environ.get("CACHE_ESCENARIOS", 32))
+escenarios = escenarios_trafico.CacheEscenarios(red, motor_csr, max_entradas=CACHE_ESCENARIOS, tramos=tabla_tramos)
+
+# Predicciones nuevas por tramo (registro JSON compartido por los workers)
+TRAMOS_PATH = os.environ.get("TRAMOS_PATH", "data/tramos_actualizados.json")
+tramos_red = trafico_tramos.ActualizacionesTramos(TRAMOS_PATH, tabla_tramos, escenarios) \
+    if tabla_tramos is not None else None
+
+def actualizar_tramos(aristas, factores):
+    """
+    Nuevas predicciones para unos tramos: ``factores`` uno por arista o uno por
+    arista y nivel de zona. Llegan a todos los workers en menos de un segundo y
+    en cada uno se reescriben solo esas aristas en los escenarios ya
+    materializados, sin recompilar el grafo. Devuelve cuántas se publicaron.
+    """
+    if tramos_red is None:
+        raise ValueError("Los factores por tramo necesitan PESOS_TRAFICO=tramo y modelo_tramos.pkl")
+    return tramos_red.publicar(aristas, factores)
+
+# Caché de respuestas de /ruta (por worker, con capa Redis opcional)
+CACHE_RUTAS = int(os.environ.get("CACHE_RUTAS", 2048))
+CACHE_RUTAS_TTL = int(os.environ.get("CACHE_RUTAS_TTL", 3600))
+CACHE_RUTAS_MB = int(os.environ.get("CACHE_RUTAS_MB", 64))
+CACHE_RUTAS_REDIS = os.environ.get("CACHE_RUTAS_REDIS")
+CACHE_RUTAS_RESOLUCION_M = 1.0  # redondeo del punto ajustado en la clave
+VERSION_RED = os.path.basename(red.meta['directorio'])  # las claves caducan al recompilar el grafo
+cache_rutas_red = cache_rutas.CacheRutas(CACHE_RUTAS, ttl=CACHE_RUTAS_TTL, max_bytes=CACHE_RUTAS_MB * 1024 * 1024,
+                                         url_compartida=CACHE_RUTAS_REDIS)
+
+# Jerarquía CCH: se abre (o se construye) la primera vez que se usa el motor "ch"
+_jerarquia = None
+
+def obtener_jerarquia_cch():
+    global _jerarquia
+    if _jerarquia is None:
+        _jerarquia = contraccion_jerarquica.obtener_jerarquia(red)
+    return _jerarquia
+
+# Grafo compacto (cadenas de grado 2 colapsadas) para el motor "compacto"
+_compacto = None
+
+def obtener_grafo_compacto():
+    global _compacto
+    if _compacto is None:
+        _compacto = grafo_compacto.obtener_grafo_compacto(red)
+    return _compacto
+
+# Ajuste de los puntos de la petición: "arista" (proyección sobre el tramo más
+# cercano, la ruta empieza/termina a mitad de arista) o "nodo" (vértice más cercano)
+AJUSTE_RUTAS = os.environ.get("AJUSTE_RUTAS", "arista")
+AJUSTES = ("arista", "nodo")
+_indice_aristas = None
+
+def obtener_indice_aristas():
+    global _indice_aristas
+    if _indice_aristas is None:
+        _indice_aristas = ajuste_aristas.IndiceAristas(red)
+    return _indice_aristas
+
 def nearest_node_by_point(point_geom):
     _, idx = kdtree.query([point_geom.x, point_geom.y])
-    return node_items[idx][0]
+    return int(idx)
 
 # -------------------------
-# API: Rutas
+# Proyecciones (Transformer de pyproj creado una vez, sobre arrays)
+# -------------------------
+_a_utm = Transformer.from_crs(4326, CRS_PROJECTED, always_xy=True)
+_a_wgs84 = Transformer.from_crs(CRS_PROJECTED, 4326, always_xy=True)
+
+def a_utm(lons, lats):
+    """(lon, lat) WGS84 -> (x, y) UTM para arrays de cualquier tamaño."""
+    return _a_utm.transform(np.asarray(lons, dtype=float), np.asarray(lats, dtype=float))
+
+def a_wgs84(xs, ys):
+    """(x, y) UTM -> (lon, lat) WGS84 para arrays de cualquier tamaño."""
+    return _a_wgs84.transform(np.asarray(xs, dtype=float), np.asarray(ys, dtype=float))
+
+_nodos_wgs84 = None
+
+def nodos_wgs84():
+    """(lon, lat) de todos los nodos, calculados una vez."""
+    global _nodos_wgs84
+    if _nodos_wgs84 is None:
+        _nodos_wgs84 = np.column_stack(a_wgs84(red.node_x, red.node_y))
+    return _nodos_wgs84
+
+# Un punto más lejos que esto de la red (fuera de Móstoles) no se ajusta; 0 = sin límite
+MAX_DISTANCIA_AJUSTE_M = float(os.environ.get("MAX_DISTANCIA_AJUSTE_M", 1000))
+
+class PuntoFueraDeRed(ValueError):
+    """Punto demasiado lejos de la calle (o nodo) más cercana."""
+
+def _comprobar_distancia(distancia):
+    distancia = np.asarray(distancia)
+    # NaN no supera ninguna comparación: un punto sin coordenadas válidas también queda fuera
+    fuera = ~np.isfinite(distancia)
+    if MAX_DISTANCIA_AJUSTE_M > 0:
+        fuera |= distancia > MAX_DISTANCIA_AJUSTE_M
+    if fuera.any():
+        i = int(np.argmax(fuera))
+        if not np.isfinite(distancia[i]):
+            raise PuntoFueraDeRed(f"El punto {i} no tiene coordenadas válidas")
+        raise PuntoFueraDeRed(f"El punto {i} está a {distancia[i]:.0f} m de la red "
+                              f"(máximo {MAX_DISTANCIA_AJUSTE_M:g} m)")
+
+def ajustar_puntos(lats, lons):
+    """Tramo más cercano y proyección de cada punto (lat, lon), vectorizado."""
+    with metricas.etapa("reproyeccion"):
+        x, y = a_utm(lons, lats)
+    with metricas.etapa("ajuste"):
+        aj = obtener_indice_aristas().ajustar(x, y)
+    _comprobar_distancia(aj.distancia)
+    return aj
+
+def nodos_cercanos(lats, lons):
+    """Nodo más cercano a cada punto (lat, lon), vectorizado."""
+    with metricas.etapa("reproyeccion"):
+        x, y = a_utm(lons, lats)
+    with metricas.etapa("ajuste"):
+        distancia, idx = kdtree.query(np.column_stack([x, y]))
+    _comprobar_distancia(np.atleast_1d(distancia))
+    return np.asarray(idx, dtype=np.int64)
+
 # -------------------------
-def generar_ruta_geojson_coords(orig_lat, orig_lon, dest_lat, dest_lon, traffic_predictions=None):
-    # 1. Convertir Lat/Lon a UTM
-    p_orig = gpd.GeoSeries([Point(orig_lon, orig_lat)], crs="EPSG:4326").to_crs(epsg=CRS_PROJECTED).iloc[0]
-    p_dest = gpd.GeoSeries([Point(dest_lon, dest_lat)], crs="EPSG:4326").to_crs(epsg=CRS_PROJECTED).iloc[0]
+# Incidencias (cortes y retenciones en vivo)
+# -------------------------
+INCIDENCIAS_PATH = os.environ.get("INCIDENCIAS_PATH", "data/incidencias.json")
+incidencias_red = incidencias.GestorIncidencias(INCIDENCIAS_PATH, escenarios)
+
+def _a_utm_geometria(geom):
+    return shapely.transform(geom, lambda c: np.column_stack(a_utm(c[:, 0], c[:, 1])))
+
+def aristas_incidencia(aristas=None, bbox=None, poligono=None):
+    """
+    Aristas afectadas: ids explícitos, las de los tramos que tocan la caja
+    ``[min_lon, min_lat, max_lon, max_lat]`` y/o las del polígono (geometría
+    GeoJSON o lista de [lon, lat]). Se admiten varias a la vez.
+    """
+    res = [np.asarray(aristas if aristas is not None else [], dtype=np.int64)]
+    geometrias = []
+    if bbox is not None:
+        min_lon, min_lat, max_lon, max_lat = map(float, bbox)
+        geometrias.append(shapely.box(min_lon, min_lat, max_lon, max_lat))
+    if poligono is not None:
+        geometrias.append(shape(poligono) if isinstance(poligono, dict) else Polygon(poligono))
+    for geom in geometrias:
+        if not geom.is_valid or geom.is_empty:
+            raise ValueError("Geometría de la incidencia no válida")
+        res.append(obtener_indice_aristas().aristas_en(_a_utm_geometria(geom)))
+    return np.unique(np.concatenate(res))
+
+def registrar_incidencia(ident, tipo, factor=None, aristas=None, bbox=None, poligono=None, expira=None,
+                         descripcion=None):
+    """Alta de un corte o retención; llega a todos los workers en menos de un segundo."""
+    afectadas = aristas_incidencia(aristas, bbox, poligono)
+    return incidencias_red.registrar(ident, tipo, afectadas, factor=factor, expira=expira, descripcion=descripcion)
 
-    # 2. Buscar nodos más cercanos
-    origin_node = nearest_node_by_point(p_orig)
-    dest_node = nearest_node_by_point(p_dest)
+def _sincronizar_pesos():
+    """Aplica las actualizaciones de tramos e incidencias publicadas por otros procesos."""
+    if tramos_red is not None:
+        tramos_red.sincronizar()
+    incidencias_red.sincronizar()
 
-    # 3. Función de peso dinámica (lógica de tráfico)
+def _version_pesos():
+    """Parte de la clave de la caché de rutas que cambia con tramos e incidencias (igual en todos los procesos)."""
+    return f"{tramos_red.huella if tramos_red is not None else ''}.{incidencias_red.huella}"
+
+# -------------------------
+# Depósitos (árboles de caminos mínimos precalculados)
+# -------------------------
+def _arbol_deposito(lat, lon, escenario):
+    """Árbol completo de caminos mínimos desde el punto del depósito."""
+    if AJUSTE_RUTAS == "nodo":
+        salidas = {int(nodos_cercanos([lat], [lon])[0]): (0.0, 0.0)}
+    else:
+        aj = ajustar_puntos([lat], [lon])
+        pesos, edge_len = escenario.vista, red.edge_len
+        salidas = {n: (f * pesos[e], f * float(edge_len[e]))
+                   for n, e, f in obtener_indice_aristas().salidas(aj.tramo[0], aj.t[0])}
+    matriz = motor_rutas.con_origen_virtual(escenario.matriz, list(salidas), [t for t, _ in salidas.values()])
+    costes, arista_pred = motor_csr.arbol(matriz, red.n_nodos)
+    return arboles_depositos.construir_arbol(arista_pred, costes, salidas)
+
+def _clave_punto(lat, lon):
+    return _claves_puntos(_ajustar_extremos(lat, lon, lat, lon, AJUSTE_RUTAS), AJUSTE_RUTAS)[0]
+
+DEPOSITOS_PATH = os.environ.get("DEPOSITOS_PATH", "data/depositos.json")
+MAX_ARBOLES_DEPOSITOS = int(os.environ.get("MAX_ARBOLES_DEPOSITOS", 64))
+depositos = arboles_depositos.GestorDepositos(DEPOSITOS_PATH, _clave_punto, _arbol_deposito,
+                                              max_arboles=MAX_ARBOLES_DEPOSITOS)
+
+def _arbol_de_origen(clave_origen, extremos, traffic_predictions, ajuste):
+    """Árbol del depósito en el que está el origen, si ya está calculado."""
+    if ajuste != AJUSTE_RUTAS:
+        return None
+    if ajuste != "nodo" and extremos.tramo[0] == extremos.tramo[1]:
+        return None  # origen y destino en el mismo tramo: lo resuelve la búsqueda normal
+    ident = depositos.deposito_en(clave_origen)
+    if ident is None:
+        return None
+    return depositos.arbol(ident, escenarios.obtener(traffic_predictions))
+
+def registrar_deposito(ident, lat, lon, traffic_predictions=None):
+    """
+    Alta de un depósito. Sus árboles se calculan en segundo plano para el
+    escenario indicado y para los que ya están en la caché de escenarios.
+    """
+    _clave_punto(lat, lon)  # PuntoFueraDeRed antes de escribirlo en el registro
+    _sincronizar_pesos()
+    actual = escenarios.obtener(traffic_predictions)
+    return depositos.registrar(ident, lat, lon, [actual] + [e for e in escenarios.activos() if e is not actual])
+
+# -------------------------
+# API: Rutas
+# -------------------------
+def _ruta_networkx(origin_node, dest_node, traffic_predictions):
+    """Ruta con ``nx.dijkstra_path`` (motor de referencia)."""
+    import networkx as nx
+    G = obtener_grafo()
+    # Pesos del escenario por id de arista: el mismo tráfico (por zona o por
+    # tramo) e incidencias que el resto de motores
+    pesos = escenarios.obtener(traffic_predictions).vista
+
+    # Función de peso dinámica (lógica de tráfico)
     def dynamic_weight(u, v, d):
-        base = d.get('travel_time_s', 1)
-        zona_edge = d.get('zona', 'Desconocida')
-        factor = 1.0
-        
-        if traffic_predictions and zona_edge in traffic_predictions:
-            nivel = traffic_predictions[zona_edge]
-            if nivel == 1: factor = 1.5   # Medio
-            elif nivel == 2: factor = 3.0 # Alto
-            
-        return base * factor
+        return pesos[d['arista']]
 
     try:
         # Usamos Dijkstra con el peso dinámico
-        path = nx.dijkstra_path(G, origin_node, dest_node, weight=dynamic_weight)
+        with metricas.etapa("busqueda"):
+            path = nx.dijkstra_path(G, origin_node, dest_node, weight=dynamic_weight)
     except nx.NetworkXNoPath:
         return None
 
-    # 4. Reconstruir geometría y calcular totales
-    
-    path_coords = []
     total_len = 0
     total_time_real = 0
-    
-    # Recopilar coordenadas y datos
-    for i in range(len(path) - 1):
-        u = path[i]
-        v = path[i+1]
-        
-        # Coordenadas
-        # El nodo u ya tiene x,y guardados
-        path_coords.append((G.nodes[u]['x'], G.nodes[u]['y']))
-        
-        # Datos de arista
-        data = G[u][v]
-        total_len += data['length_m']
-        total_time_real += dynamic_weight(u, v, data)
-    
-    # Añadir el último punto
-    last = path[-1]
-    path_coords.append((G.nodes[last]['x'], G.nodes[last]['y']))
-
-    line = LineString(path_coords)
-    
-    # Convertir a WGS84 para el mapa web
-    gdf_route = gpd.GeoDataFrame(geometry=[line], crs=CRS_PROJECTED).to_crs(epsg=4326)
-    geo_dict = json.loads(gdf_route.to_json())
-    
-    # Solo Km y Minutos 
-    
-    geo_dict['features'][0]['properties'] = {
-        "length_m": round(total_len, 2),
-        "time_s": round(total_time_real, 2),
-        "traffic_impact": "Calculado" # Placeholder, en el front ya no lo muestras
-    }
-    
-    return geo_dict
+    with metricas.etapa("reconstruccion"):
+        for i in range(len(path) - 1):
+            data = G[path[i]][path[i+1]]
+            total_len += data['length_m']
+            total_time_real += dynamic_weight(path[i], path[i+1], data)
+    return path, total_len, total_time_real
+
+def _personalizacion(escenario, motor):
+    """Estructura del motor (``ch`` o ``compacto``) y su personalización para el escenario."""
+    # Si se actualizan tramos a mitad de la personalización no se guarda (estaría a medias)
+    revision = escenario.revision
+    if motor == "ch":
+        jerarquia = obtener_jerarquia_cch()
+        pers = escenario.cch
+        if pers is None:
+            with metricas.etapa("personalizacion"):
+                pers = jerarquia.personalizar(escenario.pesos)
+            if escenario.revision == revision:
+                escenario.cch = pers
+        return jerarquia, pers
+    compacto = obtener_grafo_compacto()
+    pers = escenario.compacto
+    if pers is None:
+        with metricas.etapa("personalizacion"):
+            pers = compacto.personalizar(escenario.pesos)
+        if escenario.revision == revision:
+            escenario.compacto = pers
+    return compacto, pers
+
+def _totales(aristas, escenario):
+    # Mismo orden de suma que el motor de referencia -> mismos totales
+    edge_len, pesos = red.edge_len, escenario.vista
+    total_len = 0
+    total_time_real = 0
+    for e in aristas:
+        total_len += float(edge_len[e])
+        total_time_real += pesos[e]
+    return total_len, total_time_real
+
+def _ruta_arrays(origin_node, dest_node, traffic_predictions, motor):
+    """Ruta con el motor CSR (``csgraph``, ``dijkstra``, ``bidireccional``, ``ch`` o ``compacto``)."""
+    escenario = escenarios.obtener(traffic_predictions)
+    stats = metricas.stats_busqueda()
+    if motor in ("ch", "compacto"):
+        estructura, pers = _personalizacion(escenario, motor)
+        with metricas.etapa("busqueda"):
+            res = estructura.consulta(origin_node, dest_node, pers, stats=stats)
+    else:
+        with metricas.etapa("busqueda"):
+            res = motor_csr.ruta(origin_node, dest_node, escenario.vista, motor=motor, matriz=escenario.matriz,
+                                 stats=stats)
+    metricas.asentados(stats)
+    if res is None:
+        return None
+    path, aristas = res
+    with metricas.etapa("reconstruccion"):
+        return (path,) + _totales(aristas, escenario)
+
+def _ruta_nodos(origin_node, dest_node, traffic_predictions, motor):
+    if motor == "networkx":
+        return _ruta_networkx(origin_node, dest_node, traffic_predictions)
+    return _ruta_arrays(origin_node, dest_node, traffic_predictions, motor)
+
+def _ruta_ajustada(ajuste, traffic_predictions, motor):
+    """
+    Ruta entre los puntos 0 (origen) y 1 (destino) de ``ajuste`` que empieza y
+    termina a mitad de tramo, con costes parciales. Devuelve
+    ``(nodos, longitud, tiempo)`` o None; ``nodos`` está vacío si se va
+    directamente por el mismo tramo.
+    """
+    indice = obtener_indice_aristas()
+    escenario = escenarios.obtener(traffic_predictions)
+    pesos, edge_len = escenario.vista, red.edge_len
+    # (nodo, tiempo, longitud) del trozo de tramo entre el punto y cada extremo
+    salidas = [(n, f * pesos[e], f * float(edge_len[e]))
+               for n, e, f in indice.salidas(ajuste.tramo[0], ajuste.t[0])]
+    llegadas = [(n, f * pesos[e], f * float(edge_len[e]))
+                for n, e, f in indice.llegadas(ajuste.tramo[1], ajuste.t[1])]
+
+    mejor = None
+    directo = indice.directo(ajuste.tramo[0], ajuste.t[0], ajuste.tramo[1], ajuste.t[1])
+    if directo is not None:
+        e, f = directo
+        mejor = ([], f * float(edge_len[e]), f * pesos[e])
+
+    if motor == "compacto":
+        # Todas las combinaciones de extremos en una sola búsqueda
+        compacto, pers = _personalizacion(escenario, motor)
+        stats = metricas.stats_busqueda()
+        with metricas.etapa("busqueda"):
+            res = compacto.consulta_multi([(n, t) for n, t, _ in salidas], [(n, t) for n, t, _ in llegadas], pers,
+                                          stats=stats)
+        metricas.asentados(stats)
+        candidatos = []
+        if res is not None:
+            i, j, path, aristas = res
+            with metricas.etapa("reconstruccion"):
+                candidatos.append((i, j, (path,) + _totales(aristas, escenario)))
+    else:
+        candidatos = [(i, j, _ruta_nodos(so[0], ll[0], traffic_predictions, motor))
+                      for i, so in enumerate(salidas) for j, ll in enumerate(llegadas)]
+
+    for i, j, res in candidatos:
+        if res is None:
+            continue
+        path, total_len, total_time = res
+        total_len = salidas[i][2] + total_len + llegadas[j][2]
+        total_time = salidas[i][1] + total_time + llegadas[j][1]
+        if mejor is None or total_time < mejor[2]:
+            mejor = (path, total_len, total_time)
+    return mejor
+
+def _opciones_ruta(motor, ajuste):
+    motor = motor or MOTOR_RUTAS
+    ajuste = ajuste or AJUSTE_RUTAS
+    if motor not in motor_rutas.MOTORES:
+        raise ValueError(f"Motor de rutas desconocido: {motor}")
+    if ajuste not in AJUSTES:
+        raise ValueError(f"Ajuste de puntos desconocido: {ajuste}")
+    return motor, ajuste
+
+def _ajustar_extremos(orig_lat, orig_lon, dest_lat, dest_lon, ajuste):
+    """Nodos (``nodo``) o proyecciones sobre el tramo (``arista``) de origen y destino."""
+    if ajuste == "nodo":
+        # Lat/Lon -> UTM y nodos más cercanos (una sola transformación)
+        return tuple(int(n) for n in nodos_cercanos([orig_lat, dest_lat], [orig_lon, dest_lon]))
+    return ajustar_puntos([orig_lat, dest_lat], [orig_lon, dest_lon])
+
+def _claves_puntos(extremos, ajuste):
+    """Clave de cada extremo ajustado (caché de rutas y depósitos)."""
+    if ajuste == "nodo":
+        return [str(n) for n in extremos]
+    # Tramo + punto proyectado redondeado: clics que caen en el mismo sitio comparten clave
+    xs = np.rint(extremos.x / CACHE_RUTAS_RESOLUCION_M).astype(np.int64)
+    ys = np.rint(extremos.y / CACHE_RUTAS_RESOLUCION_M).astype(np.int64)
+    return [f"{t}:{x}:{y}" for t, x, y in zip(extremos.tramo, xs, ys)]
+
+def _ruta_arbol(arbol, extremos, escenario, ajuste):
+    """Ruta desde un depósito recorriendo su árbol precalculado (sin búsqueda)."""
+    pesos, edge_len = escenario.vista, red.edge_len
+    if ajuste == "nodo":
+        llegadas = [(extremos[1], 0.0, 0.0)]
+    else:
+        llegadas = [(n, f * pesos[e], f * float(edge_len[e]))
+                    for n, e, f in obtener_indice_aristas().llegadas(extremos.tramo[1], extremos.t[1])]
+    destino, t_fin, l_fin = min(llegadas, key=lambda ll: float(arbol.coste[ll[0]]) + ll[1])
+    with metricas.etapa("reconstruccion"):
+        res = arbol.camino(destino, red.edge_src)
+        if res is None:
+            return None
+        salida, aristas = res
+        t_ini, l_ini = arbol.salidas[salida]
+        total_len, total_time_real = _totales(aristas, escenario)
+        path = [salida] + [int(red.edge_dst[e]) for e in aristas]
+    return path, l_ini + total_len + l_fin, t_ini + total_time_real + t_fin
+
+def _camino(extremos, traffic_predictions, motor, ajuste, arbol=None):
+    """Coordenadas UTM de la ruta, longitud y tiempo: ``(xs, ys, total_len, total_time)`` o None."""
+    if arbol is not None:
+        # Salida desde un depósito: recorrido de predecesores
+        res = _ruta_arbol(arbol, extremos, escenarios.obtener(traffic_predictions), ajuste)
+        if res is None:
+            return None
+        path, total_len, total_time_real = res
+        with metricas.etapa("reconstruccion"):
+            idx = np.asarray(path, dtype=np.int64)
+            xs, ys = red.node_x[idx], red.node_y[idx]
+            if ajuste != "nodo":
+                xs = np.concatenate([extremos.x[:1], xs, extremos.x[1:]])
+                ys = np.concatenate([extremos.y[:1], ys, extremos.y[1:]])
+    elif ajuste == "nodo":
+        # Camino mínimo con pesos de tráfico
+        res = _ruta_nodos(extremos[0], extremos[1], traffic_predictions, motor)
+        if res is None:
+            return None
+        path, total_len, total_time_real = res
+        with metricas.etapa("reconstruccion"):
+            idx = np.asarray(path, dtype=np.int64)
+            xs, ys = red.node_x[idx], red.node_y[idx]
+    else:
+        # Camino mínimo desde/hasta mitad de tramo
+        res = _ruta_ajustada(extremos, traffic_predictions, motor)
+        if res is None:
+            return None
+        path, total_len, total_time_real = res
+        with metricas.etapa("reconstruccion"):
+            idx = np.asarray(path, dtype=np.int64)
+            xs = np.concatenate([extremos.x[:1], red.node_x[idx], extremos.x[1:]])
+            ys = np.concatenate([extremos.y[:1], red.node_y[idx], extremos.y[1:]])
+    if total_time_real >= escenarios_trafico.CORTE_S:
+        return None  # solo se llega atravesando un corte
+    return xs, ys, total_len, total_time_real
+
+def _geojson(xs, ys, total_len, total_time_real):
+    # Geometría en WGS84 directamente desde las coordenadas
+    with metricas.etapa("reproyeccion"):
+        lons, lats = a_wgs84(xs, ys)
+
+    with metricas.etapa("serializacion"):
+        return {
+            "type": "FeatureCollection",
+            "features": [{
+                "id": "0",
+                "type": "Feature",
+                "properties": {
+                    "length_m": round(total_len, 2),
+                    "time_s": round(total_time_real, 2),
+                    "traffic_impact": "Calculado" # Placeholder, en el front ya no lo muestras
+                },
+                "geometry": {
+                    "type": "LineString",
+                    "coordinates": np.column_stack([lons, lats]).tolist(),
+                },
+            }],
+        }
+
+def _ruta_geojson(extremos, traffic_predictions, motor, ajuste, arbol=None):
+    camino = _camino(extremos, traffic_predictions, motor, ajuste, arbol)
+    return None if camino is None else _geojson(*camino)
+
+def generar_ruta_geojson_coords(orig_lat, orig_lon, dest_lat, dest_lon, traffic_predictions=None, motor=None,
+                                ajuste=None):
+    _sincronizar_pesos()
+    motor, ajuste = _opciones_ruta(motor, ajuste)
+    # 1-2. Ajuste de origen y destino a la red
+    extremos = _ajustar_extremos(orig_lat, orig_lon, dest_lat, dest_lon, ajuste)
+    # 3-4. Camino mínimo y GeoJSON
+    return _ruta_geojson(extremos, traffic_predictions, motor, ajuste)
+
+def ruta_geojson_bytes(orig_lat, orig_lon, dest_lat, dest_lon, traffic_predictions=None, motor=None, ajuste=None):
+    """
+    Respuesta de ``/ruta`` ya serializada (bytes) o None si no hay camino.
+    Pasa por la caché de rutas con clave (extremos ajustados, escenario).
+    """
+    _sincronizar_pesos()
+    motor, ajuste = _opciones_ruta(motor, ajuste)
+    extremos = _ajustar_extremos(orig_lat, orig_lon, dest_lat, dest_lon, ajuste)
+    claves = _claves_puntos(extremos, ajuste)
+    clave = "|".join([VERSION_RED, ajuste, motor] + claves +
+                     [",".join(map(str, escenarios.clave(traffic_predictions))), _version_pesos()])
+    datos = cache_rutas_red.obtener(clave)
+    if datos is None:
+        geojson = _ruta_geojson(extremos, traffic_predictions, motor, ajuste,
+                                arbol=_arbol_de_origen(claves[0], extremos, traffic_predictions, ajuste))
+        # Sin camino se guarda como b"" para no repetir la búsqueda
+        with metricas.etapa("serializacion"):
+            datos = b"" if geojson is None else json.dumps(geojson).encode("utf-8")
+        cache_rutas_red.guardar(clave, datos)
+    return datos or None
+
+def _extremos_ajustados(ajuste, llegada, escenario):
+    """
+    Para cada punto ajustado, hasta dos nodos extremo de su tramo con el tiempo
+    y la longitud parciales hasta (``llegada=False``) o desde el punto.
+    Devuelve arrays ``(nodos, tiempos, longitudes)`` de forma (n, 2); los
+    huecos de los sentidos únicos tienen nodo 0 y tiempo ``inf``.
+    """
+    indice = obtener_indice_aristas()
+    pesos, edge_len = escenario.vista, red.edge_len
+    n = len(ajuste)
+    nodos = np.zeros((n, 2), dtype=np.int64)
+    tiempos = np.full((n, 2), np.inf)
+    longitudes = np.zeros((n, 2))
+    extremos = indice.llegadas if llegada else indice.salidas
+    for i in range(n):
+        for k, (nodo, e, f) in enumerate(extremos(ajuste.tramo[i], ajuste.t[i])):
+            nodos[i, k] = nodo
+            tiempos[i, k] = f * pesos[e]
+            longitudes[i, k] = f * float(edge_len[e])
+    return nodos, tiempos, longitudes
+
+def matriz_rutas(origenes, destinos, traffic_predictions=None, ajuste=None):
+    """
+    Matriz de tiempos (s) y distancias (m) entre listas de puntos (lat, lon).
+    Usa una búsqueda uno-a-muchos por origen (o por destino) en vez de una
+    ruta por par. Devuelve ``(tiempos, distancias)``; ``inf`` si no hay camino.
+    """
+    ajuste = ajuste or AJUSTE_RUTAS
+    if ajuste not in AJUSTES:
+        raise ValueError(f"Ajuste de puntos desconocido: {ajuste}")
+    origenes = np.asarray(origenes, dtype=float).reshape(-1, 2)
+    destinos = np.asarray(destinos, dtype=float).reshape(-1, 2)
+    _sincronizar_pesos()
+    escenario = escenarios.obtener(traffic_predictions)
+    if ajuste == "nodo":
+        nodos_o = nodos_cercanos(origenes[:, 0], origenes[:, 1])
+        nodos_d = nodos_cercanos(destinos[:, 0], destinos[:, 1])
+        return _sin_cortes(*motor_csr.matriz_costes(nodos_o, nodos_d, escenario.matriz, longitudes=red.edge_len,
+                                                    matriz_inversa=escenario.inversa))
+
+    # Ajuste a arista: una búsqueda por nodo extremo distinto y combinación
+    # vectorizada de los 2 x 2 extremos de cada par con sus costes parciales
+    aj_o = ajustar_puntos(origenes[:, 0], origenes[:, 1])
+    aj_d = ajustar_puntos(destinos[:, 0], destinos[:, 1])
+    nodos_o, t_o, l_o = _extremos_ajustados(aj_o, False, escenario)
+    nodos_d, t_d, l_d = _extremos_ajustados(aj_d, True, escenario)
+    unicos_o, idx_o = np.unique(nodos_o, return_inverse=True)
+    unicos_d, idx_d = np.unique(nodos_d, return_inverse=True)
+    tiempos, distancias = motor_csr.matriz_costes(unicos_o, unicos_d, escenario.matriz, longitudes=red.edge_len,
+                                                  matriz_inversa=escenario.inversa)
+    idx_o, idx_d = idx_o.reshape(nodos_o.shape), idx_d.reshape(nodos_d.shape)
+
+    # (O, 2, D, 2): origen, extremo de salida, destino, extremo de llegada
+    total = t_o[:, :, None, None] + tiempos[idx_o[:, :, None, None], idx_d[None, None, :, :]] + t_d[None, None, :, :]
+    n_o, n_d = len(origenes), len(destinos)
+    total = total.transpose(0, 2, 1, 3).reshape(n_o, n_d, 4)
+    mejor = np.argmin(total, axis=2)
+    ko, kd = mejor // 2, mejor % 2
+    filas, columnas = np.indices((n_o, n_d))
+    t_res = np.take_along_axis(total, mejor[:, :, None], axis=2)[:, :, 0]
+    l_res = (l_o[filas, ko] + distancias[idx_o[filas, ko], idx_d[columnas, kd]] + l_d[columnas, kd])
+    l_res[np.isinf(t_res)] = np.inf
+
+    # Origen y destino en el mismo tramo: puede bastar con recorrerlo
+    indice = obtener_indice_aristas()
+    for i, j in zip(*np.nonzero(aj_o.tramo[:, None] == aj_d.tramo[None, :])):
+        directo = indice.directo(aj_o.tramo[i], aj_o.t[i], aj_d.tramo[j], aj_d.t[j])
+        if directo is not None:
+            e, f = directo
+            if f * escenario.vista[e] < t_res[i, j]:
+                t_res[i, j] = f * escenario.vista[e]
+                l_res[i, j] = f * float(red.edge_len[e])
+    return _sin_cortes(t_res, l_res)
+
+def _sin_cortes(tiempos, distancias):
+    # Los pares que solo se unen atravesando un corte no tienen camino
+    cortados = tiempos >= escenarios_trafico.CORTE_S
+    tiempos[cortados] = distancias[cortados] = np.inf
+    return tiempos, distancias
+
+def isocronas_geojson(fuentes, minutos, traffic_predictions=None, incluir_calles=True, ajuste=None):
+    """
+    Isocronas desde uno o varios puntos (lat, lon) para cada umbral en minutos,
+    con una sola búsqueda multi-fuente. Devuelve un FeatureCollection con un
+    polígono por umbral y, opcionalmente, las calles alcanzadas en cada franja.
+    """
+    ajuste = ajuste or AJUSTE_RUTAS
+    if ajuste not in AJUSTES:
+        raise ValueError(f"Ajuste de puntos desconocido: {ajuste}")
+    fuentes = np.asarray(fuentes, dtype=float).reshape(-1, 2)
+    _sincronizar_pesos()
+    escenario = escenarios.obtener(traffic_predictions)
+    umbrales = [m * 60 for m in minutos]
+    if ajuste == "nodo":
+        nodos = nodos_cercanos(fuentes[:, 0], fuentes[:, 1])
+        resultado = isocronas.calcular(red, escenario.matriz, escenario.pesos, nodos, umbrales)
+    else:
+        # Cada fuente sale desde mitad de tramo hacia sus extremos con el tiempo parcial
+        nodos, tiempos, _ = _extremos_ajustados(ajustar_puntos(fuentes[:, 0], fuentes[:, 1]), False, escenario)
+        validos = np.isfinite(tiempos)
+        resultado = isocronas.calcular(red, escenario.matriz, escenario.pesos, nodos[validos], umbrales,
+                                       costes=tiempos[validos])
+
+    def coords_wgs84(coords):
+        return np.round(np.column_stack(a_wgs84(coords[:, 0], coords[:, 1])), 6)
+
+    features = []
+    anteriores = np.empty(0, dtype=np.int64)
+    lonlat = np.round(nodos_wgs84(), 6)
+    for umbral, aristas, poligono in resultado:
+        # Franja sin ninguna arista completa: "geometry": null (un Polygon sin coordenadas no es GeoJSON válido)
+        features.append({
+            "type": "Feature",
+            "geometry": None if poligono.is_empty else mapping(shapely.transform(poligono, coords_wgs84)),
+            "properties": {"kind": "isochrone", "minutes": round(umbral / 60, 2), "edges": int(len(aristas))},
+        })
+        if incluir_calles:
+            # Solo las calles nuevas de esta franja (las anteriores ya están)
+            nuevas = np.setdiff1d(aristas, anteriores, assume_unique=True)
+            tramos = np.stack([lonlat[red.edge_src[nuevas]], lonlat[red.edge_dst[nuevas]]], axis=1)
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "MultiLineString", "coordinates": tramos.tolist()} if len(nuevas) else None,
+                "properties": {"kind": "streets", "minutes": round(umbral / 60, 2), "edges": int(len(nuevas))},
+            })
+            anteriores = aristas
+    return {"type": "FeatureCollection", "features": features}
 
 def get_network_wgs84():
     """Devuelve la red para pintar en Cesium"""
-    gdf_wgs84 = gdf_edges.to_crs(epsg=4326)
+    gdf_wgs84 = cargar_calles().to_crs(epsg=4326)
     cols = ['geometry', 'zona', 'name', 'highway'] 
     valid_cols = [c for c in cols if c in gdf_wgs84.columns]
     return gdf_wgs84[valid_cols].to_json()
+
+_payload_red = None
+
+def obtener_payload_red():
+    """Red WGS84 ya serializada y comprimida (una vez por versión del grafo)."""
+    global _payload_red
+    if _payload_red is None:
+        _payload_red = payload_red.obtener(red.meta['directorio'], get_network_wgs84)
+    return _payload_red
+
+_teselas = None
+
+def obtener_teselas():
+    """Índice de teselas vectoriales de la red (caché en disco junto al artefacto)."""
+    global _teselas
+    if _teselas is None:
+        _teselas = teselas_red.IndiceTeselas(
+            cargar_calles().to_crs(epsg=4326),
+            os.path.join(red.meta['directorio'], teselas_red.SUBDIR),
+        )
+    return _teselas
+
+# -------------------------
+# Precarga (proceso maestro, antes del fork de Gunicorn)
+# -------------------------
+def precargar(teselas=True):
+    """
+    Construye de una vez lo que las peticiones crean de forma perezosa para que
+    los workers lo hereden por fork en lugar de construirlo cada uno: índices
+    espaciales, grafo compacto o CCH del motor, escenario sin tráfico con su
+    personalización, payload de la red e índice de teselas. Son arrays NumPy y
+    bytes que los workers solo leen, así que sus páginas siguen compartidas.
+    """
+    nodos_wgs84()
+    obtener_indice_aristas()
+    motor_csr.aristas(red.edge_src[:1], red.edge_dst[:1])  # claves ordenadas de aristas
+    escenario = escenarios.obtener(None)
+    escenario.inversa
+    if MOTOR_RUTAS in ("ch", "compacto"):
+        _personalizacion(escenario, MOTOR_RUTAS)
+    elif MOTOR_RUTAS == "networkx":
+        # dict-of-dicts de Python: los contadores de referencias lo copian en cada worker
+        obtener_grafo()
+    payload = obtener_payload_red()
+    for codificacion in payload.codificaciones():
+        payload.contenido(codificacion)
+    if teselas:
+        obtener_teselas()
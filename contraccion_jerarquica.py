@@ -0,0 +1,397 @@
+"""
+Customizable Contraction Hierarchies (CCH) sobre la red compilada.
+
+El preprocesado se divide en dos fases:
+
+1. Métrica-independiente (offline, una vez por versión del grafo): orden de
+   nodos por disección anidada geométrica, contracción simbólica (grafo
+   cordal con todos los atajos posibles) y lista de triángulos inferiores.
+   Se guarda junto al artefacto en ``<artefacto>/cch`` y se abre con mmap.
+2. Personalización (por escenario de tráfico): a partir del vector de pesos
+   por arista se calculan los pesos de subida/bajada de cada atajo recorriendo
+   los triángulos por niveles con operaciones NumPy vectorizadas. Es barata,
+   así que re-pesar tras una predicción no requiere rehacer la jerarquía.
+
+La consulta recorre los ancestros de origen y destino en el árbol de
+eliminación (sin heap) y desempaqueta los atajos a aristas originales.
+
+Uso como paso de build:
+
+    python contraccion_jerarquica.py [--forzar]
+"""
+import os
+import shutil
+
+import numpy as np
+
+import grafo_compilado
+
+CCH_VERSION = 1
+SUBDIR = "cch"
+TAM_CELDA = 16  # tamaño máximo de celda en la disección anidada
+
+ARRAYS_CCH = (
+    "rango",       # rango de cada nodo (0 = se contrae primero)
+    "padre",       # padre en el árbol de eliminación (-1 = raíz)
+    "up_indptr",   # CSR de aristas hacia nodos de mayor rango
+    "up_dst",
+    "orig_fwd",    # arista original lower->upper (-1 si no existe)
+    "orig_bwd",    # arista original upper->lower (-1 si no existe)
+    "tri_xy",      # triángulos inferiores (x < y < z) agrupados por nivel de x
+    "tri_xz",
+    "tri_yz",
+    "nivel_ptr",   # triángulos del nivel k en [nivel_ptr[k], nivel_ptr[k+1])
+    "tri_por_arista_ptr",  # triángulos por arista superior yz (para desempaquetar)
+    "tri_por_arista",
+)
+
+
+# -------------------------
+# Orden de nodos (disección anidada)
+# -------------------------
+def _aristas_no_dirigidas(red):
+    a = np.asarray(red.edge_src, dtype=np.int64)
+    b = np.asarray(red.edge_dst, dtype=np.int64)
+    m = a != b
+    lo, hi = np.minimum(a[m], b[m]), np.maximum(a[m], b[m])
+    pares = np.unique(lo * red.n_nodos + hi)
+    return pares // red.n_nodos, pares % red.n_nodos
+
+
+def orden_disseccion(x, y, ea, eb, tam_celda=TAM_CELDA):
+    """
+    Orden por disección anidada geométrica: se parte por la mediana del eje
+    más largo y los extremos de las aristas cortadas forman el separador, que
+    recibe los rangos más altos. Devuelve los nodos en orden de contracción.
+    """
+    n = len(x)
+    lado = np.zeros(n, dtype=np.int8)
+    # Recorrido iterativo con pila: (nodos, aristas internas, es_separador)
+    pila = [(np.arange(n), ea, eb, False)]
+    salida = []
+    while pila:
+        nodos, a, b, es_sep = pila.pop()
+        if es_sep or len(nodos) <= tam_celda:
+            salida.append(nodos)
+            continue
+        xs, ys = x[nodos], y[nodos]
+        coord = xs if np.ptp(xs) >= np.ptp(ys) else ys
+        lado[nodos] = np.where(coord <= np.median(coord), 1, 2)
+        if (lado[nodos] == 1).all():
+            # Todos en la mediana: no se puede partir más
+            lado[nodos] = 0
+            salida.append(nodos)
+            continue
+        cruza = lado[a] != lado[b]
+        # Separador: extremos de las aristas cortadas en el lado con menos nodos frontera
+        a1 = lado[a[cruza]] == 1
+        fa = np.unique(np.where(a1, a[cruza], b[cruza]))
+        fb = np.unique(np.where(a1, b[cruza], a[cruza]))
+        sep = fa if len(fa) <= len(fb) else fb
+        lado[sep] = 3
+        partes = []
+        for k in (1, 2):
+            m = (lado[a] == k) & (lado[b] == k)
+            partes.append((nodos[lado[nodos] == k], a[m], b[m], False))
+        lado[nodos] = 0
+        # LIFO: el separador se apila primero para emitirse después de ambas partes
+        pila.append((sep, None, None, True))
+        pila.append(partes[1])
+        pila.append(partes[0])
+    bloques = [s for s in salida if len(s)]
+    return np.concatenate(bloques) if bloques else np.arange(0)
+
+
+# -------------------------
+# Jerarquía
+# -------------------------
+class JerarquiaCCH:
+    """Jerarquía métrica-independiente + consultas sobre pesos personalizados."""
+
+    def __init__(self, red, arrays):
+        self.red = red
+        for nombre in ARRAYS_CCH:
+            setattr(self, nombre, arrays[nombre])
+        self.n_aristas = len(self.up_dst)
+        self._indptr = memoryview(np.ascontiguousarray(self.up_indptr))
+        self._up_dst = np.asarray(self.up_dst, dtype=np.intp)
+        self._up_src = memoryview(np.repeat(np.arange(len(self.padre), dtype=np.int32),
+                                            np.diff(self.up_indptr)))
+        self._padre = memoryview(np.ascontiguousarray(self.padre))
+        self._rango = memoryview(np.ascontiguousarray(self.rango))
+        self._orig = (memoryview(np.ascontiguousarray(self.orig_bwd)),
+                      memoryview(np.ascontiguousarray(self.orig_fwd)))
+        self._tri = tuple(memoryview(np.ascontiguousarray(a)) for a in
+                          (self.tri_xy, self.tri_xz, self.tri_por_arista_ptr, self.tri_por_arista))
+
+    # --- Personalización ---------------------------------------------------
+    def personalizar(self, pesos):
+        """Pesos (subida, bajada) de cada arista de la jerarquía para un escenario."""
+        pesos = np.asarray(pesos, dtype=np.float64)
+        inf = np.inf
+        fwd = np.where(self.orig_fwd >= 0, pesos[np.maximum(self.orig_fwd, 0)], inf)
+        bwd = np.where(self.orig_bwd >= 0, pesos[np.maximum(self.orig_bwd, 0)], inf)
+        ptr = self.nivel_ptr
+        for k in range(len(ptr) - 1):
+            i, j = ptr[k], ptr[k + 1]
+            xy, xz, yz = self.tri_xy[i:j], self.tri_xz[i:j], self.tri_yz[i:j]
+            # y->z = y->x + x->z ; z->y = z->x + x->y
+            np.minimum.at(fwd, yz, bwd[xy] + fwd[xz])
+            np.minimum.at(bwd, yz, bwd[xz] + fwd[xy])
+        return PersonalizacionCCH(fwd, bwd, pesos)
+
+    # --- Consulta ----------------------------------------------------------
+    def _ancestros(self, v):
+        padre = self._padre
+        out = []
+        while v >= 0:
+            out.append(v)
+            v = padre[v]
+        return out
+
+    def consulta(self, origen, destino, pers, stats=None):
+        """Devuelve ``(nodos, aristas)`` en la red original o None si no hay camino."""
+        if origen == destino:
+            return [origen], []
+        n = self.red.n_nodos
+        indptr, rango, up_dst = self._indptr, self._rango, self._up_dst
+        inf = np.inf
+        anc_f, anc_b = self._ancestros(origen), self._ancestros(destino)
+        df, db = np.full(n, inf), np.full(n, inf)
+        pf, pb = np.full(n, -1, dtype=np.int64), np.full(n, -1, dtype=np.int64)
+        df[origen] = 0.0
+        db[destino] = 0.0
+        mejor, encuentro = inf, None
+        settled = 0
+
+        # Ambos caminos de ancestros suben en rango: se recorren a la vez, se
+        # poda todo nodo que ya no mejora la mejor distancia conocida y las
+        # aristas hacia arriba de cada nodo se relajan en bloque con NumPy.
+        i = j = 0
+        while i < len(anc_f) or j < len(anc_b):
+            rf = rango[anc_f[i]] if i < len(anc_f) else inf
+            rb = rango[anc_b[j]] if j < len(anc_b) else inf
+            v = anc_f[i] if rf <= rb else anc_b[j]
+            lados = []
+            if rf <= rb:
+                lados.append((df, pf, pers.fwd))
+                i += 1
+            if rb <= rf:
+                lados.append((db, pb, pers.bwd))
+                j += 1
+            a, b = indptr[v], indptr[v + 1]
+            for dist, pred, w in lados:
+                dv = dist[v]
+                if dv >= mejor:
+                    continue
+                settled += 1
+                if a == b:
+                    continue
+                cand = dv + w[a:b]
+                dst = up_dst[a:b]
+                m = cand < dist[dst]
+                if m.any():
+                    dist[dst[m]] = cand[m]
+                    pred[dst[m]] = np.arange(a, b)[m]
+            if len(lados) == 2 and df[v] + db[v] < mejor:
+                mejor, encuentro = df[v] + db[v], v
+        if stats is not None:
+            stats["settled"] = settled
+        if encuentro is None:
+            return None
+
+        # Tramos de la jerarquía: subida desde origen y bajada hasta destino
+        up_src = self._up_src
+        aristas = []
+        tramo = []
+        v = encuentro
+        while v != origen:
+            e = int(pf[v])
+            tramo.append((e, True))
+            v = up_src[e]
+        tramo.reverse()
+        v = encuentro
+        while v != destino:
+            e = int(pb[v])
+            tramo.append((e, False))
+            v = up_src[e]
+        for e, subida in tramo:
+            self._desempaquetar(e, subida, pers, aristas)
+
+        dst = self.red.edge_dst
+        nodos = [origen] + [int(dst[e]) for e in aristas]
+        return nodos, aristas
+
+    def _desempaquetar(self, e, subida, pers, out):
+        """Expande el atajo `e` (subida: lower->upper, bajada: upper->lower)."""
+        fwd, bwd, w = pers.vista_fwd, pers.vista_bwd, pers.vista_pesos
+        tri_xy, tri_xz, por_arista_ptr, por_arista = self._tri
+        pila = [(e, subida)]
+        while pila:
+            e, subida = pila.pop()
+            objetivo = fwd[e] if subida else bwd[e]
+            orig = self._orig[subida][e]
+            if orig >= 0 and w[orig] == objetivo:
+                out.append(orig)
+                continue
+            for k in range(por_arista_ptr[e], por_arista_ptr[e + 1]):
+                t = por_arista[k]
+                xy, xz = tri_xy[t], tri_xz[t]
+                if subida and bwd[xy] + fwd[xz] == objetivo:
+                    # y->x, x->z (se apilan al revés)
+                    pila.append((xz, True))
+                    pila.append((xy, False))
+                    break
+                if not subida and bwd[xz] + fwd[xy] == objetivo:
+                    # z->x, x->y
+                    pila.append((xy, True))
+                    pila.append((xz, False))
+                    break
+            else:
+                raise RuntimeError(f"No se puede desempaquetar el atajo {e}")
+
+
+class PersonalizacionCCH:
+    """Pesos de la jerarquía para un escenario concreto."""
+
+    def __init__(self, fwd, bwd, pesos):
+        self.fwd, self.bwd = fwd, bwd
+        self.vista_fwd = memoryview(fwd)
+        self.vista_bwd = memoryview(bwd)
+        self.vista_pesos = memoryview(np.ascontiguousarray(pesos))
+
+
+# -------------------------
+# Preprocesado métrica-independiente
+# -------------------------
+def construir(red, tam_celda=TAM_CELDA):
+    n = red.n_nodos
+    ea, eb = _aristas_no_dirigidas(red)
+    x = np.asarray(red.node_x)
+    y = np.asarray(red.node_y)
+    orden = orden_disseccion(x, y, ea, eb, tam_celda)
+    rango = np.empty(n, dtype=np.int32)
+    rango[orden] = np.arange(n, dtype=np.int32)
+
+    # Contracción simbólica: los vecinos superiores de x forman un clique,
+    # basta con propagarlos al padre (vecino superior de menor rango).
+    superiores = [set() for _ in range(n)]
+    for a, b in zip(ea.tolist(), eb.tolist()):
+        if rango[a] < rango[b]:
+            superiores[a].add(b)
+        else:
+            superiores[b].add(a)
+    rango_l = rango.tolist()
+    clave = rango_l.__getitem__
+    padre = np.full(n, -1, dtype=np.int32)
+    up_listas = [None] * n
+    for v in orden.tolist():
+        sup = sorted(superiores[v], key=clave)
+        superiores[v] = None
+        up_listas[v] = sup
+        if sup:
+            p = sup[0]
+            padre[v] = p
+            superiores[p].update(sup[1:])
+
+    up_indptr = np.zeros(n + 1, dtype=np.int64)
+    up_indptr[1:] = np.cumsum([len(s) for s in up_listas])
+    up_dst = np.fromiter((u for s in up_listas for u in s), dtype=np.int32, count=int(up_indptr[-1]))
+    m = len(up_dst)
+    id_arista = {}
+    for v in range(n):
+        for e in range(up_indptr[v], up_indptr[v + 1]):
+            id_arista[(v, int(up_dst[e]))] = e
+
+    # Aristas originales -> aristas de la jerarquía
+    orig_fwd = np.full(m, -1, dtype=np.int32)
+    orig_bwd = np.full(m, -1, dtype=np.int32)
+    for e, (u, v) in enumerate(zip(red.edge_src.tolist(), red.edge_dst.tolist())):
+        if u == v:
+            continue
+        if rango_l[u] < rango_l[v]:
+            orig_fwd[id_arista[(u, v)]] = e
+        else:
+            orig_bwd[id_arista[(v, u)]] = e
+
+    # Triángulos inferiores y niveles (profundidad desde las hojas)
+    nivel = np.zeros(n, dtype=np.int32)
+    tri = []
+    for v in orden.tolist():
+        sup = up_listas[v]
+        lv = nivel[v] + 1
+        for i, a in enumerate(sup):
+            if nivel[a] < lv:
+                nivel[a] = lv
+            e_va = id_arista[(v, a)]
+            for b in sup[i + 1:]:
+                tri.append((nivel[v], e_va, id_arista[(v, b)], id_arista[(a, b)]))
+    tri = np.asarray(tri, dtype=np.int64).reshape(-1, 4)
+    tri = tri[np.argsort(tri[:, 0], kind="stable")]
+    n_niveles = int(nivel.max()) + 1 if n else 0
+
+    # Altura del árbol de eliminación (los padres tienen siempre mayor rango)
+    prof = np.zeros(n, dtype=np.int32)
+    for v in orden[::-1].tolist():
+        p = padre[v]
+        prof[v] = prof[p] + 1 if p >= 0 else 1
+    nivel_ptr = np.zeros(n_niveles + 1, dtype=np.int64)
+    nivel_ptr[1:] = np.cumsum(np.bincount(tri[:, 0], minlength=n_niveles))[:n_niveles]
+    tri_yz = tri[:, 3]
+    por_arista = np.argsort(tri_yz, kind="stable")
+    por_arista_ptr = np.zeros(m + 1, dtype=np.int64)
+    por_arista_ptr[1:] = np.cumsum(np.bincount(tri_yz, minlength=m))
+
+    arrays = {
+        "rango": rango,
+        "padre": padre,
+        "up_indptr": up_indptr,
+        "up_dst": up_dst,
+        "orig_fwd": orig_fwd,
+        "orig_bwd": orig_bwd,
+        "tri_xy": tri[:, 1].astype(np.int32),
+        "tri_xz": tri[:, 2].astype(np.int32),
+        "tri_yz": tri_yz.astype(np.int32),
+        "nivel_ptr": nivel_ptr,
+        "tri_por_arista_ptr": por_arista_ptr,
+        "tri_por_arista": por_arista.astype(np.int32),
+    }
+    meta = {
+        "cch_version": CCH_VERSION,
+        "source_sha256": red.meta["source_sha256"],
+        "n_nodos": n,
+        "n_aristas_red": red.n_aristas,
+        "n_aristas": m,
+        "n_triangulos": len(tri),
+        "n_niveles": n_niveles,
+        "altura_arbol": int(prof.max()) if n else 0,
+    }
+    return arrays, meta
+
+
+def obtener_jerarquia(red, forzar=False):
+    """Abre (o construye y guarda) la jerarquía junto al artefacto de la red."""
+    directorio = os.path.join(red.meta["directorio"], SUBDIR)
+    if forzar and os.path.isdir(directorio):
+        shutil.rmtree(directorio)
+    leido = grafo_compilado.cargar_arrays(directorio, ARRAYS_CCH)
+    if leido is not None:
+        arrays, meta = leido
+        if (meta.get("cch_version") == CCH_VERSION
+                and meta.get("source_sha256") == red.meta["source_sha256"]
+                and meta.get("n_aristas_red") == red.n_aristas):
+            return JerarquiaCCH(red, arrays)
+    print("⚙️ Construyendo jerarquía CCH (orden por disección anidada)...")
+    arrays, meta = construir(red)
+    grafo_compilado.guardar_arrays(arrays, meta, directorio)
+    print(f"✅ CCH: {meta['n_aristas']} aristas, {meta['n_triangulos']} triángulos, "
+          f"altura {meta['altura_arbol']}.")
+    arrays, _ = grafo_compilado.cargar_arrays(directorio, ARRAYS_CCH)
+    return JerarquiaCCH(red, arrays)
+
+
+if __name__ == "__main__":
+    import sys
+    import callejero_mostoles_mod as cm
+
+    obtener_jerarquia(cm.red, forzar="--forzar" in sys.argv)
@@ -0,0 +1,170 @@
+"""
+Caché LRU de escenarios de tráfico.
+
+La penalización de ``dynamic_weight`` solo depende del mapa zona -> nivel que
+devuelve ``predecir_trafico_por_fecha``. Con 6 zonas y 3 niveles hay pocos
+escenarios distintos, así que cada uno se materializa una vez (vector de pesos
+por arista + matriz CSR) y se reutiliza entre peticiones.
+
+Con una tabla de factores por tramo (``trafico_tramos``) el factor de cada
+arista sale de la tabla en vez de ser el de su zona. Si cambian los factores
+de unos pocos tramos, ``actualizar_aristas`` reescribe solo esas posiciones de
+los escenarios en caché y sube su ``revision``.
+
+Encima va la superposición de incidencias (``incidencias.py``): un factor
+por arista (1 sin incidencia, ``inf`` si está cortada) que ``superponer``
+cambia solo en las aristas afectadas. Sin incidencias activas los pesos son
+exactamente los del escenario.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import motor_rutas
+
+CORTE_S = 1e6  # peso de una arista cortada; un camino que cuesta esto o más no existe
+
+
+class Escenario:
+    """Pesos ya materializados de un escenario de tráfico (solo lectura)."""
+
+    def __init__(self, clave, pesos, matriz, revision=0):
+        self.clave = clave
+        self.revision = revision  # sube cada vez que se reescriben pesos
+        self.pesos = pesos
+        self.vista = memoryview(pesos)
+        self.matriz = matriz
+        self.cch = None  # personalización CCH, se calcula al primer uso
+        self.compacto = None  # ídem para el grafo compacto
+        self._inversa = None
+
+    @property
+    def version(self):
+        """Identifica los pesos actuales: escenario + revisión."""
+        return self.clave, self.revision
+
+    @property
+    def inversa(self):
+        """Matriz del grafo inverso (búsquedas hacia los destinos), al primer uso."""
+        if self._inversa is None:
+            self._inversa = self.matriz.T.tocsr()
+        return self._inversa
+
+
+class CacheEscenarios:
+    """LRU acotada de ``Escenario`` indexada por la tupla de niveles por zona."""
+
+    def __init__(self, red, motor, max_entradas=32, tramos=None):
+        self.red = red
+        self.motor = motor
+        self.tramos = tramos  # trafico_tramos.TablaTramos o None (factor por zona)
+        self.revision = 0
+        self.superposicion = np.ones(red.n_aristas, dtype=np.float64)
+        self.superpuestas = 0  # aristas con factor distinto de 1
+        self.max_entradas = max(1, int(max_entradas))
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def clave(self, traffic_predictions=None):
+        """Nivel de cada zona de la red (en el orden de sus códigos); None si no hay predicción."""
+        preds = traffic_predictions or {}
+        return tuple(preds.get(z) for z in self.red.zonas)
+
+    def _pesos(self, clave, aristas=None):
+        """Pesos de todas las aristas (o de ``aristas``) en el escenario ``clave``, con incidencias."""
+        pesos = self._pesos_base(clave, aristas)
+        if not self.superpuestas:
+            return pesos
+        sup = self.superposicion if aristas is None else self.superposicion[aristas]
+        with np.errstate(invalid="ignore"):
+            return np.where(np.isinf(sup), CORTE_S, pesos * sup)
+
+    def _pesos_base(self, clave, aristas=None):
+        red = self.red
+        if self.tramos is not None:
+            factores = self.tramos.factores_escenario(clave, red.edge_zona, aristas)
+            return (red.edge_time if aristas is None else red.edge_time[aristas]) * factores
+        # Un único gather vectorizado: factor[código de zona de cada arista]
+        factores = np.array([motor_rutas.FACTORES_TRAFICO.get(nivel, 1.0) for nivel in clave],
+                            dtype=np.float64)
+        if aristas is None:
+            return red.edge_time * factores[red.edge_zona]
+        return red.edge_time[aristas] * factores[red.edge_zona[aristas]]
+
+    def _materializar(self, clave, revision):
+        pesos = self._pesos(clave)
+        pesos.setflags(write=False)
+        return Escenario(clave, pesos, self.motor.matriz(pesos), revision)
+
+    def actualizar_aristas(self, aristas):
+        """
+        Recalcula los pesos de ``aristas`` en todos los escenarios en caché (tras
+        cambiar sus factores por tramo o sus incidencias). Solo se tocan esas
+        posiciones: la matriz CSR comparte el vector de pesos; la matriz
+        inversa y las personalizaciones se rehacen al siguiente uso.
+        """
+        aristas = np.unique(np.asarray(aristas, dtype=np.int64))
+        with self._lock:
+            self.revision += 1
+            for esc in self._entradas.values():
+                esc.pesos.setflags(write=True)
+                esc.pesos[aristas] = self._pesos(esc.clave, aristas)
+                esc.pesos.setflags(write=False)
+                esc.cch = esc.compacto = esc._inversa = None
+                esc.revision = self.revision
+        return len(aristas)
+
+    def superponer(self, aristas, factores):
+        """Cambia el factor de incidencia de ``aristas`` (distintas) y rehace solo sus pesos."""
+        aristas = np.asarray(aristas, dtype=np.int64)
+        factores = np.asarray(factores, dtype=np.float64)
+        with self._lock:
+            antes = int(np.count_nonzero(self.superposicion[aristas] != 1.0))
+            self.superposicion[aristas] = factores
+            self.superpuestas += int(np.count_nonzero(factores != 1.0)) - antes
+        return self.actualizar_aristas(aristas)
+
+    def obtener(self, traffic_predictions=None):
+        clave = self.clave(traffic_predictions)
+        with self._lock:
+            esc = self._entradas.get(clave)
+            if esc is not None:
+                self._entradas.move_to_end(clave)
+                self.hits += 1
+                return esc
+            self.misses += 1
+            revision = self.revision
+
+        esc = self._materializar(clave, revision)
+        with self._lock:
+            if revision != self.revision:
+                # Se actualizaron tramos mientras se materializaba: pesos al día
+                esc = self._materializar(clave, self.revision)
+            self._entradas[clave] = esc
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+        return esc
+
+    def activos(self):
+        """Escenarios en la caché, del más reciente al más antiguo."""
+        with self._lock:
+            return list(reversed(self._entradas.values()))
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entradas": len(self._entradas),
+                "max_entradas": self.max_entradas,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
@@ -0,0 +1,338 @@
+"""
+Grafo de rutas compactado: cadenas de nodos de grado 2 colapsadas.
+
+El constructor crea un nodo por vértice de cada LineString para conservar las
+curvas, así que la mayoría de nodos solo unen dos tramos de la misma calle.
+Aquí cada cadena de nodos intermedios (mismos dos vecinos, mismo sentido y
+misma zona en todas sus aristas) se sustituye por una única arista compacta
+que guarda la lista ordenada de aristas originales que recorre.
+
+- Los pesos de una arista compacta son la suma de los de su cadena, así que
+  la personalización por escenario es un ``np.add.reduceat``.
+- La consulta admite origen/destino en nodos intermedios: se sale (o se
+  entra) por los extremos de su cadena con el coste parcial correspondiente.
+- El camino devuelto se expande a las aristas originales, de modo que la
+  geometría y los totales son los mismos que con el grafo completo.
+
+Se guarda junto al artefacto en ``<artefacto>/compacto``:
+
+    python grafo_compacto.py [--forzar]
+"""
+import os
+import shutil
+
+import numpy as np
+from scipy.sparse import csr_array
+from scipy.sparse.csgraph import dijkstra as _csgraph_dijkstra
+
+import grafo_compilado
+import motor_rutas
+
+COMPACTO_VERSION = 1
+SUBDIR = "compacto"
+
+ARRAYS_COMPACTO = (
+    "nodo_compacto",   # id compacto de cada nodo original (-1 = intermedio)
+    "nodos",           # nodo original de cada nodo compacto
+    "c_src",           # arista compacta: nodo compacto de origen
+    "c_dst",           # arista compacta: nodo compacto de destino
+    "cadena_ptr",      # aristas originales de la arista compacta c en
+    "cadena_aristas",  # cadena_aristas[cadena_ptr[c]:cadena_ptr[c+1]]
+    "via_ptr",         # cadenas que atraviesan cada nodo original
+    "via_arista",      # (arista compacta, posición del nodo en la cadena)
+    "via_pos",
+    "par_indptr",      # CSR de pares (u, v) compactos distintos (sin bucles)
+    "par_dst",
+    "grupo_ptr",       # aristas compactas paralelas de cada par, agrupadas
+    "grupo_aristas",
+)
+
+
+def nodos_intermedios(red):
+    """
+    Nodos que se pueden colapsar: dos vecinos distintos y, o bien doble sentido
+    con ambos (2 entradas, 2 salidas), o bien sentido único de paso (1 y 1);
+    sin bucles y con todas sus aristas en la misma zona.
+    """
+    n = red.n_nodos
+    src = np.asarray(red.edge_src, dtype=np.int64)
+    dst = np.asarray(red.edge_dst, dtype=np.int64)
+    zona = np.asarray(red.edge_zona)
+    salida = np.bincount(src, minlength=n)
+    entrada = np.bincount(dst, minlength=n)
+
+    bucle = np.zeros(n, dtype=bool)
+    bucle[src[src == dst]] = True
+    a, b = np.minimum(src, dst), np.maximum(src, dst)
+    pares = np.unique(a[a != b] * n + b[a != b])
+    vecinos = np.bincount(pares // n, minlength=n) + np.bincount(pares % n, minlength=n)
+
+    zmin = np.full(n, np.iinfo(np.int32).max, dtype=np.int32)
+    zmax = np.full(n, -1, dtype=np.int32)
+    for extremo in (src, dst):
+        np.minimum.at(zmin, extremo, zona)
+        np.maximum.at(zmax, extremo, zona)
+
+    paso = ((salida == 2) & (entrada == 2)) | ((salida == 1) & (entrada == 1))
+    return (vecinos == 2) & paso & ~bucle & (zmin == zmax)
+
+
+def construir(red):
+    """Cadenas, nodos compactos e índices de la red compactada."""
+    n = red.n_nodos
+    indptr = np.asarray(red.indptr)
+    dst = np.asarray(red.edge_dst, dtype=np.int64)
+    src = np.asarray(red.edge_src, dtype=np.int64)
+    intermedio = nodos_intermedios(red)
+
+    # Siguiente arista de la cadena tras e=(p->x) si x es intermedio: la salida de x que no vuelve a p
+    siguiente = np.full(red.n_aristas, -1, dtype=np.int64)
+    e_int = np.flatnonzero(intermedio[dst])
+    x = dst[e_int]
+    e1 = indptr[x]
+    e2 = np.minimum(e1 + 1, indptr[x + 1] - 1)
+    siguiente[e_int] = np.where(dst[e1] != src[e_int], e1, e2)
+
+    # Recorrido de cadenas desde cada nodo conservado (bucle sobre aristas, una vez por versión)
+    conservado = ~intermedio
+    sig, dst_l, ind_l = siguiente.tolist(), dst.tolist(), indptr.tolist()
+    cubierta = np.zeros(red.n_aristas, dtype=bool)
+    cadenas = []
+
+    def recorrer(u):
+        for e in range(ind_l[u], ind_l[u + 1]):
+            cadena = [e]
+            while intermedio_l[dst_l[cadena[-1]]]:
+                cadena.append(sig[cadena[-1]])
+            cadenas.append(cadena)
+            cubierta[cadena] = True
+
+    intermedio_l = intermedio.tolist()
+    for u in np.flatnonzero(conservado).tolist():
+        recorrer(u)
+    # Ciclos formados solo por nodos intermedios: se conserva un nodo de cada uno
+    for e in np.flatnonzero(~cubierta).tolist():
+        if not cubierta[e]:
+            u = int(src[e])
+            conservado[u] = intermedio[u] = intermedio_l[u] = False
+            recorrer(u)
+
+    nodos = np.flatnonzero(conservado)
+    nodo_compacto = np.full(n, -1, dtype=np.int64)
+    nodo_compacto[nodos] = np.arange(len(nodos))
+    nc = len(nodos)
+
+    largo = np.array([len(c) for c in cadenas], dtype=np.int64)
+    cadena_ptr = np.zeros(len(cadenas) + 1, dtype=np.int64)
+    np.cumsum(largo, out=cadena_ptr[1:])
+    cadena_aristas = np.fromiter((e for c in cadenas for e in c), dtype=np.int64, count=int(cadena_ptr[-1]))
+    c_src = nodo_compacto[src[cadena_aristas[cadena_ptr[:-1]]]]
+    c_dst = nodo_compacto[dst[cadena_aristas[cadena_ptr[1:] - 1]]]
+
+    # Nodos intermedios: cada cadena que los atraviesa y en qué posición
+    cad_de = np.repeat(np.arange(len(cadenas)), largo)
+    pos = np.arange(len(cadena_aristas)) - cadena_ptr[cad_de]
+    interior = pos > 0
+    via_nodo = src[cadena_aristas[interior]]
+    orden = np.argsort(via_nodo, kind="stable")
+    via_ptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(via_nodo, minlength=n), out=via_ptr[1:])
+
+    # Pares (u, v) distintos para la matriz de búsqueda; las paralelas se agrupan
+    no_bucle = np.flatnonzero(c_src != c_dst)
+    clave = c_src[no_bucle] * nc + c_dst[no_bucle]
+    orden_par = np.argsort(clave, kind="stable")
+    claves, grupo_ini = np.unique(clave[orden_par], return_index=True)
+    par_src = claves // nc
+    par_indptr = np.zeros(nc + 1, dtype=np.int64)
+    np.cumsum(np.bincount(par_src, minlength=nc), out=par_indptr[1:])
+
+    arrays = {
+        "nodo_compacto": nodo_compacto.astype(np.int32),
+        "nodos": nodos.astype(np.int32),
+        "c_src": c_src.astype(np.int32),
+        "c_dst": c_dst.astype(np.int32),
+        "cadena_ptr": cadena_ptr,
+        "cadena_aristas": cadena_aristas.astype(np.int32),
+        "via_ptr": via_ptr,
+        "via_arista": cad_de[interior][orden].astype(np.int32),
+        "via_pos": pos[interior][orden].astype(np.int32),
+        "par_indptr": par_indptr,
+        "par_dst": (claves % nc).astype(np.int32),
+        "grupo_ptr": np.append(grupo_ini, len(clave)).astype(np.int64),
+        "grupo_aristas": no_bucle[orden_par].astype(np.int32),
+    }
+    meta = {
+        "compacto_version": COMPACTO_VERSION,
+        "source_sha256": red.meta["source_sha256"],
+        "n_aristas_red": red.n_aristas,
+        "n_nodos": nc,
+        "n_aristas": len(cadenas),
+        "n_pares": len(claves),
+    }
+    return arrays, meta
+
+
+class GrafoCompacto:
+    """Consultas de camino mínimo sobre la red compactada."""
+
+    def __init__(self, red, arrays):
+        self.red = red
+        for nombre in ARRAYS_COMPACTO:
+            # ndarray (no memmap) para que el indexado por consulta sea barato
+            setattr(self, nombre, np.asarray(arrays[nombre]))
+        self.n = len(self.nodos)
+        # Clave u*n+v de cada par, ya ordenada por construcción
+        self._clave_par = (np.repeat(np.arange(self.n, dtype=np.int64), np.diff(self.par_indptr)) * self.n
+                           + self.par_dst)
+        self._nodo_compacto = memoryview(np.ascontiguousarray(self.nodo_compacto))
+        self._cadena_ptr = self.cadena_ptr.tolist()
+        self._via_ptr = memoryview(np.ascontiguousarray(self.via_ptr))
+        self._dst = memoryview(np.ascontiguousarray(red.edge_dst))
+
+    def personalizar(self, pesos):
+        """Pesos de las aristas compactas y matriz de búsqueda para un escenario."""
+        pesos = np.asarray(pesos, dtype=np.float64)
+        w = np.add.reduceat(pesos[self.cadena_aristas], self.cadena_ptr[:-1])
+        # Entre aristas paralelas (mismo par u, v) se queda la más barata
+        wg = w[self.grupo_aristas]
+        grupo = np.repeat(np.arange(len(self.grupo_ptr) - 1), np.diff(self.grupo_ptr))
+        orden = np.lexsort((wg, grupo))
+        elegida = np.asarray(self.grupo_aristas)[orden[self.grupo_ptr[:-1]]]
+        matriz = csr_array((w[elegida], self.par_dst, self.par_indptr), shape=(self.n, self.n))
+        return PersonalizacionCompacta(matriz, elegida, pesos)
+
+    def _cadena(self, c):
+        return self.cadena_aristas[self._cadena_ptr[c]:self._cadena_ptr[c + 1]].tolist()
+
+    def _vias(self, v):
+        i, j = self._via_ptr[v], self._via_ptr[v + 1]
+        return zip(self.via_arista[i:j].tolist(), self.via_pos[i:j].tolist())
+
+    def _expandir(self, compactas):
+        """Aristas originales de una secuencia de aristas compactas, en orden."""
+        ini = self.cadena_ptr[compactas]
+        largo = self.cadena_ptr[compactas + 1] - ini
+        desplaz = np.repeat(ini - np.cumsum(largo) + largo, largo)
+        return self.cadena_aristas[desplaz + np.arange(int(largo.sum()))].tolist()
+
+    def consulta(self, origen, destino, pers, stats=None):
+        """Devuelve ``(nodos, aristas)`` originales del camino mínimo o None."""
+        res = self.consulta_multi([(origen, 0.0)], [(destino, 0.0)], pers, stats=stats)
+        return None if res is None else res[2:]
+
+    def consulta_multi(self, origenes, destinos, pers, stats=None):
+        """
+        Camino mínimo entre varios orígenes y destinos candidatos, cada uno con
+        un coste inicial/final (p. ej. el tramo parcial hasta el punto ajustado
+        a una arista). Devuelve ``(i_origen, i_destino, nodos, aristas)`` o None.
+        Si se pasa ``stats`` (dict) se rellena ``stats["settled"]`` (nodos compactos).
+        """
+        w = pers.pesos
+        mejor, solucion = float("inf"), None
+
+        # (nodo compacto, coste, aristas originales hasta/desde él, índice del candidato)
+        salidas, llegadas = [], []
+        for i, (o, c0) in enumerate(origenes):
+            if self._nodo_compacto[o] >= 0:
+                salidas.append((self._nodo_compacto[o], c0, [], i))
+            for c, k in self._vias(o):
+                tramo = self._cadena(c)[k:]
+                salidas.append((int(self.c_dst[c]), c0 + float(w[tramo].sum()), tramo, i))
+        for j, (d, c1) in enumerate(destinos):
+            if self._nodo_compacto[d] >= 0:
+                llegadas.append((self._nodo_compacto[d], c1, [], j))
+            for c, k in self._vias(d):
+                tramo = self._cadena(c)[:k]
+                llegadas.append((int(self.c_src[c]), c1 + float(w[tramo].sum()), tramo, j))
+
+        # Caminos que no pasan por ningún nodo compacto: mismo nodo o misma cadena
+        for i, (o, c0) in enumerate(origenes):
+            pos_o = dict(self._vias(o))
+            for j, (d, c1) in enumerate(destinos):
+                if o == d:
+                    if c0 + c1 < mejor:
+                        mejor, solucion = c0 + c1, ("directo", i, j, [])
+                    continue
+                for c, k in self._vias(d):
+                    if pos_o.get(c, k) < k:
+                        tramo = self._cadena(c)[pos_o[c]:k]
+                        coste = c0 + float(w[tramo].sum()) + c1
+                        if coste < mejor:
+                            mejor, solucion = coste, ("directo", i, j, tramo)
+
+        # Una sola búsqueda: con varias salidas se parte de un nodo virtual (id n)
+        # unido a cada una con su coste
+        por_nodo = {}
+        for s, cs, prefijo, i in salidas:
+            if s not in por_nodo or cs < por_nodo[s][0]:
+                por_nodo[s] = (cs, prefijo, i)
+        if len(por_nodo) == 1:
+            (fuente, (base, _, _)), = por_nodo.items()
+            matriz = pers.matriz
+        else:
+            fuente, base = self.n, 0.0
+            matriz = motor_rutas.con_origen_virtual(pers.matriz, list(por_nodo),
+                                                    [cs for cs, _, _ in por_nodo.values()])
+        dist, pred = _csgraph_dijkstra(matriz, directed=True, indices=fuente, return_predecessors=True)
+        if stats is not None:
+            stats["settled"] = int(np.isfinite(dist[:self.n]).sum())
+        for t, ct, sufijo, j in llegadas:
+            coste = base + dist[t] + ct
+            if coste < mejor:
+                mejor, solucion = coste, ("red", t, j, sufijo)
+        if solucion is None:
+            return None
+
+        if solucion[0] == "directo":
+            _, i, j, aristas = solucion
+        else:
+            _, t, j, sufijo = solucion
+            camino = [t]
+            while camino[-1] != fuente:
+                camino.append(int(pred[camino[-1]]))
+            if fuente == self.n:
+                camino.pop()
+            _, prefijo, i = por_nodo[camino[-1]]
+            camino = np.array(camino[::-1], dtype=np.int64)
+            pares = np.searchsorted(self._clave_par, camino[:-1] * self.n + camino[1:])
+            aristas = list(prefijo) + self._expandir(pers.elegida[pares]) + list(sufijo)
+        origen = origenes[i][0]
+        return i, j, [origen] + [self._dst[e] for e in aristas], aristas
+
+
+class PersonalizacionCompacta:
+    """Matriz de búsqueda del grafo compacto para un vector de pesos."""
+
+    def __init__(self, matriz, elegida, pesos):
+        self.matriz = matriz
+        self.elegida = elegida
+        self.pesos = pesos
+
+
+def obtener_grafo_compacto(red, forzar=False):
+    """Abre (o construye y guarda) el grafo compacto junto al artefacto de la red."""
+    directorio = os.path.join(red.meta["directorio"], SUBDIR)
+    if forzar and os.path.isdir(directorio):
+        shutil.rmtree(directorio)
+    leido = grafo_compilado.cargar_arrays(directorio, ARRAYS_COMPACTO)
+    if leido is not None:
+        arrays, meta = leido
+        if (meta.get("compacto_version") == COMPACTO_VERSION
+                and meta.get("source_sha256") == red.meta["source_sha256"]
+                and meta.get("n_aristas_red") == red.n_aristas):
+            return GrafoCompacto(red, arrays)
+    print("⚙️ Compactando cadenas de nodos de grado 2...")
+    arrays, meta = construir(red)
+    grafo_compilado.guardar_arrays(arrays, meta, directorio)
+    print(f"✅ Grafo compacto: {meta['n_nodos']} nodos ({red.n_nodos} originales), "
+          f"{meta['n_aristas']} aristas ({red.n_aristas} originales).")
+    arrays, _ = grafo_compilado.cargar_arrays(directorio, ARRAYS_COMPACTO)
+    return GrafoCompacto(red, arrays)
+
+
+if __name__ == "__main__":
+    import sys
+    import callejero_mostoles_mod as cm
+
+    obtener_grafo_compacto(cm.red, forzar="--forzar" in sys.argv)
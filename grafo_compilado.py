@@ -0,0 +1,218 @@
+"""
+Artefacto binario precompilado de la red viaria.
+
+La red se compila una sola vez a un directorio versionado con arrays NumPy
+(.npy) en formato CSR. Los workers lo abren con ``mmap_mode='r'``, de modo que
+el arranque tarda milisegundos y todas las páginas se comparten entre procesos.
+El artefacto se invalida con el hash SHA-256 del GeoJSON de origen.
+
+Uso como paso de build:
+
+    python grafo_compilado.py [--forzar]
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+# -------------------------
+# Parámetros
+# -------------------------
+FORMATO_VERSION = 2
+DIR_ARTEFACTOS = "data/grafo_compilado"
+META_FILE = "meta.json"
+
+# nombre -> dtype de cada array del artefacto
+ARRAYS = {
+    "indptr": np.int64,      # CSR: aristas de u en [indptr[u], indptr[u+1])
+    "edge_src": np.int32,    # nodo origen de cada arista
+    "edge_dst": np.int32,    # nodo destino de cada arista
+    "edge_len": np.float64,  # longitud (m)
+    "edge_time": np.float64, # tiempo base sin tráfico (s)
+    "edge_zona": np.int16,   # código de zona (índice en meta['zonas'])
+    "edge_highway": np.int8, # tipo de vía (índice en meta['highways'])
+    "node_x": np.float64,    # coordenadas UTM (EPSG:25830)
+    "node_y": np.float64,
+}
+
+
+def hash_fuente(path, bloque=1 << 20):
+    """SHA-256 del fichero fuente (invalida el artefacto si cambia)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(bloque), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def ruta_artefacto(source_hash, base=DIR_ARTEFACTOS):
+    return os.path.join(base, f"v{FORMATO_VERSION}_{source_hash[:16]}")
+
+
+# -------------------------
+# Red en formato CSR
+# -------------------------
+class RedCompilada:
+    """Red viaria en arrays planos (solo lectura si viene de disco)."""
+
+    def __init__(self, arrays, meta):
+        for nombre in ARRAYS:
+            setattr(self, nombre, arrays[nombre])
+        self.meta = meta
+        self.zonas = list(meta["zonas"])
+        self.highways = list(meta["highways"])
+
+    @property
+    def n_nodos(self):
+        return len(self.node_x)
+
+    @property
+    def n_aristas(self):
+        return len(self.edge_dst)
+
+    def codigo_zona(self, nombre):
+        try:
+            return self.zonas.index(nombre)
+        except ValueError:
+            return -1
+
+    def arrays(self):
+        return {nombre: getattr(self, nombre) for nombre in ARRAYS}
+
+
+def _nombre_zona(d):
+    # Zonas nulas (NaN) no casan con ninguna predicción: igual que 'Desconocida'
+    z = d.get("zona", "Desconocida")
+    return z if isinstance(z, str) else "Desconocida"
+
+
+def _nombre_highway(h):
+    return h if isinstance(h, str) and h else "desconocida"
+
+
+def compilar_desde_aristas(tabla, source_hash):
+    """
+    Compila la tabla de aristas del constructor vectorizado
+    (``callejero_mostoles_mod.construir_aristas``) a CSR. Las aristas ya vienen
+    ordenadas por nodo origen y en el orden de adyacencia de NetworkX.
+    """
+    n = len(tabla["node_x"])
+    nombres = [z if isinstance(z, str) else "Desconocida" for z in tabla["edge_zona"]]
+    zonas = sorted(set(nombres))
+    cod = {z: i for i, z in enumerate(zonas)}
+    nombres_hw = [_nombre_highway(h) for h in tabla["edge_highway"]]
+    highways = sorted(set(nombres_hw))
+    cod_hw = {h: i for i, h in enumerate(highways)}
+    src = np.asarray(tabla["edge_src"])
+
+    indptr = np.zeros(n + 1, dtype=ARRAYS["indptr"])
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    arrays = {
+        "indptr": indptr,
+        "edge_src": src.astype(ARRAYS["edge_src"]),
+        "edge_dst": np.asarray(tabla["edge_dst"], dtype=ARRAYS["edge_dst"]),
+        "edge_len": np.asarray(tabla["edge_len"], dtype=ARRAYS["edge_len"]),
+        "edge_time": np.asarray(tabla["edge_time"], dtype=ARRAYS["edge_time"]),
+        "edge_zona": np.asarray([cod[z] for z in nombres], dtype=ARRAYS["edge_zona"]),
+        "edge_highway": np.asarray([cod_hw[h] for h in nombres_hw], dtype=ARRAYS["edge_highway"]),
+        "node_x": np.asarray(tabla["node_x"], dtype=ARRAYS["node_x"]),
+        "node_y": np.asarray(tabla["node_y"], dtype=ARRAYS["node_y"]),
+    }
+    meta = {
+        "formato": FORMATO_VERSION,
+        "source_sha256": source_hash,
+        "n_nodos": n,
+        "n_aristas": len(src),
+        "zonas": zonas,
+        "highways": highways,
+    }
+    return RedCompilada(arrays, meta)
+
+
+# -------------------------
+# Persistencia
+# -------------------------
+def guardar_arrays(arrays, meta, directorio):
+    """
+    Escribe arrays .npy + meta.json de forma atómica (directorio temporal +
+    rename), así varios workers pueden compilar a la vez sin pisarse.
+    """
+    base = os.path.dirname(directorio) or "."
+    os.makedirs(base, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp_", dir=base)
+    try:
+        for nombre, arr in arrays.items():
+            np.save(os.path.join(tmp, f"{nombre}.npy"), np.ascontiguousarray(arr))
+        with open(os.path.join(tmp, META_FILE), "w", encoding="utf-8") as f:
+            json.dump({k: v for k, v in meta.items() if k != "directorio"}, f, ensure_ascii=False, indent=1)
+        # mkdtemp crea el directorio con 0700: legible también por otros usuarios del servicio
+        os.chmod(tmp, 0o755)
+        os.rename(tmp, directorio)
+    except OSError:
+        # Otro proceso lo ha publicado antes: nos quedamos con el suyo
+        if not os.path.isdir(directorio):
+            raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def cargar_arrays(directorio, nombres, mmap=True):
+    """Lee meta.json y los arrays indicados. Devuelve (arrays, meta) o None."""
+    meta_path = os.path.join(directorio, META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {
+            nombre: np.load(os.path.join(directorio, f"{nombre}.npy"), mmap_mode="r" if mmap else None)
+            for nombre in nombres
+        }
+    except (OSError, ValueError):
+        return None
+    meta["directorio"] = directorio
+    return arrays, meta
+
+
+def guardar(red, directorio):
+    arrays = {nombre: np.asarray(arr, dtype=ARRAYS[nombre]) for nombre, arr in red.arrays().items()}
+    guardar_arrays(arrays, red.meta, directorio)
+    limpiar_obsoletos(directorio)
+
+
+def cargar(directorio, source_hash=None, mmap=True):
+    """Abre el artefacto (memory-mapped). Devuelve None si falta o no es válido."""
+    leido = cargar_arrays(directorio, ARRAYS, mmap=mmap)
+    if leido is None:
+        return None
+    arrays, meta = leido
+    if meta.get("formato") != FORMATO_VERSION:
+        return None
+    if source_hash and meta.get("source_sha256") != source_hash:
+        return None
+    if len(arrays["indptr"]) != meta["n_nodos"] + 1 or len(arrays["edge_dst"]) != meta["n_aristas"]:
+        return None
+    return RedCompilada(arrays, meta)
+
+
+def limpiar_obsoletos(actual):
+    """Borra artefactos de otras versiones/hashes (los mmap abiertos siguen siendo válidos)."""
+    base = os.path.dirname(actual) or "."
+    for nombre in os.listdir(base):
+        ruta = os.path.join(base, nombre)
+        if ruta != actual and os.path.isdir(ruta) and nombre.startswith("v"):
+            shutil.rmtree(ruta, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    import sys
+    if "--forzar" in sys.argv:
+        # Importar el módulo de la red ya compila el artefacto si falta: se borra antes para compilar una sola vez
+        shutil.rmtree(DIR_ARTEFACTOS, ignore_errors=True)
+    import callejero_mostoles_mod as cm
+
+    red = cm.red
+    print(f"✅ Artefacto listo en {red.meta['directorio']}: {red.n_nodos} nodos, {red.n_aristas} aristas.")
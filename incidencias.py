@@ -0,0 +1,183 @@
+"""
+Incidencias en vivo: cortes y retenciones sobre las aristas de la red.
+
+Un corte (el propio incendio, un accidente) o una retención se guarda en un
+registro JSON compartido por todos los workers y procesos de cálculo, con
+las aristas que afecta ya resueltas y su caducidad. Cada proceso lo vuelve a
+mirar como mucho cada ``RECARGA_S`` antes de calcular y, si ha cambiado (o
+ha caducado alguna incidencia), compara la superposición nueva con la que
+tiene aplicada y pasa a la caché de escenarios solo las aristas cuyo factor
+cambia: no se recompila el grafo ni se reinicia nada.
+
+Varias incidencias sobre la misma arista: manda la más severa.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+RECARGA_S = 0.5  # las incidencias llegan a todos los procesos en menos de un segundo
+TIPOS = ("corte", "lentitud")
+
+
+def superposicion(registro, ahora):
+    """Aristas (ordenadas) y factor de las incidencias activas: ``inf`` si están cortadas."""
+    aristas, factores = [], []
+    for d in registro.values():
+        if d.get("expira") is not None and d["expira"] <= ahora:
+            continue
+        aristas.append(np.asarray(d["aristas"], dtype=np.int64))
+        factor = np.inf if d["tipo"] == "corte" else float(d["factor"])
+        factores.append(np.full(len(d["aristas"]), factor))
+    if not aristas:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    unicas, inversa = np.unique(np.concatenate(aristas), return_inverse=True)
+    peor = np.ones(len(unicas))
+    np.maximum.at(peor, inversa, np.concatenate(factores))
+    return unicas, peor
+
+
+def _factores_en(aristas, tabla_aristas, tabla_factores):
+    """Factor de cada arista según una superposición (1 si no está)."""
+    f = np.ones(len(aristas))
+    if len(tabla_aristas):
+        i = np.minimum(np.searchsorted(tabla_aristas, aristas), len(tabla_aristas) - 1)
+        hay = tabla_aristas[i] == aristas
+        f[hay] = tabla_factores[i[hay]]
+    return f
+
+
+class GestorIncidencias:
+    """Registro de incidencias y su aplicación a una ``CacheEscenarios``."""
+
+    def __init__(self, ruta, escenarios):
+        self.ruta = ruta
+        self.escenarios = escenarios
+        self._registro = {}
+        self._aristas = np.empty(0, dtype=np.int64)  # superposición aplicada
+        self._factores = np.empty(0)
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._revisado = 0.0
+        self._proxima_expiracion = float("inf")
+        self.huella = ""  # identifica las incidencias activas (igual en todos los procesos)
+        self.aplicaciones = 0
+        self.aristas_cambiadas = 0
+
+    # -------------------------
+    # Registro (JSON compartido entre workers)
+    # -------------------------
+    def _leer_registro(self):
+        if not os.path.exists(self.ruta):
+            return {}
+        with open(self.ruta, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _escribir_registro(self, registro):
+        directorio = os.path.dirname(self.ruta) or "."
+        os.makedirs(directorio, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".incidencias_", dir=directorio)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(registro, f, ensure_ascii=False)
+        os.replace(tmp, self.ruta)
+
+    @contextmanager
+    def _bloqueo_registro(self):
+        """Leer, modificar y escribir el registro sin pisar a otro worker (flock en ``<ruta>.lock``)."""
+        os.makedirs(os.path.dirname(self.ruta) or ".", exist_ok=True)
+        with self._lock, open(self.ruta + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield  # al cerrar el fichero se suelta el bloqueo
+
+    def _vigentes(self, registro, ahora):
+        return {i: d for i, d in registro.items() if d.get("expira") is None or d["expira"] > ahora}
+
+    def sincronizar(self, forzar=False):
+        """Aplica los cambios del registro y las caducidades (como mucho una comprobación cada RECARGA_S)."""
+        ahora_m = time.monotonic()
+        if not forzar and ahora_m - self._revisado < RECARGA_S:
+            return
+        self._revisado = ahora_m
+        mtime = os.path.getmtime(self.ruta) if os.path.exists(self.ruta) else None
+        ahora = time.time()
+        if not forzar and mtime == self._mtime and ahora < self._proxima_expiracion:
+            return
+        with self._lock:
+            if forzar or mtime != self._mtime:
+                self._registro = self._leer_registro()
+                self._mtime = mtime
+            activas = self._vigentes(self._registro, ahora)
+            self._proxima_expiracion = min((d["expira"] for d in activas.values() if d.get("expira") is not None),
+                                           default=float("inf"))
+            aristas, factores = superposicion(activas, ahora)
+            # Solo las aristas cuyo factor cambia respecto a lo aplicado
+            todas = np.union1d(aristas, self._aristas)
+            nuevos = _factores_en(todas, aristas, factores)
+            cambian = nuevos != _factores_en(todas, self._aristas, self._factores)
+            if cambian.any():
+                self.escenarios.superponer(todas[cambian], nuevos[cambian])
+                self.aplicaciones += 1
+                self.aristas_cambiadas += int(cambian.sum())
+            self._aristas, self._factores = aristas, factores
+            self.huella = hashlib.sha1(json.dumps(activas, sort_keys=True).encode()).hexdigest()[:12] \
+                if activas else ""
+
+    def registrar(self, ident, tipo, aristas, factor=None, expira=None, descripcion=None):
+        """Alta (o sustitución) de una incidencia sobre ``aristas``; ``expira`` en segundos epoch."""
+        if tipo not in TIPOS:
+            raise ValueError(f"Tipo de incidencia desconocido: {tipo} (use {', '.join(TIPOS)})")
+        # Las incidencias solo pueden empeorar una arista: en la superposición
+        # manda el factor mayor partiendo de 1, así que uno menor no tendría efecto
+        if tipo == "lentitud" and not (factor is not None and np.isfinite(factor) and factor >= 1):
+            raise ValueError("Una lentitud necesita un factor de al menos 1 (2 = el doble de tiempo); "
+                             "una incidencia no puede acelerar el paso")
+        aristas = sorted({int(e) for e in aristas})
+        if not aristas:
+            raise ValueError("La incidencia no afecta a ninguna arista")
+        if aristas[0] < 0 or aristas[-1] >= self.escenarios.red.n_aristas:
+            raise ValueError("Arista fuera de la red")
+        incidencia = {"tipo": tipo, "factor": None if tipo == "corte" else float(factor), "aristas": aristas,
+                      "expira": None if expira is None else float(expira), "creada": time.time()}
+        if descripcion:
+            incidencia["descripcion"] = str(descripcion)
+        with self._bloqueo_registro():
+            # De paso se limpian las caducadas
+            registro = self._vigentes(self._leer_registro(), time.time())
+            registro[str(ident)] = incidencia
+            self._escribir_registro(registro)
+        self.sincronizar(forzar=True)
+        return self._describir(str(ident), incidencia)
+
+    def eliminar(self, ident):
+        with self._bloqueo_registro():
+            registro = self._vigentes(self._leer_registro(), time.time())
+            encontrada = registro.pop(str(ident), None) is not None
+            self._escribir_registro(registro)
+        self.sincronizar(forzar=True)
+        return encontrada
+
+    @staticmethod
+    def _describir(ident, d):
+        return {"id": ident, "tipo": d["tipo"], "factor": d["factor"], "aristas": len(d["aristas"]),
+                "expira": d["expira"], "descripcion": d.get("descripcion")}
+
+    def listar(self):
+        self.sincronizar()
+        with self._lock:
+            activas = self._vigentes(self._registro, time.time())
+        return [self._describir(i, d) for i, d in activas.items()]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "activas": len(self._vigentes(self._registro, time.time())),
+                "aristas": int(len(self._aristas)),
+                "aplicaciones": self.aplicaciones,
+                "aristas_cambiadas": self.aristas_cambiadas,
+            }
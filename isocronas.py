@@ -0,0 +1,71 @@
+"""
+Isocronas: zonas alcanzables en N minutos desde una o varias fuentes.
+
+Un único Dijkstra multi-fuente (``scipy.sparse.csgraph``, ``min_only``) acotado
+por el umbral mayor da el tiempo mínimo de llegada desde la fuente más
+cercana a cada nodo. Con ese vector se clasifica cada arista por el primer
+umbral en el que se recorre entera, y el polígono de cada umbral es el buffer
+de las calles alcanzables.
+"""
+import numpy as np
+import shapely
+from scipy.sparse.csgraph import dijkstra as _csgraph_dijkstra
+
+import motor_rutas
+
+BUFFER_M = 40.0       # anchura a cada lado de la calle en el polígono
+SIMPLIFICAR_M = 10.0  # tolerancia de simplificación del polígono
+
+
+def tiempos_llegada(matriz, fuentes, limite, costes=None):
+    """
+    Tiempo mínimo desde cualquiera de las ``fuentes`` a cada nodo (``inf`` más
+    allá de ``limite``). Con ``costes``, cada fuente parte con ese tiempo ya
+    consumido (p. ej. el tramo desde un punto a mitad de arista).
+    """
+    if costes is None:
+        return _csgraph_dijkstra(matriz, directed=True, indices=np.unique(fuentes), min_only=True, limit=limite)
+    n = matriz.shape[0]
+    virtual = motor_rutas.con_origen_virtual(matriz, fuentes, costes)
+    return _csgraph_dijkstra(virtual, directed=True, indices=n, limit=limite)[:n]
+
+
+def banda_aristas(red, pesos, llegada, umbrales):
+    """
+    Índice del primer umbral (ordenados de menor a mayor) en el que cada arista
+    se recorre entera; ``len(umbrales)`` si no se alcanza.
+    """
+    fin = llegada[red.edge_src] + pesos
+    return np.searchsorted(np.asarray(umbrales, dtype=np.float64), fin, side="left")
+
+
+def poligono_calles(red, aristas):
+    """Buffer (en metros, CRS de la red) de las calles indicadas."""
+    if len(aristas) == 0:
+        return shapely.Polygon()
+    # Una sola vez cada tramo aunque sea de doble sentido
+    u, v = red.edge_src[aristas], red.edge_dst[aristas]
+    claves = np.unique(np.minimum(u, v).astype(np.int64) * red.n_nodos + np.maximum(u, v))
+    a, b = claves // red.n_nodos, claves % red.n_nodos
+    tramos = shapely.linestrings(np.stack([
+        np.column_stack([red.node_x[a], red.node_y[a]]),
+        np.column_stack([red.node_x[b], red.node_y[b]]),
+    ], axis=1))
+    lineas = shapely.line_merge(shapely.multilinestrings(tramos))
+    return shapely.simplify(shapely.buffer(lineas, BUFFER_M, quad_segs=2), SIMPLIFICAR_M)
+
+
+def calcular(red, matriz, pesos, fuentes, umbrales_s, costes=None):
+    """
+    Isocronas acumuladas por umbral (segundos). Devuelve una lista, en el orden
+    de ``umbrales_s`` ascendente, de ``(umbral, aristas, poligono)`` donde
+    ``aristas`` son los ids alcanzables dentro del umbral.
+    """
+    umbrales = sorted(set(float(u) for u in umbrales_s))
+    llegada = tiempos_llegada(matriz, fuentes, umbrales[-1], costes)
+    banda = banda_aristas(red, pesos, llegada, umbrales)
+    resultado = []
+    for k, umbral in enumerate(umbrales):
+        aristas = np.flatnonzero(banda <= k)
+        resultado.append((umbral, aristas, poligono_calles(red, aristas)))
+    return resultado
@@ -0,0 +1,72 @@
+"""
+Memoria por proceso leída de ``/proc/<pid>/smaps_rollup`` (Linux).
+
+- ``rss``: páginas residentes, incluidas las compartidas con otros procesos.
+- ``pss``: las compartidas repartidas a partes iguales entre quienes las usan.
+- ``uss``: memoria única del proceso (privada), lo que se liberaría al
+  terminarlo. Es la cifra que confirma si los workers comparten la red
+  cargada en el maestro antes del fork.
+
+Fuera de Linux (sin ``/proc``) las funciones devuelven None / listas vacías.
+"""
+import os
+
+_CAMPOS = {"Rss": "rss", "Pss": "pss", "Private_Clean": "privada_limpia", "Private_Dirty": "privada_sucia"}
+
+
+def uso(pid=None):
+    """``{pid, nombre, rss_mb, pss_mb, uss_mb}`` del proceso o None si no se puede leer."""
+    pid = os.getpid() if pid is None else int(pid)
+    kb = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for linea in f:
+                campo, _, resto = linea.partition(":")
+                if campo in _CAMPOS:
+                    kb[_CAMPOS[campo]] = int(resto.split()[0])
+        with open(f"/proc/{pid}/comm") as f:
+            nombre = f.read().strip()
+    except (OSError, ValueError, IndexError):
+        return None
+    return {
+        "pid": pid,
+        "nombre": nombre,
+        "rss_mb": round(kb.get("rss", 0) / 1024, 1),
+        "pss_mb": round(kb.get("pss", 0) / 1024, 1),
+        "uss_mb": round((kb.get("privada_limpia", 0) + kb.get("privada_sucia", 0)) / 1024, 1),
+    }
+
+
+def _padre(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        # El nombre (campo 2) va entre paréntesis y puede contener espacios
+        return int(f.read().rsplit(")", 1)[1].split()[1])
+
+
+def descendientes(pid):
+    """Pids de todos los procesos descendientes de ``pid`` (workers, pool de cálculo...)."""
+    hijos = {}
+    for entrada in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if entrada.isdigit():
+            try:
+                hijos.setdefault(_padre(entrada), []).append(int(entrada))
+            except (OSError, ValueError, IndexError):
+                continue
+    resultado, pendientes = [], [int(pid)]
+    while pendientes:
+        for hijo in sorted(hijos.get(pendientes.pop(), [])):
+            resultado.append(hijo)
+            pendientes.append(hijo)
+    return resultado
+
+
+def informe(raiz=None):
+    """Memoria de ``raiz`` (por defecto este proceso) y de todos sus descendientes."""
+    raiz = os.getpid() if raiz is None else int(raiz)
+    procesos = [u for u in (uso(p) for p in [raiz] + descendientes(raiz)) if u is not None]
+    return {
+        "procesos": procesos,
+        "total_rss_mb": round(sum(p["rss_mb"] for p in procesos), 1),
+        "total_pss_mb": round(sum(p["pss_mb"] for p in procesos), 1),
+        "total_uss_mb": round(sum(p["uss_mb"] for p in procesos), 1),
+    }
@@ -0,0 +1,422 @@
+"""
+Métricas de rendimiento por etapa agregadas entre procesos (formato Prometheus).
+
+Cada petición abre una traza (``iniciar_traza``) y cada etapa instrumentada
+(``with etapa("busqueda"):``) suma su tiempo a ella; al cerrar la traza el
+total de cada etapa se observa una vez en su histograma y el mismo desglose
+sirve para la cabecera ``Server-Timing``. Fuera de una petición (pool de
+cálculo, scripts) cada etapa se observa directamente.
+
+Los histogramas y contadores viven en memoria del proceso. Un hilo por proceso
+publica cada segundo una instantánea JSON en ``<directorio>/<pid>.json`` y
+``/metrics`` suma las de todos los procesos (workers de Gunicorn y procesos
+del pool). La instantánea de un proceso muerto se suma a ``terminados.json``
+(histogramas y contadores; sus medidores se descartan) y se borra, así que los
+contadores no retroceden y el directorio no crece con cada reinicio de worker.
+
+Con ``METRICAS=0`` ``etapa`` devuelve un contexto vacío compartido y las
+trazas no se abren: el coste es una llamada a función por etapa.
+"""
+import bisect
+import fcntl
+import functools
+import glob
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+ACTIVAS = os.environ.get("METRICAS", "1") != "0"
+INTERVALO_PUBLICACION_S = 1.0
+TERMINADOS = "terminados.json"  # suma de los procesos que ya han terminado
+
+# Límites superiores (s) de los histogramas de tiempo
+LIMITES_S = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Límites de los histogramas de nodos asentados por búsqueda
+LIMITES_NODOS = (10, 30, 100, 300, 1000, 3000, 10000, 30000, 100000, 300000, 1000000)
+
+AYUDA = {
+    "rutas_etapa_segundos": "Tiempo por etapa del cálculo de rutas y de la predicción (por petición)",
+    "http_peticion_segundos": "Latencia de las peticiones HTTP por endpoint",
+    "rutas_nodos_asentados": "Nodos asentados por búsqueda de camino mínimo",
+}
+
+_lock = threading.Lock()
+_histogramas = {}  # (nombre, etiquetas) -> [limites, cuentas, suma]
+_contadores = {}   # (nombre, etiquetas) -> valor
+_colecciones = []  # funciones -> [(nombre, tipo, etiquetas, valor)] leídas al publicar
+_local = threading.local()
+_directorio = None
+_hilo_pid = None
+# Contadores de las colecciones heredados del padre (los publica él): se restan
+_base_coleccion = {}
+_coleccion_al_fork = {}
+
+
+def _contadores_coleccion():
+    valores = {}
+    for funcion in _colecciones:
+        try:
+            for n, tipo, e, v in funcion():
+                if tipo == "counter":
+                    valores[(n, _etiquetas(e))] = float(v)
+        except Exception:
+            continue
+    return valores
+
+
+def _antes_fork():
+    global _coleccion_al_fork
+    _coleccion_al_fork = _contadores_coleccion() if ACTIVAS else {}
+
+
+def _tras_fork():
+    # El hijo (worker o proceso del pool) empieza de cero: lo heredado ya lo
+    # publica el padre y el lock podía estar cogido por su hilo de publicación
+    global _lock, _histogramas, _contadores, _base_coleccion
+    _lock = threading.Lock()
+    _histogramas, _contadores = {}, {}
+    _base_coleccion = _coleccion_al_fork
+
+
+os.register_at_fork(before=_antes_fork, after_in_child=_tras_fork)
+
+
+# -------------------------
+# Registro en memoria
+# -------------------------
+def _etiquetas(etiquetas):
+    return tuple(sorted(etiquetas.items()))
+
+
+def observar(nombre, valor, limites=LIMITES_S, **etiquetas):
+    """Añade ``valor`` al histograma ``nombre`` con esas etiquetas."""
+    clave = (nombre, _etiquetas(etiquetas))
+    i = bisect.bisect_left(limites, valor)
+    with _lock:
+        h = _histogramas.get(clave)
+        if h is None:
+            h = _histogramas[clave] = [limites, [0] * (len(limites) + 1), 0.0]
+        h[1][i] += 1
+        h[2] += valor
+    _arrancar_publicacion()
+
+
+def contar(nombre, valor=1, **etiquetas):
+    clave = (nombre, _etiquetas(etiquetas))
+    with _lock:
+        _contadores[clave] = _contadores.get(clave, 0) + valor
+    _arrancar_publicacion()
+
+
+def registrar_coleccion(funcion):
+    """
+    ``funcion()`` devuelve ``[(nombre, "counter"|"gauge", {etiquetas}, valor)]``
+    con estadísticas que ya lleva otro objeto (cachés, pool...); se lee al publicar.
+    """
+    _colecciones.append(funcion)
+
+
+# -------------------------
+# Etapas y trazas por petición
+# -------------------------
+class _Etapa:
+    __slots__ = ("nombre", "t0")
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        segundos = time.perf_counter() - self.t0
+        traza = getattr(_local, "traza", None)
+        if traza is None:
+            observar("rutas_etapa_segundos", segundos, etapa=self.nombre)
+        else:
+            traza[self.nombre] = traza.get(self.nombre, 0.0) + segundos
+        return False
+
+
+class _Nulo:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULO = _Nulo()
+
+
+def etapa(nombre):
+    """Contexto que mide una etapa (``reproyeccion``, ``ajuste``, ``busqueda``...)."""
+    return _Etapa(nombre) if ACTIVAS else _NULO
+
+
+def iniciar_traza():
+    if ACTIVAS:
+        _local.traza = {}
+        _local.inicio = time.perf_counter()
+
+
+def cerrar_traza(endpoint=None):
+    """
+    Observa el total de cada etapa de la petición (y su latencia si se da
+    ``endpoint``) y devuelve ``{etapa: segundos}`` (``total`` incluido).
+    """
+    traza = getattr(_local, "traza", None)
+    if traza is None:
+        return {}
+    _local.traza = None
+    for nombre, segundos in traza.items():
+        observar("rutas_etapa_segundos", segundos, etapa=nombre)
+    traza["total"] = time.perf_counter() - _local.inicio
+    if endpoint:
+        observar("http_peticion_segundos", traza["total"], endpoint=endpoint)
+    return traza
+
+
+def en_traza(funcion):
+    """Decorador: la llamada abre su propia traza si no hay una abierta (procesos del pool)."""
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        if not ACTIVAS or getattr(_local, "traza", None) is not None:
+            return funcion(*args, **kwargs)
+        iniciar_traza()
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            cerrar_traza()
+    return envoltura
+
+
+def asentados(stats):
+    """Registra los nodos asentados que un motor dejó en ``stats`` (dict o None)."""
+    if stats and "settled" in stats:
+        observar("rutas_nodos_asentados", stats["settled"], limites=LIMITES_NODOS)
+
+
+def stats_busqueda():
+    """Dict para el ``stats`` de los motores (None si las métricas están desactivadas)."""
+    return {} if ACTIVAS else None
+
+
+def server_timing(traza):
+    """Valor de la cabecera ``Server-Timing`` (ms) para una traza cerrada."""
+    return ", ".join(f"{nombre};dur={segundos * 1000:.3f}" for nombre, segundos in traza.items())
+
+
+# -------------------------
+# Publicación y agregación entre procesos
+# -------------------------
+def configurar(directorio, limpiar=True):
+    """
+    Activa la publicación en ``directorio`` (uno por servidor). Se llama en el
+    proceso maestro antes del fork; ``limpiar`` borra instantáneas anteriores.
+    """
+    global _directorio
+    if limpiar and os.path.isdir(directorio):
+        shutil.rmtree(directorio, ignore_errors=True)
+    os.makedirs(directorio, exist_ok=True)
+    _directorio = directorio
+
+
+def directorio_por_defecto(pid_maestro):
+    return os.path.join(tempfile.gettempdir(), f"prediccion_trafico_metricas_{pid_maestro}")
+
+
+def _arrancar_publicacion():
+    # Los hilos no sobreviven al fork: uno por proceso, al observar por primera vez
+    global _hilo_pid
+    if _directorio is None or _hilo_pid == os.getpid():
+        return
+    with _lock:
+        if _hilo_pid == os.getpid():
+            return
+        _hilo_pid = os.getpid()
+    threading.Thread(target=_publicar_periodicamente, name="metricas", daemon=True).start()
+
+
+def _publicar_periodicamente():
+    while True:
+        time.sleep(INTERVALO_PUBLICACION_S)
+        try:
+            publicar()
+        except Exception as e:
+            print(f"❌ Error publicando métricas: {e}")
+
+
+def instantanea():
+    """Estado de este proceso serializable a JSON."""
+    coleccion = []
+    for funcion in _colecciones:
+        try:
+            coleccion += [[n, t, e, float(v) - (_base_coleccion.get((n, _etiquetas(e)), 0.0) if t == "counter" else 0.0)]
+                          for n, t, e, v in funcion()]
+        except Exception:
+            continue  # p. ej. la red aún no está cargada
+    with _lock:
+        return {
+            "pid": os.getpid(),
+            "histogramas": [[n, list(e), list(h[0]), list(h[1]), h[2]] for (n, e), h in _histogramas.items()],
+            "contadores": [[n, list(e), v] for (n, e), v in _contadores.items()],
+            "coleccion": coleccion,
+        }
+
+
+def publicar():
+    if _directorio is None:
+        return
+    fd, tmp = tempfile.mkstemp(prefix=".metricas_", dir=_directorio)
+    with os.fdopen(fd, "w") as f:
+        json.dump(instantanea(), f)
+    os.replace(tmp, os.path.join(_directorio, f"{os.getpid()}.json"))
+
+
+def _vivo(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _leer_instantanea(ruta):
+    try:
+        with open(ruta) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _sumar(inst, histogramas, contadores, medidores=None):
+    """Añade una instantánea a los totales (los medidores solo si ``medidores`` no es None)."""
+    for n, e, limites, cuentas, suma in inst["histogramas"]:
+        clave = (n, tuple(map(tuple, e)))
+        h = histogramas.setdefault(clave, [limites, [0] * len(cuentas), 0.0])
+        h[1] = [a + b for a, b in zip(h[1], cuentas)]
+        h[2] += suma
+    for n, e, v in inst["contadores"]:
+        clave = (n, tuple(map(tuple, e)))
+        contadores[clave] = contadores.get(clave, 0) + v
+    for n, tipo, e, v in inst["coleccion"]:
+        clave = (n, tuple(sorted(e.items())))
+        if tipo == "counter":
+            contadores[clave] = contadores.get(clave, 0) + v
+        elif medidores is not None:
+            medidores[clave] = medidores.get(clave, 0) + v
+
+
+def _podar():
+    """Suma a ``TERMINADOS`` las instantáneas de procesos que ya no existen y las borra."""
+    muertas = []
+    for ruta in glob.glob(os.path.join(_directorio, "*.json")):
+        nombre = os.path.basename(ruta)[:-len(".json")]
+        if nombre.isdigit() and int(nombre) != os.getpid() and not _vivo(int(nombre)):
+            muertas.append(ruta)
+    if not muertas:
+        return
+    # Un solo proceso a la vez: si dos sumaran la misma instantánea se contaría dos veces
+    with open(os.path.join(_directorio, ".terminados.lock"), "a") as bloqueo:
+        fcntl.flock(bloqueo, fcntl.LOCK_EX)
+        histogramas, contadores = {}, {}
+        total = _leer_instantanea(os.path.join(_directorio, TERMINADOS))
+        if total is not None:
+            _sumar(total, histogramas, contadores)
+        sumadas = []
+        for ruta in muertas:
+            inst = _leer_instantanea(ruta)  # None si otro proceso ya la ha podado
+            if inst is not None:
+                _sumar(inst, histogramas, contadores)
+                sumadas.append(ruta)
+        if not sumadas:
+            return
+        fd, tmp = tempfile.mkstemp(prefix=".metricas_", dir=_directorio)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"pid": None,
+                       "histogramas": [[n, list(e), l, c, s] for (n, e), (l, c, s) in histogramas.items()],
+                       "contadores": [[n, list(e), v] for (n, e), v in contadores.items()],
+                       "coleccion": []}, f)
+        os.replace(tmp, os.path.join(_directorio, TERMINADOS))
+        for ruta in sumadas:
+            os.remove(ruta)
+
+
+def agregar():
+    """Suma de las instantáneas de todos los procesos (o solo la de este si no se publica)."""
+    if _directorio is None:
+        instantaneas = [instantanea()]
+    else:
+        publicar()
+        _podar()
+        instantaneas = [inst for inst in map(_leer_instantanea, glob.glob(os.path.join(_directorio, "*.json")))
+                        if inst is not None]
+    histogramas, contadores, medidores = {}, {}, {}
+    for inst in instantaneas:
+        vivo = inst["pid"] is not None and (inst["pid"] == os.getpid() or _vivo(inst["pid"]))
+        _sumar(inst, histogramas, contadores, medidores if vivo else None)
+    # Tasa de aciertos de cada caché con los contadores ya sumados entre procesos
+    for (n, e), aciertos in list(contadores.items()):
+        if n == "cache_aciertos_total":
+            total = aciertos + contadores.get(("cache_fallos_total", e), 0)
+            medidores[("cache_tasa_aciertos", e)] = round(aciertos / total, 4) if total else 0.0
+    return {"procesos": sum(inst["pid"] is not None for inst in instantaneas), "histogramas": histogramas,
+            "contadores": contadores, "medidores": medidores}
+
+
+# -------------------------
+# Formato de exposición de Prometheus
+# -------------------------
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _formato_etiquetas(etiquetas, extra=()):
+    pares = list(etiquetas) + list(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in pares) + "}"
+
+
+def _numero(v):
+    return repr(float(v)) if isinstance(v, float) and not float(v).is_integer() else str(int(v))
+
+
+def prometheus(agregado=None):
+    """Texto en formato de exposición 0.0.4 de Prometheus."""
+    agregado = agregado or agregar()
+    lineas = []
+    por_nombre = {}
+    for (n, e), h in sorted(agregado["histogramas"].items()):
+        por_nombre.setdefault(n, []).append((e, h))
+    for n, series in por_nombre.items():
+        if n in AYUDA:
+            lineas.append(f"# HELP {n} {AYUDA[n]}")
+        lineas.append(f"# TYPE {n} histogram")
+        for e, (limites, cuentas, suma) in series:
+            acumulado = 0
+            for limite, c in zip(list(limites) + ["+Inf"], cuentas):
+                acumulado += c
+                le = limite if limite == "+Inf" else _numero(limite)
+                lineas.append(f"{n}_bucket{_formato_etiquetas(e, [('le', le)])} {acumulado}")
+            lineas.append(f"{n}_sum{_formato_etiquetas(e)} {repr(float(suma))}")
+            lineas.append(f"{n}_count{_formato_etiquetas(e)} {acumulado}")
+    for tipo, valores in (("counter", agregado["contadores"]), ("gauge", agregado["medidores"])):
+        vistos = set()
+        for (n, e), v in sorted(valores.items()):
+            if n not in vistos:
+                vistos.add(n)
+                lineas.append(f"# TYPE {n} {tipo}")
+            lineas.append(f"{n}{_formato_etiquetas(e)} {_numero(v)}")
+    lineas.append("# TYPE metricas_procesos gauge")
+    lineas.append(f"metricas_procesos {agregado['procesos']}")
+    return "\n".join(lineas) + "\n"
@@ -1,7 +1,34 @@
+"""
+Generación del dataset sintético de tráfico por bloques.
+
+Las reglas solo dependen de (día de la semana, vacaciones, franja, zona), así
+que se evalúan una vez en un tensor de probabilidades y cada partición (un mes)
+se muestrea con una única extracción vectorizada. Cada mes tiene su propio
+generador sembrado con (semilla, año, mes): el resultado no depende del rango
+pedido ni del orden en que se escriban las particiones.
+
+    python ml/generar_dataset_trafico.py                       # último año -> CSV único
+    python ml/generar_dataset_trafico.py --inicio 2015-01-01 --fin 2024-12-31 \
+        --salida ml/dataset_trafico                            # Parquet particionado por mes
+"""
+import argparse
 import pandas as pd
 import numpy as np
+import os
+import sys
+import time
 from datetime import datetime, timedelta
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tabla_prediccion import MINUTOS_FRANJA, FRANJAS_DIA, vacaciones_vector
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
 # -------------------------
 # Configuración
 # -------------------------
@@ -14,27 +41,15 @@ zonas = [
     "Sur"
 ]
 
-# Periodos vacacionales (Tráfico baja en zonas escolares/laborales, sube en salidas)
-vacaciones_periodos = [
-    ("2024-03-22", "2024-04-01"), # Semana Santa
-    ("2024-07-15", "2024-08-31"), # Verano
-    ("2024-12-22", "2025-01-07"), # Navidad
-]
-
-def es_vacaciones(fecha):
-    s_fecha = fecha.strftime("%Y-%m-%d")
-    for ini, fin in vacaciones_periodos:
-        if ini <= s_fecha <= fin:
-            return True
-    return False
+# Periodos vacacionales (Tráfico baja en zonas escolares/laborales, sube en salidas):
+# el calendario de tabla_prediccion, el mismo que usa el servidor, para cualquier año
 
-def obtener_trafico_zona(fecha, zona):
+def probabilidades_dia(dia_semana, vacaciones, zona):
     """
-    Devuelve nivel de tráfico (0, 1, 2) basado en reglas de negocio específicas
-    0: Fluido | 1: Moderado | 2: Denso
+    Probabilidades [Fluido, Moderado, Denso] del día según reglas de negocio
+    específicas de cada zona (el "carácter" del día, antes de la hora).
+    ``dia_semana``: 0=Lun, 1=Mar, ..., 5=Sab, 6=Dom.
     """
-    dia_semana = fecha.weekday() # 0=Lun, 1=Mar, ..., 5=Sab, 6=Dom
-    vacaciones = es_vacaciones(fecha)
     
     # Probabilidad base [Bajo, Medio, Alto]
     probs = [1.0, 0.0, 0.0] 
@@ -116,44 +131,144 @@ def obtener_trafico_zona(fecha, zona):
         else: # Resto de días fluido (es una urba externa)
             probs = [0.9, 0.1, 0.0]
 
-    # Elegir nivel basado en probabilidad (añade "ruido" natural)
-    return np.random.choice([0, 1, 2], p=probs)
+    return probs
 
 # -------------------------
-# Generación
+# Perfil horario
 # -------------------------
-print("Generando dataset de tráfico realista...")
-data = []
+# Intensidad relativa por hora (0 = madrugada vacía, 1 = pico normal, >1 pico
+# acusado) que reparte la congestión del día entre sus franjas
+LABORABLE = [0.05] * 6 + [0.5, 1.2, 1.2, 0.7, 0.5, 0.5, 0.6, 0.9, 0.9, 0.6, 0.6, 1.0, 1.2, 1.2, 0.6, 0.4, 0.2, 0.1]
+FINDE = [0.1] * 6 + [0.1, 0.2, 0.3, 0.5, 0.8, 1.0, 1.0, 0.9, 0.6, 0.5, 0.6, 0.8, 1.0, 1.0, 0.7, 0.5, 0.3, 0.2]
 
-# Últimos 12 meses
-fecha_fin = datetime.now()
-fecha_ini = fecha_fin - timedelta(days=365)
-dias_totales = (fecha_fin - fecha_ini).days
+def intensidad_hora(zona, dia_semana, vacaciones, hora):
+    laborable = dia_semana <= 4 and not vacaciones
+    perfil = LABORABLE if laborable else FINDE
 
-for i in range(dias_totales):
-    fecha_actual = fecha_ini + timedelta(days=i)
-    fecha_str = fecha_actual.strftime("%Y-%m-%d")
-    
-    dia_semana = fecha_actual.weekday()
-    es_finde = 1 if dia_semana >= 5 else 0
-    vacaciones = 1 if es_vacaciones(fecha_actual) else 0
-
-    for zona in zonas:
-        nivel = obtener_trafico_zona(fecha_actual, zona)
-        
-        data.append({
-            "fecha": fecha_str,
-            "dia_semana": dia_semana,
-            "es_fin_de_semana": es_finde,
-            "vacaciones": vacaciones,
-            "zona": zona,
-            "nivel_trafico": nivel
-        })
-
-# Crear DataFrame y guardar
-df = pd.DataFrame(data)
-csv_name = "trafico_sintetico_mostoles.csv"
-df.to_csv(csv_name, index=False)
-
-print(f"✅ Dataset generado: {csv_name} con {len(df)} registros.")
-print(df.sample(10)) # Muestra aleatoria para verificar variedad
\ No newline at end of file
+    if zona == "Parque Coimbra – Guadarrama":
+        # Urbanización externa: solo la salida del viernes tarde y el retorno del domingo tarde
+        if dia_semana == 4 and 15 <= hora < 21:
+            return 1.3
+        if dia_semana == 6 and 17 <= hora < 22:
+            return 1.3
+        return 0.2 * perfil[hora]
+    if zona == "Centro" and dia_semana == 5:
+        # Sábado comercial: mañana y tarde de tiendas
+        return 1.3 if 11 <= hora < 14 or 17 <= hora < 21 else 0.6 * perfil[hora]
+    if zona == "Centro" and dia_semana == 4 and 18 <= hora < 23:
+        return 1.3  # viernes tarde (ocio)
+    if zona == "Sur – Este" and laborable:
+        # Turnos de los polígonos
+        return 1.3 if 6 <= hora < 9 or 14 <= hora < 16 else 0.5 * perfil[hora]
+    if zona == "Sur" and laborable:
+        if dia_semana == 0 and 7 <= hora < 10:
+            return 1.3  # entrada del lunes
+        if dia_semana == 4 and 15 <= hora < 20:
+            return 1.3  # salida del viernes
+    return perfil[hora]
+
+def probabilidades_franja(dia_semana, vacaciones, franja, zona):
+    """[Fluido, Moderado, Denso] de la zona en la franja horaria."""
+    probs = probabilidades_dia(dia_semana, vacaciones, zona)
+    f = intensidad_hora(zona, dia_semana, vacaciones, franja * MINUTOS_FRANJA // 60)
+    # La masa de Moderado + Denso escala con la intensidad de la hora
+    congestion = probs[1] + probs[2]
+    if congestion > 0:
+        escala = min(1.0, congestion * f) / congestion
+        probs = [1.0 - congestion * escala, probs[1] * escala, probs[2] * escala]
+    return probs
+
+def tabla_probabilidades():
+    """
+    Probabilidades acumuladas de Fluido y Fluido+Moderado para cada
+    (día de la semana, vacaciones, franja, zona): array 7 x 2 x FRANJAS_DIA x zonas x 2.
+    """
+    acumuladas = np.zeros((7, 2, FRANJAS_DIA, len(zonas), 2))
+    for dia in range(7):
+        for vac in range(2):
+            for franja in range(FRANJAS_DIA):
+                for k, zona in enumerate(zonas):
+                    acumuladas[dia, vac, franja, k] = np.cumsum(probabilidades_franja(dia, bool(vac), franja, zona))[:2]
+    return acumuladas
+
+# -------------------------
+# Generación por bloques
+# -------------------------
+COLUMNAS = ["fecha", "dia_semana", "es_fin_de_semana", "vacaciones", "franja", "zona", "nivel_trafico"]
+
+def bloque(fechas, acumuladas, rng):
+    """
+    Filas de un bloque de días (DatetimeIndex): todas las fechas x franjas x
+    zonas con una sola extracción uniforme y muestreo por CDF inversa
+    0: Fluido | 1: Moderado | 2: Denso (añade "ruido" natural).
+    """
+    dia = fechas.weekday.to_numpy()
+    vac = vacaciones_vector(fechas)
+    cdf = acumuladas[dia, vac]  # n x franjas x zonas x 2
+    u = rng.random(cdf.shape[:3])
+    nivel = (u >= cdf[..., 0]).astype(np.int8) + (u >= cdf[..., 1])
+
+    n_fr, n_z = FRANJAS_DIA, len(zonas)
+    por_fecha = n_fr * n_z
+    return pd.DataFrame({
+        "fecha": np.repeat(fechas.strftime("%Y-%m-%d").to_numpy(), por_fecha),
+        "dia_semana": np.repeat(dia.astype(np.int8), por_fecha),
+        "es_fin_de_semana": np.repeat((dia >= 5).astype(np.int8), por_fecha),
+        "vacaciones": np.repeat(vac, por_fecha),
+        "franja": np.tile(np.repeat(np.arange(n_fr, dtype=np.int16), n_z), len(fechas)),
+        "zona": pd.Categorical.from_codes(np.tile(np.arange(n_z), len(fechas) * n_fr), categories=zonas),
+        "nivel_trafico": nivel.ravel(),
+    }, columns=COLUMNAS)
+
+def generar(inicio, fin, semilla=42):
+    """Genera ``(mes 'YYYY-MM', DataFrame)`` mes a mes entre ``inicio`` y ``fin`` (incluidos)."""
+    acumuladas = tabla_probabilidades()
+    dias = pd.date_range(pd.Timestamp(inicio).normalize(), pd.Timestamp(fin).normalize(), freq="D")
+    for periodo, fechas in dias.groupby(dias.to_period("M")).items():
+        # Generador propio por mes: reproducible sea cual sea el rango pedido
+        rng = np.random.default_rng([semilla, periodo.year, periodo.month])
+        yield str(periodo), bloque(pd.DatetimeIndex(fechas), acumuladas, rng)
+
+def escribir_particion(directorio, mes, df, formato):
+    """``<directorio>/mes=YYYY-MM/parte.<formato>`` (esquema hive, legible por pyarrow.dataset)."""
+    carpeta = os.path.join(directorio, f"mes={mes}")
+    os.makedirs(carpeta, exist_ok=True)
+    if formato == "parquet":
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), os.path.join(carpeta, "parte.parquet"),
+                       compression="zstd")
+    else:
+        df.to_csv(os.path.join(carpeta, "parte.csv"), index=False)
+
+def main():
+    parser = argparse.ArgumentParser(description="Dataset sintético de tráfico por franjas horarias")
+    hoy = datetime.now().date()
+    parser.add_argument("--inicio", default=str(hoy - timedelta(days=365)), help="primer día (YYYY-MM-DD)")
+    parser.add_argument("--fin", default=str(hoy - timedelta(days=1)), help="último día (YYYY-MM-DD)")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--salida", default="ml/trafico_sintetico_mostoles.csv",
+                        help="fichero .csv único o directorio de particiones mensuales")
+    parser.add_argument("--formato", choices=["parquet", "csv"], default="parquet",
+                        help="formato de las particiones (sin pyarrow se usa csv)")
+    args = parser.parse_args()
+
+    formato = args.formato
+    unico = args.salida.endswith(".csv")
+    if not unico and formato == "parquet" and not PYARROW_AVAILABLE:
+        print("⚠️  pyarrow no está instalado: particiones en CSV (pip install pyarrow)")
+        formato = "csv"
+
+    print(f"Generando dataset de tráfico realista (franjas de {MINUTOS_FRANJA} min, {args.inicio} a {args.fin})...")
+    t0 = time.perf_counter()
+    filas = 0
+    for i, (mes, df) in enumerate(generar(args.inicio, args.fin, args.semilla)):
+        if unico:
+            # Un solo CSV escrito mes a mes (no se acumula el dataset en memoria)
+            df.to_csv(args.salida, index=False, mode="w" if i == 0 else "a", header=i == 0)
+        else:
+            escribir_particion(args.salida, mes, df, formato)
+        filas += len(df)
+
+    print(f"✅ Dataset generado: {args.salida} con {filas} registros en {time.perf_counter() - t0:.1f} s.")
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,175 @@
-import pandas as pd
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.preprocessing import LabelEncoder
-from sklearn.model_selection import train_test_split
-import joblib
-
-# Cargar dataset
-df = pd.read_csv("ml/trafico_sintetico_mostoles.csv")
-
-# Codificar zona
-le_zona = LabelEncoder()
-df["zona_encoded"] = le_zona.fit_transform(df["zona"])
-
-X = df[[
-    "dia_semana",
-    "es_fin_de_semana",
-    "vacaciones",
-    "zona_encoded"
-]]
-
-y = df["nivel_trafico"]
-
-# Split
-X_train, X_test, y_train, y_test = train_test_split(
-    X, y, test_size=0.2, random_state=42
-)
-
-# Modelo
-model = RandomForestClassifier(
-    n_estimators=100,
-    max_depth=8,
-    random_state=42
-)
-
-model.fit(X_train, y_train)
-
-# Guardar modelo y encoder
-joblib.dump(model, "modelo_trafico.pkl")
-joblib.dump(le_zona, "encoder_zona.pkl")
-
-print("Modelo entrenado y guardado")
+"""
+Entrenamiento del modelo de tráfico.
+
+- ``completo`` (por defecto): el CSV entero en memoria y split 80/20.
+- ``agregado``: recorre el dataset por bloques (CSV único o directorio de
+  particiones mensuales Parquet/CSV) contando cuántas veces aparece cada nivel
+  en cada combinación de features. Las features son categóricas (día, fin de
+  semana, vacaciones, franja, zona), así que son unos pocos miles de
+  combinaciones aunque el histórico tenga años: el bosque se ajusta sobre ellas
+  con los conteos como ``sample_weight``. Test: uno de cada cinco días.
+- ``muestra``: muestra uniforme de ``--max-filas`` filas tomada en streaming
+  (reservoir) y ajuste como en ``completo``.
+
+    python ml/train_trafico_model.py
+    python ml/train_trafico_model.py --datos ml/dataset_trafico --modo agregado
+"""
+import argparse
+import glob
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import LabelEncoder
+from sklearn.model_selection import train_test_split
+import joblib
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tabla_prediccion
+
+try:
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# Columnas de entrada: la zona se codifica al entrenar
+CLAVE = ["dia_semana", "es_fin_de_semana", "vacaciones", "franja", "zona"]
+COLUMNAS = ["fecha"] + CLAVE + ["nivel_trafico"]
+TIPOS = {"dia_semana": "int8", "es_fin_de_semana": "int8", "vacaciones": "int8", "franja": "int16",
+         "zona": "category", "nivel_trafico": "int8"}
+
+def nuevo_modelo():
+    return RandomForestClassifier(
+        n_estimators=100,
+        max_depth=8,
+        random_state=42
+    )
+
+# -------------------------
+# Lectura por bloques
+# -------------------------
+def leer_bloques(ruta, filas_bloque):
+    """DataFrames de como mucho ``filas_bloque`` filas de un CSV o de un directorio de particiones."""
+    if not os.path.isdir(ruta):
+        yield from pd.read_csv(ruta, usecols=COLUMNAS, dtype=TIPOS, chunksize=filas_bloque)
+        return
+    partes = sorted(glob.glob(os.path.join(ruta, "*", "parte.*")))
+    if not partes:
+        raise SystemExit(f"❌ No hay particiones en {ruta}")
+    for parte in partes:
+        if parte.endswith(".parquet"):
+            if not PYARROW_AVAILABLE:
+                raise SystemExit("❌ Para leer Parquet hace falta pyarrow (pip install pyarrow)")
+            for lote in pq.ParquetFile(parte).iter_batches(batch_size=filas_bloque, columns=COLUMNAS):
+                yield lote.to_pandas()
+        else:
+            yield from pd.read_csv(parte, usecols=COLUMNAS, dtype=TIPOS, chunksize=filas_bloque)
+
+def es_test(fechas):
+    # Hold-out por días completos: uno de cada cinco
+    return pd.to_datetime(fechas).to_numpy().astype("datetime64[D]").astype(np.int64) % 5 == 0
+
+# -------------------------
+# Modos de entrenamiento
+# -------------------------
+def entrenar_completo(ruta):
+    df = pd.read_csv(ruta)
+    le_zona = LabelEncoder()
+    df["zona_encoded"] = le_zona.fit_transform(df["zona"])
+
+    # dia_semana, es_fin_de_semana, vacaciones, franja (horaria), zona_encoded
+    X = df[tabla_prediccion.COLUMNAS_MODELO]
+    y = df["nivel_trafico"]
+
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.2, random_state=42
+    )
+    model = nuevo_modelo()
+    model.fit(X_train, y_train)
+    return model, le_zona, model.score(X_test, y_test), len(df)
+
+def agregar(bloques):
+    """Conteo de filas por (test, combinación de features, nivel), bloque a bloque."""
+    total = None
+    for df in bloques:
+        df = df.assign(zona=df["zona"].astype(str), test=es_test(df["fecha"]))
+        conteo = df.groupby(["test"] + CLAVE + ["nivel_trafico"]).size()
+        total = conteo if total is None else total.add(conteo, fill_value=0)
+    if total is None:
+        raise SystemExit("❌ Dataset vacío")
+    return total.rename("n").reset_index()
+
+def entrenar_agregado(bloques):
+    tabla = agregar(bloques)
+    le_zona = LabelEncoder()
+    tabla["zona_encoded"] = le_zona.fit_transform(tabla["zona"])
+    train, test = tabla[~tabla["test"]], tabla[tabla["test"]]
+    model = nuevo_modelo()
+    model.fit(train[tabla_prediccion.COLUMNAS_MODELO], train["nivel_trafico"], sample_weight=train["n"])
+    acierto = model.score(test[tabla_prediccion.COLUMNAS_MODELO], test["nivel_trafico"], sample_weight=test["n"])
+    return model, le_zona, acierto, int(tabla["n"].sum())
+
+def muestrear(bloques, max_filas, semilla=42):
+    """Muestra uniforme sin reemplazo de ``max_filas`` filas: memoria acotada a muestra + bloque."""
+    rng = np.random.default_rng(semilla)
+    muestra, filas = None, 0
+    for df in bloques:
+        filas += len(df)
+        df = df.assign(zona=df["zona"].astype(str), _clave=rng.random(len(df)))
+        muestra = df if muestra is None else pd.concat([muestra, df], ignore_index=True)
+        if len(muestra) > max_filas:
+            muestra = muestra.nsmallest(max_filas, "_clave")
+    if muestra is None:
+        raise SystemExit("❌ Dataset vacío")
+    return muestra.drop(columns="_clave").reset_index(drop=True), filas
+
+def entrenar_muestra(bloques, max_filas):
+    df, filas = muestrear(bloques, max_filas)
+    le_zona = LabelEncoder()
+    df["zona_encoded"] = le_zona.fit_transform(df["zona"])
+    X_train, X_test, y_train, y_test = train_test_split(
+        df[tabla_prediccion.COLUMNAS_MODELO], df["nivel_trafico"], test_size=0.2, random_state=42
+    )
+    model = nuevo_modelo()
+    model.fit(X_train, y_train)
+    return model, le_zona, model.score(X_test, y_test), filas
+
+def main():
+    parser = argparse.ArgumentParser(description="Entrena el modelo de tráfico y su tabla de predicción")
+    parser.add_argument("--datos", default="ml/trafico_sintetico_mostoles.csv",
+                        help="CSV o directorio de particiones de generar_dataset_trafico.py")
+    parser.add_argument("--modo", choices=["completo", "agregado", "muestra"], default=None,
+                        help="por defecto: completo para un CSV, agregado para un directorio")
+    parser.add_argument("--filas-bloque", type=int, default=500_000)
+    parser.add_argument("--max-filas", type=int, default=2_000_000, help="tamaño de la muestra (modo muestra)")
+    args = parser.parse_args()
+
+    modo = args.modo or ("agregado" if os.path.isdir(args.datos) else "completo")
+    if modo == "completo":
+        if os.path.isdir(args.datos):
+            raise SystemExit("❌ El modo completo necesita un CSV; use --modo agregado o muestra")
+        model, le_zona, acierto, filas = entrenar_completo(args.datos)
+    elif modo == "agregado":
+        model, le_zona, acierto, filas = entrenar_agregado(leer_bloques(args.datos, args.filas_bloque))
+    else:
+        model, le_zona, acierto, filas = entrenar_muestra(leer_bloques(args.datos, args.filas_bloque),
+                                                         args.max_filas)
+    print(f"Modo {modo}: {filas} filas, acierto en test {acierto:.3f}")
+
+    # Guardar modelo y encoder
+    joblib.dump(model, "modelo_trafico.pkl")
+    joblib.dump(le_zona, "encoder_zona.pkl")
+
+    # Tabla precalculada (7 días x 2 vacaciones x franjas x zonas), verificada contra predict
+    tabla = tabla_prediccion.construir_tabla(model, le_zona, "modelo_trafico.pkl")
+    errores = tabla_prediccion.verificar_tabla(tabla, model, le_zona)
+    if errores:
+        raise SystemExit(f"La tabla de predicción difiere del modelo en {errores} celdas")
+    tabla_prediccion.guardar_tabla(tabla)
+
+    print("Modelo entrenado y guardado")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Entrenamiento del modelo de tráfico por tramo.
+
+No hay aforos por calle, así que las observaciones son sintéticas (como el
+dataset por zonas): para tramos y niveles de zona al azar se genera el factor
+de tiempo observado. Las vías principales se congestionan más que las
+residenciales, más cuanto más rápidas y más cerca del centro, con ruido
+lognormal. El hold-out es por tramos: el modelo se evalúa en calles que no vio.
+
+Guarda ``modelo_tramos.pkl``; el servidor (PESOS_TRAFICO=tramo) predice con él
+la tabla de factores de todas las aristas la primera vez que lo ve.
+
+    python ml/train_trafico_tramos.py
+"""
+import argparse
+import os
+import sys
+
+import joblib
+import numpy as np
+from sklearn.ensemble import HistGradientBoostingRegressor
+from sklearn.metrics import mean_absolute_error, r2_score
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import motor_rutas
+import trafico_tramos
+
+# Sensibilidad a la congestión por posición en trafico_tramos.JERARQUIA_VIAS (+ desconocidas)
+SENSIBILIDAD = np.array([1.1, 1.1, 1.25, 1.2, 1.1, 1.0, 0.8, 0.7, 0.6, 0.8])
+RADIO_CENTRO_M = 800.0
+
+
+def factor_real(estaticas, niveles, centro):
+    """Factor "verdadero" de cada observación (sin ruido)."""
+    jer, velocidad, x, y = (estaticas[:, i] for i in range(4))
+    base = np.array([motor_rutas.FACTORES_TRAFICO[n] for n in range(trafico_tramos.NIVELES)])[niveles]
+    d2 = (x - centro[0]) ** 2 + (y - centro[1]) ** 2
+    centralidad = 1 + 0.5 * np.exp(-d2 / (2 * RADIO_CENTRO_M ** 2))
+    rapidez = 0.8 + 0.4 * np.minimum(velocidad, 80) / 80
+    return 1 + (base - 1) * SENSIBILIDAD[jer.astype(int)] * centralidad * rapidez
+
+
+def observaciones(red, n, semilla):
+    """``n`` observaciones (features, factor) de tramos y niveles al azar."""
+    rng = np.random.default_rng(semilla)
+    estaticas = trafico_tramos.features_estaticas(red)
+    centro = (float(np.mean(red.node_x)), float(np.mean(red.node_y)))
+    aristas = rng.integers(0, red.n_aristas, n)
+    niveles = rng.integers(0, trafico_tramos.NIVELES, n)
+    y = factor_real(estaticas[aristas], niveles, centro) * rng.lognormal(0.0, 0.1, n)
+    X = np.column_stack([niveles.astype(np.float32), estaticas[aristas]])
+    return X, np.maximum(y, 1.0), aristas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Entrena el modelo de tráfico por tramo")
+    parser.add_argument("--observaciones", type=int, default=300_000)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--salida", default=trafico_tramos.MODELO_TRAMOS_PATH)
+    args = parser.parse_args()
+
+    import callejero_mostoles_mod as cm
+    red = cm.red
+
+    X, y, aristas = observaciones(red, args.observaciones, args.semilla)
+    # Hold-out por tramos: uno de cada cinco
+    test = aristas % 5 == 0
+    model = HistGradientBoostingRegressor(max_iter=200, random_state=args.semilla)
+    model.fit(X[~test], y[~test])
+    pred = model.predict(X[test])
+    print(f"{len(y)} observaciones de {len(np.unique(aristas))} tramos: "
+          f"MAE {mean_absolute_error(y[test], pred):.3f}, R² {r2_score(y[test], pred):.3f}")
+
+    joblib.dump(model, args.salida)
+    print(f"Modelo por tramo guardado en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""
+Motor de caminos mínimos sobre los arrays CSR de la red compilada.
+
+Sustituye a ``nx.dijkstra_path`` con una función de peso en Python: los pesos
+de todas las aristas se materializan antes en un único vector (tiempo base x
+factor de tráfico de su zona) y la búsqueda solo indexa arrays planos.
+
+- ``csgraph``: Dijkstra con heap compilado (``scipy.sparse.csgraph``) sobre la
+  matriz CSR de pesos. Es el más rápido; mismo coste óptimo y mismo camino
+  salvo empates exactos de coste entre caminos distintos.
+- ``dijkstra``: Dijkstra con heap en Python. Reproduce el orden de exploración
+  y los desempates de NetworkX, así que devuelve exactamente el mismo camino.
+- ``bidireccional``: Dijkstra bidireccional en Python. Mismo coste óptimo;
+  ante empates exactos puede elegir otro camino equivalente.
+- ``ch``: consulta sobre Customizable Contraction Hierarchies
+  (ver ``contraccion_jerarquica``).
+- ``compacto``: ``csgraph`` sobre la red con las cadenas de nodos de grado 2
+  colapsadas (ver ``grafo_compacto``).
+
+``matriz_costes`` calcula matrices origen-destino completas con una búsqueda
+uno-a-muchos por origen (o por destino sobre el grafo inverso, lo que sea
+menor), en lugar de un Dijkstra por par.
+"""
+from heapq import heappush, heappop
+from itertools import count
+
+import numpy as np
+from scipy.sparse import csr_array
+from scipy.sparse.csgraph import dijkstra as _csgraph_dijkstra
+
+# Penalización por nivel de tráfico (0=Bajo, 1=Medio, 2=Alto)
+FACTORES_TRAFICO = {0: 1.0, 1: 1.5, 2: 3.0}
+
+MOTORES = ("csgraph", "dijkstra", "bidireccional", "ch", "compacto", "networkx")
+
+
+def factores_por_zona(zonas, traffic_predictions=None):
+    """Factor de tráfico por código de zona (mismo criterio que ``dynamic_weight``)."""
+    factores = np.ones(len(zonas), dtype=np.float64)
+    if traffic_predictions:
+        for cod, zona in enumerate(zonas):
+            if zona in traffic_predictions:
+                factores[cod] = FACTORES_TRAFICO.get(traffic_predictions[zona], 1.0)
+    return factores
+
+
+def pesos_trafico(red, traffic_predictions=None):
+    """Vector de pesos por arista: tiempo base x factor de la zona de la arista."""
+    return red.edge_time * factores_por_zona(red.zonas, traffic_predictions)[red.edge_zona]
+
+
+def con_origen_virtual(matriz, nodos, costes):
+    """
+    Copia de la matriz CSR (n x n) con un nodo virtual ``n`` unido a ``nodos``
+    con ``costes``: una búsqueda desde él equivale a un Dijkstra multi-fuente
+    con costes iniciales distintos.
+    """
+    n = matriz.shape[0]
+    indptr = np.append(matriz.indptr, matriz.indptr[-1] + len(nodos))
+    return csr_array((np.concatenate([matriz.data, np.asarray(costes, dtype=np.float64)]),
+                      np.concatenate([matriz.indices, np.asarray(nodos, dtype=matriz.indices.dtype)]),
+                      indptr), shape=(n + 1, n + 1))
+
+
+def _vista(arr):
+    # memoryview devuelve int/float de Python sin copiar el array (válido con mmap)
+    return memoryview(np.ascontiguousarray(arr))
+
+
+class MotorRutas:
+    """Búsquedas de camino mínimo sobre una ``RedCompilada``."""
+
+    def __init__(self, red):
+        self.red = red
+        self.n = red.n_nodos
+        self._indptr = _vista(red.indptr)
+        self._dst = _vista(red.edge_dst)
+        self._src = _vista(red.edge_src)
+        self._rev = None
+        self._claves = None
+
+    def _reverso(self):
+        # CSR inverso (aristas entrantes por nodo) para la búsqueda hacia atrás
+        if self._rev is None:
+            red = self.red
+            orden = np.argsort(red.edge_dst, kind="stable").astype(np.int32)
+            indptr = np.zeros(self.n + 1, dtype=np.int64)
+            np.cumsum(np.bincount(red.edge_dst, minlength=self.n), out=indptr[1:])
+            self._rev = (_vista(indptr), _vista(orden))
+        return self._rev
+
+    def matriz(self, pesos):
+        """Matriz dispersa CSR (n x n) con los pesos por arista."""
+        red = self.red
+        return csr_array((np.asarray(pesos, dtype=np.float64), red.edge_dst, red.indptr),
+                         shape=(self.n, self.n))
+
+    def arista(self, u, v):
+        """Id de la arista u->v (DiGraph: como mucho una)."""
+        for e in range(self._indptr[u], self._indptr[u + 1]):
+            if self._dst[e] == v:
+                return e
+        raise KeyError((u, v))
+
+    def aristas(self, u, v):
+        """Ids de las aristas u[i]->v[i] (vectorizado)."""
+        if self._claves is None:
+            red = self.red
+            claves = red.edge_src.astype(np.int64) * self.n + red.edge_dst
+            orden = np.argsort(claves, kind="stable")
+            self._claves = (claves[orden], orden)
+        claves, orden = self._claves
+        pos = np.searchsorted(claves, np.asarray(u, dtype=np.int64) * self.n + v)
+        return orden[pos]
+
+    # -------------------------
+    # Matriz origen-destino
+    # -------------------------
+    def _acumular_arbol(self, pred, longitudes, inverso):
+        """
+        Suma de ``longitudes`` desde la raíz de cada árbol de caminos mínimos
+        (filas de ``pred``) hasta cada nodo, por duplicación de punteros.
+        """
+        filas, nodos = np.nonzero(pred >= 0)
+        padres = pred[filas, nodos]
+        acc = np.zeros(pred.shape, dtype=np.float64)
+        if inverso:  # en el grafo inverso el padre es el siguiente nodo hacia el destino
+            acc[filas, nodos] = longitudes[self.aristas(nodos, padres)]
+        else:
+            acc[filas, nodos] = longitudes[self.aristas(padres, nodos)]
+        anc = np.where(pred >= 0, pred, -1)
+        while len(filas):
+            acc[filas, nodos] += acc[filas, padres]
+            padres = anc[filas, padres]
+            anc[filas, nodos] = padres
+            sigue = padres >= 0
+            filas, nodos, padres = filas[sigue], nodos[sigue], padres[sigue]
+        return acc
+
+    def matriz_costes(self, origenes, destinos, matriz, longitudes=None, matriz_inversa=None,
+                      bloque=32):
+        """
+        Costes (y longitudes del camino de coste mínimo si se pasan) entre todos
+        los ``origenes`` y ``destinos`` (ids de nodo). Devuelve
+        ``(costes, longitudes)`` de forma (n_origenes x n_destinos); ``inf``
+        si no hay camino y ``longitudes`` None si no se pidieron.
+
+        Lanza una búsqueda por origen distinto o, si hay menos destinos y se da
+        ``matriz_inversa``, una por destino sobre el grafo inverso.
+        """
+        origenes = np.asarray(origenes, dtype=np.int64)
+        destinos = np.asarray(destinos, dtype=np.int64)
+        uo, io = np.unique(origenes, return_inverse=True)
+        ud, id_ = np.unique(destinos, return_inverse=True)
+        inverso = matriz_inversa is not None and len(ud) < len(uo)
+        fuentes, objetivos = (ud, uo) if inverso else (uo, ud)
+        grafo = matriz_inversa if inverso else matriz
+
+        costes = np.empty((len(fuentes), len(objetivos)), dtype=np.float64)
+        largos = np.empty_like(costes) if longitudes is not None else None
+        # Por bloques para acotar la memoria (cada fuente ocupa un vector de n nodos)
+        for i in range(0, len(fuentes), bloque):
+            lote = fuentes[i:i + bloque]
+            if largos is None:
+                dist = _csgraph_dijkstra(grafo, directed=True, indices=lote)
+            else:
+                dist, pred = _csgraph_dijkstra(grafo, directed=True, indices=lote, return_predecessors=True)
+                acc = self._acumular_arbol(pred, longitudes, inverso)
+                largos[i:i + bloque] = np.where(np.isfinite(dist[:, objetivos]), acc[:, objetivos], np.inf)
+            costes[i:i + bloque] = dist[:, objetivos]
+
+        if inverso:
+            costes = costes.T
+            largos = largos.T if largos is not None else None
+        costes = costes[io][:, id_]
+        if largos is not None:
+            largos = largos[io][:, id_]
+        return costes, largos
+
+    def arbol(self, matriz, fuente):
+        """
+        Árbol completo de caminos mínimos desde ``fuente``: ``(costes,
+        arista_pred)`` por nodo de la red. ``arista_pred`` es -1 si el nodo no
+        se alcanza y -2 si su predecesor es un nodo virtual (id >= n, ver
+        ``con_origen_virtual``).
+        """
+        dist, pred = _csgraph_dijkstra(matriz, directed=True, indices=fuente, return_predecessors=True)
+        dist, pred = dist[:self.n], pred[:self.n]
+        arista_pred = np.full(self.n, -1, dtype=np.int64)
+        interno = (pred >= 0) & (pred < self.n)
+        arista_pred[interno] = self.aristas(pred[interno], np.flatnonzero(interno))
+        arista_pred[pred >= self.n] = -2
+        return dist, arista_pred
+
+    # -------------------------
+    # Dijkstra compilado (scipy)
+    # -------------------------
+    def csgraph(self, origen, destino, pesos, matriz=None, stats=None):
+        """Como ``dijkstra`` pero con el heap de ``scipy.sparse.csgraph``."""
+        if matriz is None:
+            matriz = self.matriz(pesos)
+        dist, pred = _csgraph_dijkstra(matriz, directed=True, indices=origen, return_predecessors=True)
+        if stats is not None:
+            # Búsqueda completa desde el origen: se asientan todos los alcanzables
+            stats["settled"] = int(np.isfinite(dist).sum())
+        if not np.isfinite(dist[destino]):
+            return None
+        nodos = [destino]
+        while nodos[-1] != origen:
+            nodos.append(int(pred[nodos[-1]]))
+        nodos.reverse()
+        aristas = [self.arista(u, v) for u, v in zip(nodos[:-1], nodos[1:])]
+        return nodos, aristas
+
+    # -------------------------
+    # Dijkstra unidireccional
+    # -------------------------
+    def dijkstra(self, origen, destino, pesos, stats=None):
+        """
+        Devuelve ``(nodos, aristas)`` del camino mínimo o None si no existe.
+        ``pesos`` es el vector por arista (ndarray o memoryview). Si se pasa
+        ``stats`` (dict) se rellena ``stats["settled"]``.
+        """
+        w = pesos if isinstance(pesos, memoryview) else _vista(np.asarray(pesos, dtype=np.float64))
+        indptr, dst = self._indptr, self._dst
+        inf = float("inf")
+        settled = bytearray(self.n)
+        seen = [inf] * self.n
+        pred = {}
+        c = count()
+        seen[origen] = 0
+        fringe = [(0, next(c), origen)]
+        encontrado = False
+        while fringe:
+            d, _, v = heappop(fringe)
+            if settled[v]:
+                continue
+            settled[v] = 1
+            if v == destino:
+                encontrado = True
+                break
+            for e in range(indptr[v], indptr[v + 1]):
+                u = dst[e]
+                if settled[u]:
+                    continue
+                vu = d + w[e]
+                if vu < seen[u]:
+                    seen[u] = vu
+                    pred[u] = e
+                    heappush(fringe, (vu, next(c), u))
+        if stats is not None:
+            stats["settled"] = settled.count(1)
+        if not encontrado:
+            return None
+        return self._reconstruir(origen, destino, pred)
+
+    def _reconstruir(self, origen, destino, pred):
+        src = self._src
+        aristas = []
+        v = destino
+        while v != origen:
+            e = pred[v]
+            aristas.append(e)
+            v = src[e]
+        aristas.reverse()
+        nodos = [origen] + [self._dst[e] for e in aristas]
+        return nodos, aristas
+
+    # -------------------------
+    # Dijkstra bidireccional
+    # -------------------------
+    def bidireccional(self, origen, destino, pesos, stats=None):
+        """Como ``dijkstra`` pero buscando a la vez desde origen y destino."""
+        if origen == destino:
+            if stats is not None:
+                stats["settled"] = 0
+            return [origen], []
+        w = pesos if isinstance(pesos, memoryview) else _vista(np.asarray(pesos, dtype=np.float64))
+        indptr_f, dst = self._indptr, self._dst
+        indptr_b, orden_b = self._reverso()
+        src = self._src
+        inf = float("inf")
+        n = self.n
+
+        settled = (bytearray(n), bytearray(n))
+        seen = ([inf] * n, [inf] * n)
+        pred = ({}, {})
+        fringe = ([(0, 0, origen)], [(0, 0, destino)])
+        seen[0][origen] = 0
+        seen[1][destino] = 0
+        c = count(1)
+        mejor, encuentro = inf, None
+
+        while fringe[0] and fringe[1]:
+            if fringe[0][0][0] + fringe[1][0][0] >= mejor:
+                break
+            # Avanzamos por el lado con la frontera más barata
+            lado = 0 if fringe[0][0][0] <= fringe[1][0][0] else 1
+            d, _, v = heappop(fringe[lado])
+            if settled[lado][v]:
+                continue
+            settled[lado][v] = 1
+            seen_l, seen_o, pred_l, st_l = seen[lado], seen[1 - lado], pred[lado], settled[lado]
+            if lado == 0:
+                rango = range(indptr_f[v], indptr_f[v + 1])
+            else:
+                rango = (orden_b[i] for i in range(indptr_b[v], indptr_b[v + 1]))
+            for e in rango:
+                u = dst[e] if lado == 0 else src[e]
+                if st_l[u]:
+                    continue
+                vu = d + w[e]
+                if vu < seen_l[u]:
+                    seen_l[u] = vu
+                    pred_l[u] = e
+                    heappush(fringe[lado], (vu, next(c), u))
+                    if vu + seen_o[u] < mejor:
+                        mejor, encuentro = vu + seen_o[u], u
+
+        if stats is not None:
+            stats["settled"] = settled[0].count(1) + settled[1].count(1)
+        if encuentro is None:
+            return None
+        nodos_f, aristas_f = self._reconstruir(origen, encuentro, pred[0])
+        aristas_b = []
+        v = encuentro
+        while v != destino:
+            e = pred[1][v]
+            aristas_b.append(e)
+            v = dst[e]
+        aristas = aristas_f + aristas_b
+        nodos = nodos_f + [dst[e] for e in aristas_b]
+        return nodos, aristas
+
+    def ruta(self, origen, destino, pesos, motor="csgraph", matriz=None, stats=None):
+        if motor == "bidireccional":
+            return self.bidireccional(origen, destino, pesos, stats=stats)
+        if motor == "dijkstra":
+            return self.dijkstra(origen, destino, pesos, stats=stats)
+        return self.csgraph(origen, destino, pesos, matriz=matriz, stats=stats)
@@ -0,0 +1,98 @@
+"""
+Payload precomprimido de la red en WGS84 para ``/callejero_full``.
+
+El GeoJSON de la red se serializa una sola vez por versión del grafo y se
+guarda junto al artefacto compilado en claro, gzip y (si está instalado el
+paquete ``brotli``) brotli, con un ETag fuerte derivado del contenido.
+Así los workers solo leen bytes ya codificados y nunca repiten la
+reproyección ni el ``to_json`` de GeoPandas.
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+SUBDIR = "payload_red"
+ARCHIVOS = {None: "red_wgs84.json", "gzip": "red_wgs84.json.gz", "br": "red_wgs84.json.br"}
+META_FILE = "meta.json"
+
+
+class PayloadPrecomprimido:
+    """Bytes de la red por codificación + ETag base."""
+
+    def __init__(self, directorio, etag):
+        self.directorio = directorio
+        self.etag = etag
+        self._bytes = {}
+        self._disponibles = [c for c, f in ARCHIVOS.items() if os.path.exists(os.path.join(directorio, f))]
+
+    def codificaciones(self):
+        return list(self._disponibles)
+
+    def contenido(self, codificacion=None):
+        if codificacion not in self._bytes:
+            with open(os.path.join(self.directorio, ARCHIVOS[codificacion]), "rb") as f:
+                self._bytes[codificacion] = f.read()
+        return self._bytes[codificacion]
+
+    def etag_de(self, codificacion=None):
+        # Cada representación tiene su propio ETag fuerte (RFC 9110)
+        return self.etag if codificacion is None else f"{self.etag}-{codificacion}"
+
+    def etags(self):
+        return {self.etag_de(c) for c in ARCHIVOS}
+
+    def elegir_codificacion(self, aceptadas):
+        """Mejor codificación disponible entre las aceptadas (br > gzip > sin comprimir)."""
+        aceptadas = {a.lower() for a in aceptadas}
+        for c in ("br", "gzip"):
+            if c in self._disponibles and (c in aceptadas or "*" in aceptadas):
+                return c
+        return None
+
+
+def construir(contenido, directorio):
+    """Escribe las tres representaciones de forma atómica (tmp + rename)."""
+    base = os.path.dirname(directorio) or "."
+    os.makedirs(base, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp_", dir=base)
+    try:
+        datos = contenido.encode("utf-8") if isinstance(contenido, str) else contenido
+        with open(os.path.join(tmp, ARCHIVOS[None]), "wb") as f:
+            f.write(datos)
+        with open(os.path.join(tmp, ARCHIVOS["gzip"]), "wb") as f:
+            f.write(gzip.compress(datos, compresslevel=9, mtime=0))
+        if BROTLI_AVAILABLE:
+            with open(os.path.join(tmp, ARCHIVOS["br"]), "wb") as f:
+                f.write(brotli.compress(datos, quality=9))
+        etag = hashlib.sha256(datos).hexdigest()[:32]
+        with open(os.path.join(tmp, META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"etag": etag, "bytes": len(datos)}, f)
+        os.rename(tmp, directorio)
+    except OSError:
+        if not os.path.isdir(directorio):
+            raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def obtener(directorio_artefacto, generar):
+    """
+    Abre el payload de la versión actual del grafo o lo genera con
+    ``generar()`` (que devuelve el GeoJSON como str) si todavía no existe.
+    """
+    directorio = os.path.join(directorio_artefacto, SUBDIR)
+    meta_path = os.path.join(directorio, META_FILE)
+    if not os.path.exists(meta_path):
+        construir(generar(), directorio)
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    return PayloadPrecomprimido(directorio, meta["etag"])
@@ -0,0 +1,252 @@
+"""
+Pool de procesos para el cálculo de rutas en los modos de servidor asíncronos.
+
+Con workers síncronos cada petición bloquea un worker entero durante su
+Dijkstra. En los modos ``gevent`` y ``asgi`` un único proceso atiende las
+conexiones y el cálculo (``/ruta``, ``/matriz``, ``/isocronas``) se delega en
+este pool de procesos hijos, creados por ``fork`` después de cargar la red:
+el artefacto del grafo está mapeado en memoria y sus páginas son las mismas
+en todos los procesos, así que la memoria no se multiplica por proceso.
+
+El proceso de conexiones tiene varios hilos (el ejecutor de Flask en modo
+ASGI, la publicación de métricas, la carga de registros) y un ``fork`` desde
+él puede dejar al hijo con un lock cogido por otro hilo. Por eso, al arrancar
+el pool se crea un único proceso semilla, de un solo hilo, y es él quien hace
+el ``fork`` de cada proceso de cálculo, también de los que sustituyen a uno
+matado: el proceso de conexiones le pasa el extremo hijo de la tubería
+(``send_handle``) y recibe el pid.
+
+- Contrapresión: como mucho ``max_cola`` peticiones esperando un proceso
+  libre; por encima se rechazan (``Saturado`` -> 503) en lugar de encolarlas
+  sin límite.
+- Timeout por petición: si vence, el proceso que la calcula se mata y se
+  sustituye por otro (un Dijkstra no se puede interrumpir desde fuera).
+- Cancelación: igual que el timeout, cuando el cliente abandona la petición
+  (``cancelar``, un ``threading.Event``).
+
+La espera es ``Connection.poll`` con intervalos cortos, que con gevent
+(``monkey.patch_all``) cede el control al resto de greenlets.
+"""
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from multiprocessing import reduction
+from multiprocessing.connection import Connection
+
+CLAVE_CANCELAR = "pool_rutas.cancelar"  # clave del Event de cancelación en el environ WSGI
+INTERVALO_S = 0.05
+
+
+class ErrorPool(Exception):
+    """Petición no completada por el pool (ver subclases)."""
+    estado = 500
+
+
+class Saturado(ErrorPool):
+    """Todos los procesos ocupados y la cola de espera llena."""
+    estado = 503
+
+
+class TiempoAgotado(ErrorPool):
+    """La petición superó su timeout."""
+    estado = 504
+
+
+class Cancelada(ErrorPool):
+    """El cliente abandonó la petición."""
+    estado = 499
+
+
+def _bucle(conn, tareas):
+    # Proceso hijo: ejecuta tareas por nombre hasta que se cierra la tubería
+    while True:
+        try:
+            nombre, args, kwargs = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            resultado = (True, tareas[nombre](*args, **kwargs))
+        except Exception as e:
+            resultado = (False, e)
+        try:
+            conn.send(resultado)
+        except Exception as e:  # excepción o resultado no serializable
+            conn.send((False, RuntimeError(f"{type(e).__name__}: {e}")))
+
+
+def _semilla(control, tareas):
+    # Proceso semilla (un solo hilo): un fork por cada tubería que recibe
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # los hijos que terminan no quedan zombis
+    while True:
+        try:
+            fd = reduction.recv_handle(control)
+        except (EOFError, OSError):
+            return
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            control.close()
+            try:
+                _bucle(Connection(fd), tareas)
+            finally:
+                os._exit(0)
+        os.close(fd)
+        control.send(pid)
+
+
+class _Proceso:
+    def __init__(self, pid, conn):
+        self.pid = pid
+        self.conn = conn
+
+    def matar(self):
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.conn.close()
+
+
+class PoolRutas:
+    """Procesos hijos que ejecutan ``tareas[nombre](*args, **kwargs)``."""
+
+    def __init__(self, tareas, procesos=4, max_cola=64, timeout=15.0):
+        self.tareas = tareas
+        self.procesos = max(1, int(procesos))
+        self.max_cola = max(0, int(max_cola))
+        self.timeout = float(timeout)
+        self._ctx = multiprocessing.get_context("fork")
+        self._semilla = None
+        self._control = None
+        self._lock_semilla = threading.Lock()
+        self._cond = threading.Condition()
+        self._libres = []
+        self._todos = []
+        self._esperando = 0
+        self.completadas = 0
+        self.errores = 0
+        self.rechazadas = 0
+        self.timeouts = 0
+        self.canceladas = 0
+        self.reinicios = 0
+
+    def _lanzar(self):
+        padre, hijo = self._ctx.Pipe()
+        with self._lock_semilla:
+            reduction.send_handle(self._control, hijo.fileno(), self._semilla.pid)
+            pid = self._control.recv()
+        hijo.close()
+        return _Proceso(pid, padre)
+
+    def arrancar(self):
+        if self._semilla is None:
+            # El único fork desde este proceso: antes de atender peticiones
+            self._control, control_semilla = self._ctx.Pipe()
+            self._semilla = self._ctx.Process(target=_semilla, args=(control_semilla, self.tareas),
+                                              name="pool-rutas-semilla", daemon=True)
+            self._semilla.start()
+            control_semilla.close()
+        with self._cond:
+            while len(self._todos) < self.procesos:
+                p = self._lanzar()
+                self._todos.append(p)
+                self._libres.append(p)
+        return self
+
+    def _adquirir(self, limite, cancelar):
+        with self._cond:
+            if not self._libres and self._esperando >= self.max_cola:
+                self.rechazadas += 1
+                raise Saturado("Servidor saturado, reintente más tarde")
+            self._esperando += 1
+            try:
+                while not self._libres:
+                    if cancelar is not None and cancelar.is_set():
+                        self.canceladas += 1
+                        raise Cancelada("Petición abandonada por el cliente")
+                    resto = limite - time.monotonic()
+                    if resto <= 0:
+                        self.timeouts += 1
+                        raise TiempoAgotado("Tiempo de espera agotado")
+                    self._cond.wait(min(resto, INTERVALO_S))
+            finally:
+                self._esperando -= 1
+            return self._libres.pop()
+
+    def _liberar(self, p, sano):
+        if not sano:
+            # Proceso ocupado en una petición abandonada o muerto: se sustituye
+            # (la semilla recoge al muerto)
+            p.matar()
+            nuevo = self._lanzar()
+        with self._cond:
+            if not sano:
+                self._todos[self._todos.index(p)] = nuevo
+                self.reinicios += 1
+                p = nuevo
+            self._libres.append(p)
+            self._cond.notify()
+
+    def ejecutar(self, nombre, *args, timeout=None, cancelar=None, **kwargs):
+        """Ejecuta la tarea en un proceso libre y devuelve su resultado (o relanza su excepción)."""
+        limite = time.monotonic() + (self.timeout if timeout is None else timeout)
+        p = self._adquirir(limite, cancelar)
+        sano = False
+        try:
+            p.conn.send((nombre, args, kwargs))
+            while True:
+                if cancelar is not None and cancelar.is_set():
+                    with self._cond:
+                        self.canceladas += 1
+                    raise Cancelada("Petición abandonada por el cliente")
+                resto = limite - time.monotonic()
+                if resto <= 0:
+                    with self._cond:
+                        self.timeouts += 1
+                    raise TiempoAgotado("Tiempo de cálculo agotado")
+                if p.conn.poll(min(resto, INTERVALO_S)):
+                    ok, valor = p.conn.recv()
+                    sano = True
+                    break
+        except (EOFError, OSError) as e:
+            raise RuntimeError(f"El proceso de cálculo terminó inesperadamente: {e}")
+        finally:
+            self._liberar(p, sano)
+        with self._cond:
+            if ok:
+                self.completadas += 1
+            else:
+                self.errores += 1
+        if not ok:
+            raise valor
+        return valor
+
+    def stats(self):
+        with self._cond:
+            return {
+                "procesos": len(self._todos),
+                "libres": len(self._libres),
+                "esperando": self._esperando,
+                "max_cola": self.max_cola,
+                "timeout_s": self.timeout,
+                "pids": [p.pid for p in self._todos],
+                "completadas": self.completadas,
+                "errores": self.errores,
+                "rechazadas": self.rechazadas,
+                "timeouts": self.timeouts,
+                "canceladas": self.canceladas,
+                "reinicios": self.reinicios,
+            }
+
+    def cerrar(self):
+        with self._cond:
+            for p in self._todos:
+                p.matar()
+            self._todos, self._libres = [], []
+        if self._semilla is not None:
+            self._control.close()
+            self._semilla.join(1)
+            self._semilla.kill()
+            self._semilla = self._control = None
@@ -1,41 +1,136 @@
 from flask import Flask, request, jsonify, render_template, Response
 from flasgger import Swagger
-from callejero_mostoles_mod import generar_ruta_geojson_coords, get_network_wgs84
+import pool_rutas
+import memoria_procesos
+import metricas
+import gzip
 import json
+import functools
+import gc
+import importlib.util
 import os
-import pandas as pd
+import threading
+import time
+import uuid
 import numpy as np
-import joblib
+import tabla_prediccion
 from datetime import datetime
 
+# La red (geopandas, scipy, shapely...), pandas y el modelo se cargan en
+# inicializar(): importar este módulo es rápido y /health responde al momento
+cm = None  # callejero_mostoles_mod, una vez cargado
+
 app = Flask(__name__)
 
 # Puerto configurable
 PORT = int(os.environ.get("PORT", 8080))
+# Límites de /matriz (cada origen/destino distinto es una búsqueda sobre toda la red)
+MAX_MATRIZ_PUNTOS = int(os.environ.get("MAX_MATRIZ_PUNTOS", 500))
+# Límites de /isocronas
+MAX_ISOCRONA_MINUTOS = float(os.environ.get("MAX_ISOCRONA_MINUTOS", 60))
+MAX_ISOCRONA_UMBRALES = 10
+# Cache-Control de /callejero_full (la red solo cambia al recompilar el grafo)
+CACHE_RED_SEGUNDOS = int(os.environ.get("CACHE_RED_SEGUNDOS", 86400))
+# Cabecera Server-Timing con el desglose por etapa de cada respuesta
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") != "0"
 
 # ---------------------------------------------
 # 1. Carga del Modelo de Machine Learning
 # ---------------------------------------------
 MODEL_PATH = "modelo_trafico.pkl"
 ENCODER_PATH = "encoder_zona.pkl"
+# "tabla": lookup precalculado sin sklearn en las peticiones | "modelo": RandomForest en vivo
+MODO_PREDICCION = os.environ.get("MODO_PREDICCION", "tabla")
 model = None
 le_zona = None
+tabla = None
 
-try:
-    if os.path.exists(MODEL_PATH) and os.path.exists(ENCODER_PATH):
-        model = joblib.load(MODEL_PATH)
-        le_zona = joblib.load(ENCODER_PATH)
-    else:
-        # Mensaje interno silencioso para no ensuciar el arranque
-        pass 
-except Exception as e:
-    print(f"❌ Error cargando modelos: {e}")
+def cargar_modelo():
+    """Tabla de predicción o modelo + encoder (joblib/sklearn solo si hacen falta)."""
+    global model, le_zona, tabla
+    try:
+        if MODO_PREDICCION == "tabla":
+            tabla = tabla_prediccion.cargar_tabla(tabla_prediccion.TABLA_PATH, MODEL_PATH)
+        if tabla is None and os.path.exists(MODEL_PATH) and os.path.exists(ENCODER_PATH):
+            import joblib
+            model = joblib.load(MODEL_PATH)
+            le_zona = joblib.load(ENCODER_PATH)
+            if MODO_PREDICCION == "tabla":
+                # Tabla ausente o de otro modelo: se regenera y se verifica en vivo
+                tabla = tabla_prediccion.construir_tabla(model, le_zona, MODEL_PATH)
+                errores = tabla_prediccion.verificar_tabla(tabla, model, le_zona)
+                if errores:
+                    print(f"❌ Tabla de predicción descartada: {errores} discrepancias con el modelo")
+                    tabla = None
+                else:
+                    tabla_prediccion.guardar_tabla(tabla)
+        else:
+            # Mensaje interno silencioso para no ensuciar el arranque
+            pass 
+    except Exception as e:
+        print(f"❌ Error cargando modelos: {e}")
 
 ZONAS_LISTA = [
     "Centro", "Norte – Universidad", "Sur – Este", 
     "Oeste", "Parque Coimbra – Guadarrama", "Sur"
 ]
 
+# Inicialización diferida: la red y el modelo se cargan en un hilo al arrancar
+# el proceso y, mientras tanto, /health responde y el resto de endpoints que
+# los necesitan devuelven 503 (/ready indica cuándo se puede enviar tráfico)
+ESTADO = {"grafo": False, "modelo": False, "error": None, "segundos": None}
+_listo = threading.Event()
+_lock_init = threading.Lock()
+_lock_arranque = threading.Lock()
+_pid_init = None
+
+def inicializar():
+    """Carga la red de calles y el modelo (bloqueante; solo la primera vez)."""
+    global cm, _pid_init
+    with _lock_init:
+        if _listo.is_set():
+            return True
+        t0 = time.perf_counter()
+        try:
+            import callejero_mostoles_mod
+            cm = callejero_mostoles_mod
+            ESTADO["grafo"] = True
+            cargar_modelo()
+            ESTADO["modelo"] = tabla is not None or model is not None
+            ESTADO["error"] = None
+            _listo.set()
+        except Exception as e:
+            ESTADO["error"] = f"{type(e).__name__}: {e}"
+            with _lock_arranque:
+                _pid_init = None  # la siguiente petición lo vuelve a intentar
+            print(f"❌ Error en la inicialización: {e}")
+        finally:
+            ESTADO["segundos"] = round(time.perf_counter() - t0, 2)
+        return _listo.is_set()
+
+def arrancar_inicializacion(despues=None):
+    """Lanza inicializar() en segundo plano (una vez por proceso) y después ``despues()``."""
+    global _pid_init
+    if _listo.is_set():
+        if despues is not None:
+            despues()
+        return
+    with _lock_arranque:
+        if _pid_init == os.getpid():
+            return
+        _pid_init = os.getpid()
+
+    def _trabajo():
+        if inicializar() and despues is not None:
+            despues()
+
+    threading.Thread(target=_trabajo, name="inicializacion", daemon=True).start()
+
+def esperar_listo(timeout=None):
+    """Arranca la inicialización si hace falta y espera a que termine (scripts)."""
+    arrancar_inicializacion()
+    return _listo.wait(timeout)
+
 # ---------------------------------------------
 # 2. Configuración Swagger 
 # ---------------------------------------------
@@ -69,44 +164,215 @@ swagger_template = {
 
 swagger = Swagger(app, config=swagger_config, template=swagger_template)
 
+# Endpoints que no necesitan la red ni el modelo
+SIN_INICIALIZAR = {"index", "salud", "preparado", "metricas_prometheus", "static"}
+
+@app.before_request
+def comprobar_inicializacion():
+    metricas.iniciar_traza()
+    arrancar_inicializacion()
+    if _listo.is_set() or request.endpoint in SIN_INICIALIZAR or request.blueprint == "flasgger":
+        return None
+    resp = jsonify({"error": "Servidor iniciándose, reintente en unos segundos",
+                    "error_inicializacion": ESTADO["error"]})
+    resp.status_code = 503
+    resp.headers['Retry-After'] = '2'
+    return resp
+
 @app.after_request
 def add_cors_headers(response):
     response.headers['Access-Control-Allow-Origin'] = '*'
-    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, DELETE, OPTIONS'
     response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    traza = metricas.cerrar_traza(request.endpoint or "desconocido")
+    if SERVER_TIMING and traza:
+        response.headers['Server-Timing'] = metricas.server_timing(traza)
     return response
 
 # ---------------------------------------------
 # 3. Lógica Auxiliar IA
 # ---------------------------------------------
+COLUMNAS_MODELO = tabla_prediccion.COLUMNAS_MODELO
+MAX_DIAS_RANGO = int(os.environ.get("MAX_DIAS_RANGO", 366))
+# Días con todas sus franjas horarias ya predichas en memoria
+CACHE_PREDICCION_DIAS = int(os.environ.get("CACHE_PREDICCION_DIAS", 64))
+
 def es_vacaciones(fecha_dt):
-    vacaciones_periodos = [
-        ("2024-08-01", "2024-08-31"), ("2024-12-20", "2025-01-07"),
-        ("2024-04-01", "2024-04-15"), ("2025-08-01", "2025-08-31"),
-        ("2025-12-20", "2026-01-07")
-    ]
-    s_fecha = fecha_dt.strftime("%Y-%m-%d")
-    for ini, fin in vacaciones_periodos:
-        if ini <= s_fecha <= fin: return 1
-    return 0
+    # Mismo calendario con el que se generó el dataset de entrenamiento
+    return int(tabla_prediccion.vacaciones_vector([np.datetime64(fecha_dt.strftime("%Y-%m-%d"))])[0])
+
+def _zonas_codificadas():
+    """Zonas conocidas por el encoder y su código (una sola llamada a transform)."""
+    zonas = [z for z in ZONAS_LISTA if z in set(le_zona.classes_)]
+    return zonas, np.asarray(le_zona.transform(zonas)) if zonas else np.zeros(0, dtype=np.int64)
+
+def _niveles_franjas(fechas):
+    """
+    Niveles de todas las franjas horarias de cada fecha: todas las fechas x
+    franjas x zonas en una única matriz de features y una única llamada a
+    ``model.predict`` (o un único gather sobre la tabla precalculada en modo tabla).
+    Devuelve (fechas, zonas, niveles n_fechas x FRANJAS_DIA x n_zonas).
+    """
+    import pandas as pd
+    fechas = pd.DatetimeIndex(pd.to_datetime(fechas)).normalize()
+    dia = fechas.weekday.to_numpy()
+    vac = tabla_prediccion.vacaciones_vector(fechas)
+    n_fr = tabla_prediccion.FRANJAS_DIA
+
+    if tabla is not None:
+        # Modo tabla: un gather sobre niveles[dia, vacaciones, franja, zona]
+        zonas = [z for z in ZONAS_LISTA if z in tabla.indice]
+        if len(fechas) == 0 or not zonas: return fechas, [], None
+        niveles = tabla.consultar_dias(dia, vac, [tabla.indice[z] for z in zonas])
+    else:
+        zonas, z_codes = _zonas_codificadas()
+        if len(fechas) == 0 or not zonas: return fechas, [], None
+        n_z = len(zonas)
+        por_fecha = n_fr * n_z
+        X = np.column_stack([
+            np.repeat(dia, por_fecha),
+            np.repeat((dia >= 5).astype(np.int64), por_fecha),
+            np.repeat(vac, por_fecha),
+            np.tile(np.repeat(np.arange(n_fr), n_z), len(fechas)),
+            np.tile(z_codes, len(fechas) * n_fr),
+        ])
+        niveles = np.asarray(model.predict(pd.DataFrame(X, columns=COLUMNAS_MODELO))).reshape(len(fechas), n_fr, n_z)
+    return fechas, zonas, niveles
+
+def _nivel_dia(niveles):
+    """
+    Nivel de una fecha sin hora: el de su franja más cargada (n_fechas x n_zonas).
+    Es lo más cercano al antiguo nivel diario (el carácter del día); el más
+    frecuente lo arrastrarían hacia Fluido las horas de madrugada.
+    """
+    return niveles.max(axis=1)
+
+def predecir_trafico_lote(fechas):
+    """
+    Predicción diaria por lotes: para cada fecha y zona, el nivel de su franja más cargada
+    entre sus franjas horarias (una sola consulta para todas las fechas).
+    Devuelve {fecha 'YYYY-MM-DD': {zona: nivel}}.
+    """
+    if tabla is None and (not model or not le_zona): return {}
+    fechas, zonas, niveles = _niveles_franjas(fechas)
+    if not zonas: return {}
+    claves = fechas.strftime("%Y-%m-%d")
+    return {
+        clave: {zona: int(nivel) for zona, nivel in zip(zonas, fila)}
+        for clave, fila in zip(claves, _nivel_dia(niveles).tolist())
+    }
+
+@functools.lru_cache(maxsize=CACHE_PREDICCION_DIAS)
+def predicciones_dia(dia):
+    """
+    ({zona: nivel} de cada franja, {zona: nivel} del día) del día
+    'YYYY-MM-DD'. Todas las franjas se calculan de una vez y se reutilizan
+    en todas las peticiones de ese día: resolver la franja de salida es un
+    acceso a lista.
+    """
+    if tabla is None and (not model or not le_zona): return [], {}
+    _, zonas, niveles = _niveles_franjas([dia])
+    if not zonas: return [], {}
+    franjas = [dict(zip(zonas, fila)) for fila in niveles[0].tolist()]
+    return franjas, dict(zip(zonas, _nivel_dia(niveles)[0].tolist()))
+
+def predecir_trafico_rango(inicio, fin):
+    """Predicción para todos los días de [inicio, fin] (ambos incluidos)."""
+    import pandas as pd
+    inicio, fin = pd.to_datetime(inicio).normalize(), pd.to_datetime(fin).normalize()
+    if inicio > fin:
+        raise ValueError("start no puede ser posterior a end")
+    fechas = pd.date_range(inicio, fin, freq="D")
+    if len(fechas) > MAX_DIAS_RANGO:
+        raise ValueError(f"El rango no puede superar {MAX_DIAS_RANGO} días")
+    return predecir_trafico_lote(fechas)
 
 def predecir_trafico_por_fecha(fecha_str):
-    if not model or not le_zona: return {}
+    """
+    {zona: nivel} para 'YYYY-MM-DDTHH:MM' (franja de la hora de salida) o para
+    'YYYY-MM-DD' (nivel de la franja más cargada del día).
+    """
     try:
-        dt = pd.to_datetime(fecha_str)
-        dia = dt.weekday()
-        finde = 1 if dia >= 5 else 0
-        vac = es_vacaciones(dt)
-        preds = {}
-        for zona in ZONAS_LISTA:
-            try:
-                z_code = le_zona.transform([zona])[0]
-                nivel = model.predict(pd.DataFrame([[dia, finde, vac, z_code]], 
-                                      columns=["dia_semana", "es_fin_de_semana", "vacaciones", "zona_encoded"]))[0]
-                preds[zona] = int(nivel)
-            except: continue
-        return preds
-    except: return {}
+        import pandas as pd
+        with metricas.etapa("prediccion"):
+            momento = pd.Timestamp(fecha_str)
+            franjas, resumen = predicciones_dia(momento.strftime("%Y-%m-%d"))
+            if ":" not in fecha_str or not franjas:
+                return resumen
+            return franjas[tabla_prediccion.franja(momento.hour, momento.minute)]
+    except Exception: return {}
+
+def predecir_trafico_franjas(fecha_str):
+    """{'HH:MM': {zona: nivel}} de todas las franjas del día."""
+    import pandas as pd
+    franjas, _ = predicciones_dia(pd.Timestamp(fecha_str).strftime("%Y-%m-%d"))
+    return {tabla_prediccion.etiqueta_franja(i): niveles for i, niveles in enumerate(franjas)}
+
+# Cálculo de rutas: en el propio proceso (modo sync) o en el pool de procesos
+# (modos gevent/asgi, ver run_production)
+pool = None
+
+# En los procesos del pool cada tarea abre su propia traza de métricas
+@metricas.en_traza
+def _ruta_bytes(*args, **kwargs):
+    return cm.ruta_geojson_bytes(*args, **kwargs)
+
+@metricas.en_traza
+def _matriz(*args, **kwargs):
+    return cm.matriz_rutas(*args, **kwargs)
+
+@metricas.en_traza
+def _isocronas_bytes(*args, **kwargs):
+    return json.dumps(cm.isocronas_geojson(*args, **kwargs)).encode("utf-8")
+
+TAREAS_POOL = {"ruta": _ruta_bytes, "matriz": _matriz, "isocronas": _isocronas_bytes}
+
+def calcular(nombre, *args, **kwargs):
+    if pool is None:
+        return TAREAS_POOL[nombre](*args, **kwargs)
+    # Espera en cola + cálculo en el pool (sus etapas las publica el proceso del pool)
+    with metricas.etapa("calculo"):
+        return pool.ejecutar(nombre, *args, cancelar=request.environ.get(pool_rutas.CLAVE_CANCELAR), **kwargs)
+
+def _metricas_caches():
+    """Contadores de las cachés y del pool de este proceso para /metrics."""
+    valores = []
+    info = predicciones_dia.cache_info()
+    fuentes = [("prediccion_dias", info.hits, info.misses, info.currsize)]
+    if cm is not None:
+        rutas, esc, dep = cm.cache_rutas_red.stats(), cm.escenarios.stats(), cm.depositos.stats()
+        fuentes += [("rutas", rutas["hits"] + rutas["hits_compartida"], rutas["misses"], rutas["entradas"]),
+                    ("escenarios", esc["hits"], esc["misses"], esc["entradas"]),
+                    ("depositos", dep["hits"], dep["misses"], dep["arboles"])]
+        valores.append(("cache_bytes", "gauge", {"cache": "rutas"}, rutas["bytes"]))
+    for nombre, aciertos, fallos, entradas in fuentes:
+        valores += [("cache_aciertos_total", "counter", {"cache": nombre}, aciertos),
+                    ("cache_fallos_total", "counter", {"cache": nombre}, fallos),
+                    ("cache_entradas", "gauge", {"cache": nombre}, entradas)]
+    if pool is not None:
+        p = pool.stats()
+        valores += [("pool_tareas_total", "counter", {"estado": estado}, p[estado])
+                    for estado in ("completadas", "errores", "rechazadas", "timeouts", "canceladas")]
+        valores += [("pool_esperando", "gauge", {}, p["esperando"]),
+                    ("pool_procesos_libres", "gauge", {}, p["libres"])]
+    return valores
+
+metricas.registrar_coleccion(_metricas_caches)
+
+def _error_pool(e):
+    resp = jsonify({"error": str(e)})
+    resp.status_code = e.estado
+    if isinstance(e, pool_rutas.Saturado):
+        resp.headers['Retry-After'] = '1'
+    return resp
+
+def arrancar_pool():
+    """Crea el pool de cálculo (una vez por proceso servidor, después del fork de Gunicorn)."""
+    global pool
+    if pool is None:
+        pool = pool_rutas.PoolRutas(TAREAS_POOL, procesos=PROCESOS_RUTAS, max_cola=COLA_RUTAS,
+                                    timeout=TIMEOUT_RUTAS_S).arrancar()
+    return pool
 
 # ---------------------------------------------
 # 4. Endpoints
@@ -116,17 +382,133 @@ def predecir_trafico_por_fecha(fecha_str):
 def index():
     return render_template("index.html")
 
+@app.route("/health")
+def salud():
+    """
+    Liveness: el proceso responde (no espera a la carga de la red ni del modelo).
+    ---
+    tags:
+      - Servidor
+    responses:
+      200:
+        description: Proceso vivo
+    """
+    return jsonify({"estado": "ok", "pid": os.getpid()})
+
+@app.route("/ready")
+def preparado():
+    """
+    Readiness: la red de calles y el modelo están cargados.
+    ---
+    tags:
+      - Servidor
+    responses:
+      200:
+        description: >
+          Listo para recibir tráfico. grafo y modelo indican qué componentes están
+          cargados (sin modelo, las rutas se calculan sin predicción de tráfico).
+      503:
+        description: Inicialización en curso o fallida (ver error)
+    """
+    listo = _listo.is_set()
+    resp = jsonify(dict(ESTADO, listo=listo))
+    if not listo:
+        resp.status_code = 503
+        resp.headers['Retry-After'] = '2'
+    return resp
+
 @app.route("/callejero_full")
 def get_full_network():
     try:
-        return Response(get_network_wgs84(), mimetype='application/json')
+        payload = cm.obtener_payload_red()
+        aceptadas = {enc for enc, q in request.accept_encodings if q > 0}
+        codificacion = payload.elegir_codificacion(aceptadas)
+        etag = payload.etag_de(codificacion)
+
+        # Cualquier representación de la misma versión vale para revalidar
+        if any(request.if_none_match.contains(e) for e in payload.etags()):
+            resp = Response(status=304)
+        else:
+            resp = Response(payload.contenido(codificacion), mimetype='application/json')
+            if codificacion:
+                resp.headers['Content-Encoding'] = codificacion
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = f"public, max-age={CACHE_RED_SEGUNDOS}"
+        resp.headers['Vary'] = 'Accept-Encoding'
+        return resp
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/teselas/meta")
+def meta_teselas():
+    """
+    Metadatos de las teselas vectoriales de la red.
+    ---
+    tags:
+      - Red Viaria
+    responses:
+      200:
+        description: Rango de zooms, extensión de cuantización y bbox (oeste, sur, este, norte) de la red
+    """
+    try:
+        return jsonify(cm.obtener_teselas().meta())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/teselas/<int:z>/<int:x>/<int:y>.topojson")
+def get_tesela(z, x, y):
+    """
+    Tesela vectorial z/x/y de la red (TopoJSON cuantizado con zona y highway).
+    ---
+    tags:
+      - Red Viaria
+    parameters:
+      - name: z
+        in: path
+        type: integer
+        required: true
+      - name: x
+        in: path
+        type: integer
+        required: true
+      - name: y
+        in: path
+        type: integer
+        required: true
+    responses:
+      200:
+        description: TopoJSON con el objeto "red" (vías recortadas y simplificadas a la tesela)
+      304:
+        description: La tesela no ha cambiado (If-None-Match)
+      404:
+        description: Tesela fuera del rango de zooms o de la rejilla
+    """
+    if not cm.teselas_red.tesela_valida(z, x, y):
+        return jsonify({"error": "Tesela fuera de rango"}), 404
+    try:
+        indice = cm.obtener_teselas()
+        etag = indice.etag(z, x, y)
+        if request.if_none_match.contains(etag):
+            resp = Response(status=304)
+        else:
+            datos = indice.obtener(z, x, y)
+            aceptadas = {enc for enc, q in request.accept_encodings if q > 0}
+            if "gzip" in aceptadas or "*" in aceptadas:
+                resp = Response(datos, mimetype='application/json')
+                resp.headers['Content-Encoding'] = 'gzip'
+            else:
+                resp = Response(gzip.decompress(datos), mimetype='application/json')
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = f"public, max-age={CACHE_RED_SEGUNDOS}"
+        resp.headers['Vary'] = 'Accept-Encoding'
+        return resp
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route("/prediccion_trafico", methods=['GET'])
 def api_prediccion():
     """
-    Devuelve el nivel de tráfico por zona para una fecha.
+    Devuelve el nivel de tráfico por zona para una fecha o un rango de fechas.
     ---
     tags:
       - Inteligencia Artificial
@@ -134,18 +516,52 @@ def api_prediccion():
       - name: date
         in: query
         type: string
-        required: true
-        description: Fecha en formato YYYY-MM-DD
+        required: false
+        description: >
+          Fecha YYYY-MM-DD (nivel de la franja más cargada del día) o fecha y hora
+          YYYY-MM-DDTHH:MM (nivel de la franja horaria que la contiene)
+      - name: franjas
+        in: query
+        type: boolean
+        required: false
+        description: Con date, devuelve todas las franjas horarias del día {"HH:MM": {zona: nivel}}
+      - name: start
+        in: query
+        type: string
+        required: false
+        description: Inicio del rango (YYYY-MM-DD). Se usa junto con end en lugar de date.
+      - name: end
+        in: query
+        type: string
+        required: false
+        description: Fin del rango (YYYY-MM-DD), incluido.
     responses:
       200:
-        description: Diccionario con niveles de tráfico (0=Bajo, 1=Medio, 2=Alto)
+        description: >
+          Con date, diccionario con niveles de tráfico (0=Bajo, 1=Medio, 2=Alto).
+          Con franjas=true, {"HH:MM": {zona: nivel}} por franja horaria.
+          Con start/end, diccionario {fecha: {zona: nivel}} (nivel de la franja más cargada de cada día).
         schema:
           type: object
           additionalProperties:
             type: integer
+      400:
+        description: Parámetros incorrectos
     """
+    inicio, fin = request.args.get("start"), request.args.get("end")
+    if inicio or fin:
+        if not (inicio and fin): return jsonify({"error": "El rango necesita start y end"}), 400
+        try:
+            return jsonify(predecir_trafico_rango(inicio, fin))
+        except (ValueError, TypeError) as e:
+            return jsonify({"error": str(e)}), 400
     fecha = request.args.get("date")
     if not fecha: return jsonify({"error": "Falta parámetro date"}), 400
+    if request.args.get("franjas", "").lower() in ("1", "true"):
+        try:
+            return jsonify(predecir_trafico_franjas(fecha))
+        except (ValueError, TypeError) as e:
+            return jsonify({"error": str(e)}), 400
     return jsonify(predecir_trafico_por_fecha(fecha))
 
 @app.route("/ruta", methods=["GET"])
@@ -159,15 +575,20 @@ def obtener_ruta():
       - name: orig_lat
         in: query
         type: number
-        required: true
-        description: Latitud del punto de origen
+        required: false
+        description: Latitud del punto de origen (obligatoria salvo con deposito)
         example: 40.324
       - name: orig_lon
         in: query
         type: number
-        required: true
-        description: Longitud del punto de origen
+        required: false
+        description: Longitud del punto de origen (obligatoria salvo con deposito)
         example: -3.867
+      - name: deposito
+        in: query
+        type: string
+        required: false
+        description: Id de un depósito registrado en /depositos como origen (en lugar de orig_lat/orig_lon)
       - name: dest_lat
         in: query
         type: number
@@ -184,8 +605,8 @@ def obtener_ruta():
         in: query
         type: string
         required: false
-        description: Fecha para predicción de tráfico (YYYY-MM-DD). Opcional.
-        example: "2025-12-29"
+        description: Fecha (YYYY-MM-DD) o fecha y hora de salida (YYYY-MM-DDTHH:MM) para la predicción de tráfico. Opcional.
+        example: "2025-12-29T08:30"
     responses:
       200:
         description: GeoJSON con la ruta calculada
@@ -229,39 +650,534 @@ def obtener_ruta():
       400:
         description: Error en la solicitud
       404:
-        description: No existe ruta entre los puntos
+        description: No existe ruta entre los puntos o depósito desconocido
       500:
         description: Error interno
     """
     try:
-        orig_lat = float(request.args.get("orig_lat"))
-        orig_lon = float(request.args.get("orig_lon"))
+        ident = request.args.get("deposito")
+        if ident:
+            deposito = cm.depositos.deposito(ident)
+            if deposito is None:
+                return jsonify({"error": f"Depósito desconocido: {ident}"}), 404
+            orig_lat, orig_lon = deposito.lat, deposito.lon
+        else:
+            orig_lat = float(request.args.get("orig_lat"))
+            orig_lon = float(request.args.get("orig_lon"))
         dest_lat = float(request.args.get("dest_lat"))
         dest_lon = float(request.args.get("dest_lon"))
+        if not np.isfinite([orig_lat, orig_lon, dest_lat, dest_lon]).all():
+            return jsonify({"error": "Coordenadas no válidas"}), 400
         fecha = request.args.get("date")
 
         trafico_preds = {}
         if fecha:
             trafico_preds = predecir_trafico_por_fecha(fecha)
 
-        geojson = generar_ruta_geojson_coords(
+        datos = calcular(
+            "ruta",
             orig_lat, orig_lon,
             dest_lat, dest_lon,
             traffic_predictions=trafico_preds
         )
 
-        if geojson is None:
+        if datos is None:
             return jsonify({"error": "No existe ruta entre los puntos"}), 404
 
-        return Response(json.dumps(geojson), status=200, mimetype="application/geo+json")
+        return Response(datos, status=200, mimetype="application/geo+json")
+
+    except pool_rutas.ErrorPool as e:
+        return _error_pool(e)
+    except cm.PuntoFueraDeRed as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def _leer_puntos(valor, nombre):
+    puntos = np.asarray(valor, dtype=float)
+    if puntos.ndim != 2 or puntos.shape[1] != 2 or len(puntos) == 0:
+        raise ValueError(f"'{nombre}' debe ser una lista no vacía de pares [lat, lon]")
+    if len(puntos) > MAX_MATRIZ_PUNTOS:
+        raise ValueError(f"'{nombre}' admite como máximo {MAX_MATRIZ_PUNTOS} puntos")
+    if not np.isfinite(puntos).all():
+        raise ValueError(f"'{nombre}' contiene coordenadas no válidas")
+    return puntos
+
+@app.route("/matriz", methods=["POST"])
+def obtener_matriz():
+    """
+    Matriz de tiempos y distancias entre varios orígenes y destinos.
+    ---
+    tags:
+      - Rutas
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required: [origins, destinations]
+          properties:
+            origins:
+              type: array
+              description: Lista de puntos [lat, lon] de origen (p. ej. unidades disponibles)
+              items:
+                type: array
+                items:
+                  type: number
+              example: [[40.324, -3.867], [40.322, -3.858]]
+            destinations:
+              type: array
+              description: Lista de puntos [lat, lon] de destino (p. ej. incidentes)
+              items:
+                type: array
+                items:
+                  type: number
+              example: [[40.318, -3.861]]
+            date:
+              type: string
+              description: Fecha (YYYY-MM-DD) o fecha y hora de salida (YYYY-MM-DDTHH:MM) para la predicción de tráfico. Opcional.
+              example: "2025-12-29T08:30"
+            format:
+              type: string
+              enum: [json, binary]
+              description: >
+                json (por defecto) o binary: float32 little-endian de forma
+                (2, n_origins, n_destinations) con tiempos y distancias (inf = sin camino).
+    responses:
+      200:
+        description: >
+          JSON con time_s y length_m (matrices n_origins x n_destinations,
+          null si no hay camino) o el array binario.
+      400:
+        description: Error en la solicitud
+      500:
+        description: Error interno
+    """
+    cuerpo = request.get_json(silent=True) or {}
+    try:
+        origenes = _leer_puntos(cuerpo.get("origins"), "origins")
+        destinos = _leer_puntos(cuerpo.get("destinations"), "destinations")
+        formato = cuerpo.get("format", "json")
+        if formato not in ("json", "binary"):
+            raise ValueError("'format' debe ser json o binary")
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        fecha = cuerpo.get("date")
+        trafico_preds = predecir_trafico_por_fecha(fecha) if fecha else {}
+        tiempos, distancias = calcular("matriz", origenes, destinos, traffic_predictions=trafico_preds)
+
+        if formato == "binary":
+            datos = np.stack([tiempos, distancias]).astype("<f4")
+            resp = Response(datos.tobytes(), mimetype="application/octet-stream")
+            resp.headers["X-Matriz-Forma"] = ",".join(map(str, datos.shape))
+            return resp
+
+        def _a_lista(m):
+            m = np.round(m, 2).astype(object)
+            m[~np.isfinite(m.astype(float))] = None
+            return m.tolist()
+
+        return jsonify({"time_s": _a_lista(tiempos), "length_m": _a_lista(distancias)})
+
+    except pool_rutas.ErrorPool as e:
+        return _error_pool(e)
+    except cm.PuntoFueraDeRed as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/isocronas", methods=["POST"])
+def obtener_isocronas():
+    """
+    Zonas y calles alcanzables en N minutos desde una o varias fuentes.
+    ---
+    tags:
+      - Rutas
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required: [sources, minutes]
+          properties:
+            sources:
+              type: array
+              description: Lista de puntos [lat, lon] de salida (p. ej. parques de bomberos)
+              items:
+                type: array
+                items:
+                  type: number
+              example: [[40.322, -3.8576]]
+            minutes:
+              type: array
+              description: Umbrales de tiempo en minutos
+              items:
+                type: number
+              example: [5, 10, 15]
+            date:
+              type: string
+              description: Fecha (YYYY-MM-DD) o fecha y hora de salida (YYYY-MM-DDTHH:MM) para la predicción de tráfico. Opcional.
+              example: "2025-12-29T08:30"
+            streets:
+              type: boolean
+              description: Incluir las calles alcanzadas en cada franja (por defecto true)
+    responses:
+      200:
+        description: >
+          GeoJSON FeatureCollection con un polígono (kind=isochrone) por umbral y,
+          si streets=true, un MultiLineString (kind=streets) con las calles nuevas de cada franja.
+      400:
+        description: Error en la solicitud
+      500:
+        description: Error interno
+    """
+    cuerpo = request.get_json(silent=True) or {}
+    try:
+        fuentes = _leer_puntos(cuerpo.get("sources"), "sources")
+        minutos = [float(m) for m in cuerpo.get("minutes") or []]
+        if not minutos or len(minutos) > MAX_ISOCRONA_UMBRALES:
+            raise ValueError(f"'minutes' debe tener entre 1 y {MAX_ISOCRONA_UMBRALES} umbrales")
+        if not all(0 < m <= MAX_ISOCRONA_MINUTOS for m in minutos):
+            raise ValueError(f"Los umbrales deben estar entre 0 y {MAX_ISOCRONA_MINUTOS:g} minutos")
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        fecha = cuerpo.get("date")
+        trafico_preds = predecir_trafico_por_fecha(fecha) if fecha else {}
+        datos = calcular("isocronas", fuentes, minutos, traffic_predictions=trafico_preds,
+                         incluir_calles=bool(cuerpo.get("streets", True)))
+        return Response(datos, status=200, mimetype="application/geo+json")
+    except pool_rutas.ErrorPool as e:
+        return _error_pool(e)
+    except cm.PuntoFueraDeRed as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/depositos", methods=["GET"])
+def listar_depositos():
+    """
+    Depósitos registrados (parques, bases) y árboles de caminos calculados en este worker.
+    ---
+    tags:
+      - Rutas
+    responses:
+      200:
+        description: Lista de {id, lat, lon, arboles}
+    """
+    return jsonify(cm.depositos.listar())
 
+@app.route("/depositos", methods=["POST"])
+def alta_deposito():
+    """
+    Registra (o mueve) un depósito. Las rutas que salen de él se resuelven con
+    un árbol de caminos mínimos precalculado en segundo plano por escenario.
+    ---
+    tags:
+      - Rutas
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required: [id, lat, lon]
+          properties:
+            id:
+              type: string
+              example: "parque-1"
+            lat:
+              type: number
+              example: 40.322
+            lon:
+              type: number
+              example: -3.8576
+            date:
+              type: string
+              description: Fecha u hora (YYYY-MM-DDTHH:MM) del escenario a precalcular primero. Por defecto, la hora actual.
+    responses:
+      201:
+        description: Depósito registrado
+      400:
+        description: Error en la solicitud
+    """
+    cuerpo = request.get_json(silent=True) or {}
+    try:
+        ident = str(cuerpo["id"]).strip()
+        lat, lon = float(cuerpo["lat"]), float(cuerpo["lon"])
+        if not ident or not (np.isfinite(lat) and np.isfinite(lon)):
+            raise ValueError("id, lat y lon deben ser válidos")
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Parámetros incorrectos: {e}"}), 400
+    try:
+        fecha = cuerpo.get("date") or datetime.now().strftime("%Y-%m-%dT%H:%M")
+        deposito = cm.registrar_deposito(ident, lat, lon, predecir_trafico_por_fecha(fecha))
+        return jsonify({"id": deposito.id, "lat": deposito.lat, "lon": deposito.lon}), 201
+    except cm.PuntoFueraDeRed as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/depositos/<ident>", methods=["DELETE"])
+def baja_deposito(ident):
+    """
+    Da de baja un depósito.
+    ---
+    tags:
+      - Rutas
+    parameters:
+      - name: ident
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: Depósito eliminado
+      404:
+        description: Depósito desconocido
+    """
+    if not cm.depositos.eliminar(ident):
+        return jsonify({"error": f"Depósito desconocido: {ident}"}), 404
+    return jsonify({"id": ident})
+
+@app.route("/incidencias", methods=["GET"])
+def listar_incidencias():
+    """
+    Cortes y retenciones activos.
+    ---
+    tags:
+      - Rutas
+    responses:
+      200:
+        description: Lista de {id, tipo, factor, aristas, expira, descripcion}
+    """
+    return jsonify(cm.incidencias_red.listar())
+
+def _expiracion(cuerpo):
+    """Caducidad en segundos epoch: ``duracion_s`` desde ahora o ``expira`` (YYYY-MM-DDTHH:MM)."""
+    if cuerpo.get("duracion_s") is not None:
+        duracion = float(cuerpo["duracion_s"])
+        if not duracion > 0:
+            raise ValueError("duracion_s debe ser positiva")
+        return time.time() + duracion
+    if cuerpo.get("expira") is not None:
+        return datetime.fromisoformat(str(cuerpo["expira"])).timestamp()
+    return None
+
+@app.route("/incidencias", methods=["POST"])
+def alta_incidencia():
+    """
+    Registra un corte o una retención sobre aristas concretas, una caja o un
+    polígono. Todos los workers la aplican en menos de un segundo, sin recompilar
+    la red; al caducar (o al borrarla) los pesos vuelven a ser los del escenario.
+    ---
+    tags:
+      - Rutas
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required: [tipo]
+          properties:
+            id:
+              type: string
+              description: Por defecto se genera uno. Un id existente se sustituye.
+            tipo:
+              type: string
+              enum: [corte, lentitud]
+            factor:
+              type: number
+              description: Multiplicador del tiempo de paso (solo lentitud, al menos 1)
+              example: 3
+            aristas:
+              type: array
+              items:
+                type: integer
+            bbox:
+              type: array
+              description: "[min_lon, min_lat, max_lon, max_lat]"
+              example: [-3.866, 40.322, -3.862, 40.325]
+            poligono:
+              type: object
+              description: Geometría GeoJSON (Polygon o MultiPolygon) en WGS84
+            duracion_s:
+              type: number
+              example: 3600
+            expira:
+              type: string
+              description: Fecha y hora de caducidad (YYYY-MM-DDTHH:MM). Sin duracion_s ni expira, hasta borrarla.
+            descripcion:
+              type: string
+    responses:
+      201:
+        description: Incidencia registrada (con el número de aristas afectadas)
+      400:
+        description: Error en la solicitud
+    """
+    cuerpo = request.get_json(silent=True) or {}
+    try:
+        ident = str(cuerpo.get("id") or uuid.uuid4().hex[:12]).strip()
+        if not any(cuerpo.get(k) is not None for k in ("aristas", "bbox", "poligono")):
+            raise ValueError("Indique aristas, bbox o poligono")
+        incidencia = cm.registrar_incidencia(
+            ident, cuerpo.get("tipo"), factor=cuerpo.get("factor"), aristas=cuerpo.get("aristas"),
+            bbox=cuerpo.get("bbox"), poligono=cuerpo.get("poligono"), expira=_expiracion(cuerpo),
+            descripcion=cuerpo.get("descripcion"))
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        return jsonify({"error": f"Parámetros incorrectos: {e}"}), 400
+    return jsonify(incidencia), 201
+
+@app.route("/incidencias/<ident>", methods=["DELETE"])
+def baja_incidencia(ident):
+    """
+    Da por terminada una incidencia.
+    ---
+    tags:
+      - Rutas
+    parameters:
+      - name: ident
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: Incidencia eliminada
+      404:
+        description: Incidencia desconocida
+    """
+    if not cm.incidencias_red.eliminar(ident):
+        return jsonify({"error": f"Incidencia desconocida: {ident}"}), 404
+    return jsonify({"id": ident})
+
+@app.route("/tramos", methods=["POST"])
+def publicar_tramos():
+    """
+    Publica predicciones nuevas de tráfico para unos tramos (PESOS_TRAFICO=tramo).
+    Todos los workers las aplican en menos de un segundo, reescribiendo solo esas
+    aristas en los escenarios en caché, sin recompilar la red.
+    ---
+    tags:
+      - Rutas
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required: [aristas, factores]
+          properties:
+            aristas:
+              type: array
+              description: Ids de arista (orden del CSR)
+              items:
+                type: integer
+              example: [120, 121]
+            factores:
+              type: array
+              description: >
+                Un factor por arista (el mismo para los tres niveles de la zona) o
+                una lista [fluido, moderado, denso] por arista. Positivos y finitos.
+              example: [1.8, 2.5]
+    responses:
+      200:
+        description: Número de aristas publicadas
+      400:
+        description: Error en la solicitud
+      409:
+        description: El servidor no usa factores por tramo (PESOS_TRAFICO=zona o sin modelo)
+    """
+    if cm.tramos_red is None:
+        return jsonify({"error": "Los factores por tramo necesitan PESOS_TRAFICO=tramo y modelo_tramos.pkl"}), 409
+    cuerpo = request.get_json(silent=True) or {}
+    try:
+        # La forma y los valores los valida TablaTramos.normalizar
+        publicadas = cm.actualizar_tramos(cuerpo["aristas"], cuerpo["factores"])
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Parámetros incorrectos: {e}"}), 400
+    return jsonify({"aristas": publicadas})
+
+@app.route("/estadisticas/cache", methods=["GET"])
+def estadisticas_cache():
+    """
+    Estado de las cachés de este worker (rutas y escenarios de tráfico).
+    ---
+    tags:
+      - Rutas
+    responses:
+      200:
+        description: >
+          rutas: entradas, bytes, hits (local y compartida), misses, caducadas,
+          expulsadas y hit_rate de la caché de /ruta. escenarios: ídem de la LRU
+          de vectores de pesos. depositos: árboles en memoria, bytes, pendientes y aciertos.
+          incidencias: activas, aristas afectadas y cambios aplicados en este worker.
+          tramos: aristas con factor actualizado y cambios aplicados en este worker
+          (null con PESOS_TRAFICO=zona).
+          pool: procesos de cálculo, cola, rechazadas, timeouts y canceladas (modos gevent/asgi).
+    """
+    return jsonify({"rutas": cm.cache_rutas_red.stats(), "escenarios": cm.escenarios.stats(),
+                    "depositos": cm.depositos.stats(), "incidencias": cm.incidencias_red.stats(),
+                    "tramos": cm.tramos_red.stats() if cm.tramos_red else None,
+                    "pool": pool.stats() if pool else None})
+
+@app.route("/estadisticas/memoria", methods=["GET"])
+def estadisticas_memoria():
+    """
+    Memoria del maestro de Gunicorn y de cada worker (y procesos de cálculo).
+    ---
+    tags:
+      - Rutas
+    responses:
+      200:
+        description: >
+          Por proceso, rss_mb, pss_mb y uss_mb (memoria única). Con la precarga
+          el uss de cada worker es pequeño: la red se comparte con el maestro.
+    """
+    return jsonify(memoria_procesos.informe(PID_MAESTRO or os.getpid()))
+
+@app.route("/metrics", methods=["GET"])
+def metricas_prometheus():
+    """
+    Métricas de rendimiento en formato Prometheus, sumadas entre todos los workers.
+    ---
+    tags:
+      - Servidor
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: >
+          rutas_etapa_segundos: histograma por etapa (prediccion, reproyeccion,
+          ajuste, busqueda, reconstruccion, serializacion, personalizacion,
+          calculo). http_peticion_segundos: latencia por endpoint.
+          rutas_nodos_asentados: nodos asentados por búsqueda.
+          cache_aciertos_total / cache_fallos_total / cache_tasa_aciertos por caché
+          (rutas, escenarios, depositos, prediccion_dias) y contadores del pool.
+          Cada proceso publica sus valores como mucho con 1 s de retraso.
+    """
+    return Response(metricas.prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 # ---------------------------------------------
 # 5. Configuración de ARRANQUE
 # ---------------------------------------------
 WORKERS = int(os.environ.get("WORKERS", 4))
+# "sync": workers síncronos de Gunicorn | "gevent" / "asgi": un proceso que atiende
+# las conexiones de forma asíncrona + pool de PROCESOS_RUTAS procesos de cálculo
+MODO_SERVIDOR = os.environ.get("MODO_SERVIDOR", "sync")
+PROCESOS_RUTAS = int(os.environ.get("PROCESOS_RUTAS", WORKERS))
+COLA_RUTAS = int(os.environ.get("COLA_RUTAS", 64))
+TIMEOUT_RUTAS_S = float(os.environ.get("TIMEOUT_RUTAS_S", 15))
+# Construir los datos de routing en el maestro antes del fork (compartidos por los workers)
+PRECARGA = os.environ.get("PRECARGA", "1") != "0"
+PID_MAESTRO = None
+# Instantáneas de métricas de cada proceso (por defecto un directorio temporal por servidor)
+METRICAS_DIR = os.environ.get("METRICAS_DIR")
 
 try:
     from gunicorn.app.base import BaseApplication
@@ -273,9 +1189,16 @@ def run_development():
     print(f"🚀 Servidor de DESARROLLO iniciando en http://localhost:{PORT}")
     print(f"📖 Swagger UI disponible en http://localhost:{PORT}/docs")
     print("⚠️  Usa Gunicorn para producción")
+    metricas.configurar(METRICAS_DIR or metricas.directorio_por_defecto(os.getpid()))
+    arrancar_inicializacion()
     app.run(host="0.0.0.0", port=PORT, debug=True)
 
 def run_production():
+    # Los modos asíncronos necesitan su worker de Gunicorn: se comprueba antes de cargar la red
+    requisito = {"gevent": "gevent", "asgi": "uvicorn"}.get(MODO_SERVIDOR)
+    if requisito and importlib.util.find_spec(requisito) is None:
+        raise SystemExit(f"❌ MODO_SERVIDOR={MODO_SERVIDOR} necesita {requisito} (pip install {requisito})")
+
     class GunicornApp(BaseApplication):
         def __init__(self, app, options=None):
             self.options = options or {}
@@ -287,17 +1210,59 @@ def run_production():
                     self.cfg.set(key.lower(), value)
         def load(self): return self.application
 
+    global PID_MAESTRO
+    PID_MAESTRO = os.getpid()
     options = {
         "bind": f"0.0.0.0:{PORT}",
         "workers": WORKERS,
         "accesslog": "-",
         "errorlog": "-",
         "capture_output": True,
+        "preload_app": True,
     }
+    if PRECARGA:
+        if not inicializar():
+            raise RuntimeError(f"No se pudo inicializar el servidor: {ESTADO['error']}")
+        cm.precargar()
+        # Todo lo cargado pasa a la generación permanente: el GC de los workers no
+        # lo recorre y no ensucia sus páginas (copy-on-write)
+        gc.collect()
+        gc.freeze()
+        maestro = memoria_procesos.uso()
+        if maestro:
+            print(f"📦 Datos de routing precargados en el maestro: RSS {maestro['rss_mb']} MB")
+    else:
+        # Cada worker carga la red en segundo plano nada más arrancar
+        options["post_worker_init"] = lambda worker: arrancar_inicializacion()
+    aplicacion = app
+    if MODO_SERVIDOR in ("gevent", "asgi"):
+        # Un único proceso atiende todas las conexiones; el cálculo va al pool
+        options.update({
+            "workers": 1,
+            "worker_class": "gevent" if MODO_SERVIDOR == "gevent" else "uvicorn.workers.UvicornWorker",
+            "worker_connections": 1000,
+            "timeout": int(TIMEOUT_RUTAS_S) + 30,
+            # El pool se crea con la red ya cargada: sus procesos la heredan del fork
+            "post_worker_init": lambda worker: arrancar_inicializacion(despues=arrancar_pool),
+        })
+        if MODO_SERVIDOR == "asgi":
+            import servidor_asgi
+            aplicacion = servidor_asgi.AdaptadorASGI(app)
+        else:
+            # Cliente desconectado -> se cancela su cálculo en el pool
+            import servidor_gevent
+            aplicacion = servidor_gevent.VigilanteDesconexion(app)
+    elif MODO_SERVIDOR != "sync":
+        raise ValueError(f"MODO_SERVIDOR desconocido: {MODO_SERVIDOR}")
+    # Cada worker y proceso del pool publica ahí sus métricas; /metrics las suma
+    metricas.configurar(METRICAS_DIR or metricas.directorio_por_defecto(PID_MAESTRO))
     print(f"🚀 Servidor de PRODUCCIÓN (Gunicorn) iniciando en http://localhost:{PORT}")
     print(f"📖 Swagger UI disponible en http://localhost:{PORT}/docs")
-    print(f"👷 Workers: {WORKERS}")
-    GunicornApp(app, options).run()
+    if MODO_SERVIDOR == "sync":
+        print(f"👷 Workers: {WORKERS}")
+    else:
+        print(f"👷 Modo {MODO_SERVIDOR}: 1 proceso de conexiones + {PROCESOS_RUTAS} procesos de cálculo")
+    GunicornApp(aplicacion, options).run()
 
 if __name__ == "__main__":
     import sys
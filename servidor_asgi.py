@@ -0,0 +1,120 @@
+"""
+Adaptador ASGI mínimo para servir la app Flask (WSGI) desde un bucle asyncio.
+
+Lo usa el modo ``MODO_SERVIDOR=asgi`` (Gunicorn con ``uvicorn.workers.UvicornWorker``):
+las conexiones las atiende el bucle de eventos y cada petición ejecuta la app
+Flask en un hilo. El cálculo pesado no ocupa esos hilos más que esperando al
+pool de procesos (ver ``pool_rutas``), y si el cliente se desconecta
+(``http.disconnect``) se activa el ``threading.Event`` de cancelación del
+environ para que el pool abandone la búsqueda.
+"""
+import asyncio
+import io
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pool_rutas
+
+
+class AdaptadorASGI:
+    """Aplicación ASGI que delega cada petición HTTP en ``wsgi_app`` (en un hilo)."""
+
+    def __init__(self, wsgi_app, hilos=64):
+        self.wsgi_app = wsgi_app
+        self._ejecutor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="wsgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                mensaje = await receive()
+                if mensaje["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif mensaje["type"] == "lifespan.shutdown":
+                    self._ejecutor.shutdown(wait=False)
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+
+        partes = []
+        while True:
+            mensaje = await receive()
+            if mensaje["type"] == "http.disconnect":
+                return
+            partes.append(mensaje.get("body", b""))
+            if not mensaje.get("more_body"):
+                break
+
+        cancelar = threading.Event()
+        environ = _environ(scope, b"".join(partes))
+        environ[pool_rutas.CLAVE_CANCELAR] = cancelar
+        loop = asyncio.get_running_loop()
+        vigilante = asyncio.ensure_future(_vigilar_desconexion(receive, cancelar))
+        try:
+            estado, cabeceras, cuerpo = await loop.run_in_executor(self._ejecutor, self._ejecutar, environ)
+        finally:
+            vigilante.cancel()
+        if cancelar.is_set():
+            return  # el cliente ya no está
+        await send({"type": "http.response.start", "status": estado, "headers": cabeceras})
+        await send({"type": "http.response.body", "body": cuerpo})
+
+    def _ejecutar(self, environ):
+        respuesta = {}
+        escrito = []
+
+        def start_response(status, headers, exc_info=None):
+            respuesta["estado"] = int(status.split(" ", 1)[0])
+            respuesta["cabeceras"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+            return escrito.append
+
+        resultado = self.wsgi_app(environ, start_response)
+        try:
+            cuerpo = b"".join(escrito) + b"".join(resultado)
+        finally:
+            if hasattr(resultado, "close"):
+                resultado.close()
+        return respuesta["estado"], respuesta["cabeceras"], cuerpo
+
+
+async def _vigilar_desconexion(receive, cancelar):
+    while True:
+        mensaje = await receive()
+        if mensaje["type"] == "http.disconnect":
+            cancelar.set()
+            return
+
+
+def _environ(scope, cuerpo):
+    """Environ WSGI (PEP 3333) a partir del scope HTTP de ASGI."""
+    servidor = scope.get("server") or ("localhost", 80)
+    cliente = scope.get("client") or ("", 0)
+    ruta = scope.get("raw_path") or scope["path"].encode("utf-8")
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": ruta.split(b"?", 1)[0].decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(servidor[0]),
+        "SERVER_PORT": str(servidor[1]),
+        "REMOTE_ADDR": str(cliente[0]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(cuerpo),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+        "CONTENT_LENGTH": str(len(cuerpo)),
+    }
+    for nombre, valor in scope.get("headers", []):
+        nombre = nombre.decode("latin-1").upper().replace("-", "_")
+        valor = valor.decode("latin-1")
+        if nombre == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = valor
+        elif nombre != "CONTENT_LENGTH":
+            clave = f"HTTP_{nombre}"
+            environ[clave] = f"{environ[clave]},{valor}" if clave in environ else valor
+    return environ
@@ -0,0 +1,48 @@
+"""
+Cancelación de peticiones abandonadas en ``MODO_SERVIDOR=gevent``.
+
+Gunicorn pasa el socket del cliente en ``environ["gunicorn.socket"]``. Mientras
+Flask espera al pool de procesos, un greenlet espera a que ese socket sea
+legible: si lo que llega es el cierre de la conexión (``recv`` con
+``MSG_PEEK`` devuelve ``b""``) se activa el ``threading.Event`` de cancelación
+del environ (el de gevent, con el monkey patching del worker) y el pool
+abandona la búsqueda, igual que con ``http.disconnect`` en el adaptador ASGI.
+Si lo que llega son datos (cuerpo aún sin leer, siguiente petición en
+keep-alive) se deja de vigilar sin cancelar nada.
+"""
+import socket
+import threading
+
+import gevent
+from gevent.socket import wait_read
+
+import pool_rutas
+
+
+def _vigilar(sock, cancelar):
+    try:
+        wait_read(sock.fileno())
+        if sock.recv(1, socket.MSG_PEEK) == b"":
+            cancelar.set()
+    except OSError:
+        cancelar.set()
+
+
+class VigilanteDesconexion:
+    """Middleware WSGI que cancela la petición si el cliente cierra la conexión."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        sock = environ.get("gunicorn.socket")
+        if sock is None:
+            return self.wsgi_app(environ, start_response)
+        cancelar = threading.Event()
+        environ[pool_rutas.CLAVE_CANCELAR] = cancelar
+        vigilante = gevent.spawn(_vigilar, sock, cancelar)
+        try:
+            # Flask construye la respuesta entera aquí (incluida la espera al pool)
+            return self.wsgi_app(environ, start_response)
+        finally:
+            vigilante.kill(block=False)
@@ -0,0 +1,166 @@
+"""
+Tabla precalculada de predicciones de tráfico.
+
+Las features del modelo son solo día de la semana, fin de semana (derivado del
+día), vacaciones, franja horaria y zona, así que el espacio completo cabe en una
+tabla ``niveles[dia_semana, vacaciones, franja, zona]`` de 7 x 2 x FRANJAS_DIA x
+n_zonas enteros. Se genera al entrenar (``ml/train_trafico_model.py``) o al
+arrancar el servidor, se verifica contra ``model.predict`` y se sirve sin cargar
+sklearn.
+
+La resolución (``MINUTOS_FRANJA``) la comparten el generador del dataset, el
+entrenamiento y el servidor; al cambiarla hay que regenerar el dataset y
+reentrenar (una tabla con otro número de franjas se descarta al cargarla).
+El calendario de vacaciones también es común (``vacaciones_vector``) y vale
+para cualquier año.
+
+    python tabla_prediccion.py    # regenera y verifica la tabla desde los .pkl
+"""
+import hashlib
+import os
+
+import numpy as np
+
+TABLA_PATH = "tabla_trafico.npz"
+MINUTOS_FRANJA = 60  # resolución horaria (15 para cuartos de hora)
+FRANJAS_DIA = 24 * 60 // MINUTOS_FRANJA
+COLUMNAS_MODELO = ["dia_semana", "es_fin_de_semana", "vacaciones", "franja", "zona_encoded"]
+
+
+def franja(hora, minuto=0):
+    """Índice de la franja del día que contiene hora:minuto."""
+    return (int(hora) * 60 + int(minuto)) // MINUTOS_FRANJA
+
+
+def etiqueta_franja(i):
+    """'HH:MM' de inicio de la franja ``i``."""
+    minutos = int(i) * MINUTOS_FRANJA
+    return f"{minutos // 60:02d}:{minutos % 60:02d}"
+
+
+# -------------------------
+# Calendario de vacaciones
+# -------------------------
+def domingo_pascua(anio):
+    """Domingo de Pascua (calendario gregoriano, algoritmo de Meeus/Jones/Butcher)."""
+    a, b, c = anio % 19, anio // 100, anio % 100
+    d, e = b // 4, b % 4
+    g = (8 * b + 13) // 25
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    mes, dia = divmod(h + l - 7 * m + 114, 31)
+    return np.datetime64(f"{anio:04d}-{mes:02d}-{dia + 1:02d}")
+
+
+def periodos_vacaciones(anio):
+    """[(inicio, fin)] (``datetime64[D]``, ambos incluidos) de las vacaciones escolares de ``anio``."""
+    pascua = domingo_pascua(anio)
+    return [
+        (np.datetime64(f"{anio:04d}-01-01"), np.datetime64(f"{anio:04d}-01-07")),  # Navidad (Reyes)
+        (pascua - 9, pascua + 1),  # Semana Santa: viernes de Dolores a lunes de Pascua
+        (np.datetime64(f"{anio:04d}-07-15"), np.datetime64(f"{anio:04d}-08-31")),  # Verano
+        (np.datetime64(f"{anio:04d}-12-22"), np.datetime64(f"{anio:04d}-12-31")),  # Navidad
+    ]
+
+
+def vacaciones_vector(fechas):
+    """0/1 (int8) por fecha: un array/DatetimeIndex de cualquier rango de años."""
+    dias = np.asarray(fechas, dtype="datetime64[D]")
+    vac = np.zeros(len(dias), dtype=np.int8)
+    anios = dias.astype("datetime64[Y]").astype(np.int64) + 1970
+    for anio in np.unique(anios).tolist():
+        for ini, fin in periodos_vacaciones(anio):
+            vac |= (dias >= ini) & (dias <= fin)
+    return vac
+
+
+def hash_modelo(model_path):
+    h = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class TablaPrediccion:
+    """Lookup O(1) de nivel de tráfico por (día, vacaciones, franja, zona)."""
+
+    def __init__(self, niveles, zonas, modelo_sha256=""):
+        self.niveles = niveles
+        self.zonas = [str(z) for z in zonas]
+        self.indice = {z: i for i, z in enumerate(self.zonas)}
+        self.modelo_sha256 = modelo_sha256
+
+    def consultar(self, dia, vac, franjas, zonas_idx):
+        """Niveles (n_momentos x n_zonas) con un único gather vectorizado."""
+        return self.niveles[np.asarray(dia)[:, None], np.asarray(vac)[:, None],
+                            np.asarray(franjas)[:, None], np.asarray(zonas_idx)[None, :]]
+
+    def consultar_dias(self, dia, vac, zonas_idx):
+        """Niveles de todas las franjas de cada fecha (n_fechas x FRANJAS_DIA x n_zonas)."""
+        return self.niveles[np.asarray(dia), np.asarray(vac)][:, :, np.asarray(zonas_idx)]
+
+
+def _espacio_features(z_codes):
+    """Todas las combinaciones (dia, vacaciones, franja, zona) en orden C de la tabla."""
+    dia, vac, fr, zona = np.meshgrid(np.arange(7), np.arange(2), np.arange(FRANJAS_DIA), np.asarray(z_codes),
+                                     indexing="ij")
+    dia, vac, fr, zona = dia.ravel(), vac.ravel(), fr.ravel(), zona.ravel()
+    return np.column_stack([dia, (dia >= 5).astype(np.int64), vac, fr, zona])
+
+
+def _predecir(model, X):
+    import pandas as pd
+    return np.asarray(model.predict(pd.DataFrame(X, columns=COLUMNAS_MODELO)))
+
+
+def construir_tabla(model, le_zona, model_path=None):
+    """Enumera el espacio completo de features con una sola llamada a predict."""
+    zonas = list(le_zona.classes_)
+    z_codes = le_zona.transform(zonas)
+    niveles = _predecir(model, _espacio_features(z_codes)).astype(np.int8).reshape(7, 2, FRANJAS_DIA, len(zonas))
+    return TablaPrediccion(niveles, zonas, hash_modelo(model_path) if model_path else "")
+
+
+def verificar_tabla(tabla, model, le_zona):
+    """Compara la tabla con predicciones en vivo. Devuelve el nº de discrepancias."""
+    z_codes = le_zona.transform(tabla.zonas)
+    vivo = _predecir(model, _espacio_features(z_codes)).reshape(tabla.niveles.shape)
+    return int((vivo != tabla.niveles).sum())
+
+
+def guardar_tabla(tabla, path=TABLA_PATH):
+    # Escritura atómica: varios workers pueden generarla a la vez
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, niveles=tabla.niveles, zonas=np.asarray(tabla.zonas),
+                 modelo_sha256=np.asarray(tabla.modelo_sha256))
+    os.replace(tmp, path)
+
+
+def cargar_tabla(path=TABLA_PATH, model_path=None):
+    """Carga la tabla; None si no existe o si se generó con otro modelo u otra resolución."""
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as data:
+        tabla = TablaPrediccion(data["niveles"], data["zonas"].tolist(), str(data["modelo_sha256"]))
+    if tabla.niveles.ndim != 4 or tabla.niveles.shape[2] != FRANJAS_DIA:
+        return None
+    if model_path and os.path.exists(model_path) and tabla.modelo_sha256 != hash_modelo(model_path):
+        return None
+    return tabla
+
+
+if __name__ == "__main__":
+    import joblib
+
+    MODEL_PATH, ENCODER_PATH = "modelo_trafico.pkl", "encoder_zona.pkl"
+    model, le_zona = joblib.load(MODEL_PATH), joblib.load(ENCODER_PATH)
+    tabla = construir_tabla(model, le_zona, MODEL_PATH)
+    errores = verificar_tabla(tabla, model, le_zona)
+    if errores:
+        raise SystemExit(f"❌ La tabla difiere de las predicciones en vivo en {errores} celdas")
+    guardar_tabla(tabla)
+    print(f"✅ Tabla de predicción verificada y guardada en {TABLA_PATH} ({tabla.niveles.size} celdas)")
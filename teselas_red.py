@@ -0,0 +1,225 @@
+"""
+Teselas vectoriales de la red viaria (esquema XYZ / slippy map).
+
+En lugar de enviar toda la red en un único GeoJSON, el frontend pide solo las
+teselas ``z/x/y`` visibles. Cada tesela es un TopoJSON cuantizado (enteros
+sobre una rejilla de ``EXTENT`` x ``EXTENT`` con codificación delta) que Cesium
+carga directamente con ``GeoJsonDataSource``. La geometría se recorta a la
+tesela, se simplifica a la resolución del zoom y las vías menores se omiten
+en zooms bajos.
+
+Las teselas se generan bajo demanda y se guardan comprimidas junto al
+artefacto del grafo, así que solo se calculan una vez por versión de la red.
+
+    python teselas_red.py [--zoom 12-16]   # pregenera las teselas de la red
+"""
+import gzip
+import json
+import math
+import os
+import threading
+
+import numpy as np
+import shapely
+
+SUBDIR = "teselas"
+EXTENT = 4096       # resolución de cuantización por tesela
+MARGEN = 16         # margen (en unidades de EXTENT) para no cortar líneas en el borde
+ZOOM_MIN = 10
+ZOOM_MAX = 18
+
+# Zoom mínimo al que aparece cada clase de vía (el resto desde ZOOM_DETALLE)
+ZOOM_VIA = {
+    "motorway": ZOOM_MIN, "trunk": ZOOM_MIN, "primary": ZOOM_MIN,
+    "secondary": 12, "tertiary": 13,
+}
+ZOOM_DETALLE = 14
+
+TESELA_VACIA = gzip.compress(json.dumps({
+    "type": "Topology", "objects": {"red": {"type": "GeometryCollection", "geometries": []}}, "arcs": [],
+}).encode("utf-8"), mtime=0)
+
+
+def limites_tesela(z, x, y):
+    """(oeste, sur, este, norte) en grados de la tesela XYZ."""
+    n = 2 ** z
+
+    def lat(fila):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * fila / n))))
+
+    return x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)
+
+
+def tesela_de(lon, lat, z):
+    """Tesela XYZ que contiene el punto (lon, lat)."""
+    n = 2 ** z
+    lat_r = math.radians(max(min(lat, 85.0511), -85.0511))
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(lat_r)) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def teselas_en_bbox(bbox, z):
+    """Todas las teselas del zoom z que cubren bbox = (oeste, sur, este, norte)."""
+    x0, y0 = tesela_de(bbox[0], bbox[3], z)
+    x1, y1 = tesela_de(bbox[2], bbox[1], z)
+    return [(z, x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def tesela_valida(z, x, y):
+    return ZOOM_MIN <= z <= ZOOM_MAX and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def _clase_via(highway):
+    if isinstance(highway, (list, tuple)):
+        highway = highway[0] if highway else None
+    if not isinstance(highway, str):
+        return None
+    return highway.removesuffix("_link")
+
+
+def _texto(valor):
+    return valor if isinstance(valor, str) else None
+
+
+class IndiceTeselas:
+    """Índice espacial de la red WGS84 + caché en disco de teselas generadas."""
+
+    def __init__(self, gdf_wgs84, directorio=None):
+        self.geometrias = np.asarray(gdf_wgs84.geometry.values, dtype=object)
+        self.arbol = shapely.STRtree(self.geometrias)
+        self.bbox = tuple(float(v) for v in gdf_wgs84.total_bounds)
+        n = len(self.geometrias)
+        zonas = gdf_wgs84["zona"] if "zona" in gdf_wgs84.columns else [None] * n
+        highways = gdf_wgs84["highway"] if "highway" in gdf_wgs84.columns else [None] * n
+        self.propiedades = [{"zona": _texto(z), "highway": _texto(h)} for z, h in zip(zonas, highways)]
+        self.zoom_min = np.array([ZOOM_VIA.get(_clase_via(h), ZOOM_DETALLE) for h in highways],
+                                 dtype=np.int8)
+        self.directorio = directorio
+        self.version = os.path.basename(os.path.dirname(directorio)) if directorio else ""
+        self._lock = threading.Lock()
+
+    def etag(self, z, x, y):
+        return f"{self.version}-{z}-{x}-{y}"
+
+    def meta(self):
+        return {"zoom_min": ZOOM_MIN, "zoom_max": ZOOM_MAX, "extent": EXTENT, "bbox": self.bbox,
+                "version": self.version}
+
+    def generar(self, z, x, y):
+        """TopoJSON cuantizado de la tesela (dict) o None si no hay vías."""
+        oeste, sur, este, norte = limites_tesela(z, x, y)
+        sx, sy = (este - oeste) / EXTENT, (norte - sur) / EXTENT
+        caja = (oeste - MARGEN * sx, sur - MARGEN * sy, este + MARGEN * sx, norte + MARGEN * sy)
+
+        idx = self.arbol.query(shapely.box(*caja))
+        idx = np.sort(idx[self.zoom_min[idx] <= z])
+        if len(idx) == 0:
+            return None
+
+        # Recorte + simplificación a la resolución de la tesela (vectorizados)
+        geoms = shapely.clip_by_rect(self.geometrias[idx], *caja)
+        geoms = shapely.simplify(geoms, min(sx, sy), preserve_topology=False)
+        partes, origen = shapely.get_parts(geoms, return_index=True)
+        partes = np.asarray(partes)
+        es_linea = shapely.get_type_id(partes) == 1
+        partes, origen = partes[es_linea], origen[es_linea]
+        if len(partes) == 0:
+            return None
+
+        coords, parte = shapely.get_coordinates(partes, return_index=True)
+        q = np.empty((len(coords), 2), dtype=np.int64)
+        q[:, 0] = np.rint((coords[:, 0] - oeste) / sx)
+        q[:, 1] = np.rint((coords[:, 1] - sur) / sy)
+
+        # Fuera puntos repetidos tras cuantizar y partes que se quedan en un punto
+        nueva = np.r_[True, parte[1:] != parte[:-1]]
+        repetido = ~nueva & np.r_[False, (q[1:] == q[:-1]).all(axis=1)]
+        q, parte, nueva = q[~repetido], parte[~repetido], nueva[~repetido]
+        n_puntos = np.bincount(parte, minlength=len(partes))
+        valida = n_puntos >= 2
+        mantener = valida[parte]
+        q, parte, nueva = q[mantener], parte[mantener], nueva[mantener]
+
+        # Codificación delta de TopoJSON (el primer punto de cada arco va absoluto)
+        delta = q.copy()
+        delta[1:] -= q[:-1]
+        delta[nueva] = q[nueva]
+        cortes = np.flatnonzero(nueva)[1:]
+        arcos = [a.tolist() for a in np.split(delta, cortes)]
+
+        # Agrupar arcos por feature original (LineString o MultiLineString)
+        geometrias = []
+        arco = 0
+        origen = origen[valida]
+        for k in range(len(origen)):
+            if k == 0 or origen[k] != origen[k - 1]:
+                geometrias.append({"type": "LineString", "arcs": [arco],
+                                   "properties": self.propiedades[idx[origen[k]]]})
+            else:
+                g = geometrias[-1]
+                if g["type"] == "LineString":
+                    g["type"], g["arcs"] = "MultiLineString", [g["arcs"]]
+                g["arcs"].append([arco])
+            arco += 1
+
+        return {
+            "type": "Topology",
+            "bbox": [oeste, sur, este, norte],
+            "transform": {"scale": [sx, sy], "translate": [oeste, sur]},
+            "objects": {"red": {"type": "GeometryCollection", "geometries": geometrias}},
+            "arcs": arcos,
+        }
+
+    def _ruta(self, z, x, y):
+        return os.path.join(self.directorio, str(z), str(x), f"{y}.topojson.gz")
+
+    def obtener(self, z, x, y):
+        """Bytes gzip de la tesela: de la caché en disco o generados y guardados."""
+        ruta = self._ruta(z, x, y) if self.directorio else None
+        if ruta and os.path.exists(ruta):
+            with open(ruta, "rb") as f:
+                return f.read()
+
+        oeste, sur, este, norte = limites_tesela(z, x, y)
+        b = self.bbox
+        if este < b[0] or oeste > b[2] or norte < b[1] or sur > b[3]:
+            return TESELA_VACIA  # fuera de la red: no se guarda
+        topo = self.generar(z, x, y)
+        if topo is None:
+            return TESELA_VACIA
+        datos = gzip.compress(json.dumps(topo, separators=(",", ":")).encode("utf-8"),
+                              compresslevel=6, mtime=0)
+        if ruta:
+            # Escritura atómica: varios workers pueden generar la misma tesela
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(datos)
+            os.replace(tmp, ruta)
+        return datos
+
+    def pregenerar(self, zooms):
+        """Genera y guarda todas las teselas de la red para los zooms indicados."""
+        total = 0
+        for z in zooms:
+            for t in teselas_en_bbox(self.bbox, z):
+                if self.obtener(*t) is not TESELA_VACIA:
+                    total += 1
+        return total
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import callejero_mostoles_mod as cm
+
+    parser = argparse.ArgumentParser(description="Pregenera las teselas vectoriales de la red")
+    parser.add_argument("--zoom", default=f"{ZOOM_MIN}-16", help="Rango de zooms, p. ej. 12-16")
+    args = parser.parse_args()
+    z0, _, z1 = args.zoom.partition("-")
+    zooms = range(max(int(z0), ZOOM_MIN), min(int(z1 or z0), ZOOM_MAX) + 1)
+
+    indice = cm.obtener_teselas()
+    n = indice.pregenerar(zooms)
+    print(f"✅ {n} teselas generadas en {indice.directorio} (zooms {zooms.start}-{zooms.stop - 1})")
@@ -0,0 +1,7 @@
+"""Los tests importan los módulos del servidor desde la raíz del repositorio."""
+import os
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
@@ -0,0 +1,75 @@
+"""
+Presupuesto de arranque del servidor: ``import server`` debe ser rápido.
+
+Cada medida es un intérprete limpio. Se comprueba el tiempo de ``import
+server`` (mediana de varias medidas) y que no se ha importado ninguno de los
+módulos pesados, que se cargan después en ``server.inicializar()``. También
+se comprueba que ``/health`` responde 200 y ``/ready`` 503 antes de que
+termine la carga, y que ``/ready`` pasa a 200 después.
+
+    python -m pytest tests/test_arranque.py
+    PRESUPUESTO_ARRANQUE_S=0.4 python -m pytest tests/test_arranque.py
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("flasgger")
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PRESUPUESTO_S = float(os.environ.get("PRESUPUESTO_ARRANQUE_S", 0.6))  # mediana de import server
+REPETICIONES = int(os.environ.get("REPETICIONES_ARRANQUE", 5))
+
+PESADOS = ["callejero_mostoles_mod", "geopandas", "networkx", "pandas", "scipy",
+           "shapely", "pyproj", "sklearn", "joblib"]
+
+_IMPORTACION = """
+import json, sys, time
+t0 = time.perf_counter()
+import server
+importacion = time.perf_counter() - t0
+print(json.dumps({"importacion_s": importacion, "pesados": [m for m in %r if m in sys.modules]}))
+"""
+
+_SALUD = """
+import json
+import server
+c = server.app.test_client()
+salud, listo = c.get("/health").status_code, c.get("/ready").status_code
+server.esperar_listo(120)
+print(json.dumps({"health": salud, "ready_antes": listo, "ready_despues": c.get("/ready").status_code}))
+"""
+
+
+def _ejecutar(codigo):
+    salida = subprocess.run([sys.executable, "-W", "ignore", "-c", codigo], capture_output=True, text=True,
+                            check=True, cwd=RAIZ, timeout=300).stdout
+    return json.loads(salida.strip().splitlines()[-1])
+
+
+@pytest.fixture(scope="module")
+def medidas():
+    return [_ejecutar(_IMPORTACION % PESADOS) for _ in range(REPETICIONES)]
+
+
+def test_import_server_dentro_del_presupuesto(medidas):
+    tiempos = sorted(m["importacion_s"] for m in medidas)
+    mediana = tiempos[len(tiempos) // 2]
+    assert mediana <= PRESUPUESTO_S, (f"import server tarda {mediana:.3f} s (> {PRESUPUESTO_S:.3f} s); "
+                                      f"medidas: {', '.join(f'{t:.3f}' for t in tiempos)}")
+
+
+def test_sin_modulos_pesados_al_importar(medidas):
+    pesados = sorted({p for m in medidas for p in m["pesados"]})
+    assert not pesados, f"módulos pesados importados al cargar server.py: {', '.join(pesados)}"
+
+
+def test_health_y_ready_durante_la_carga():
+    if not os.path.exists(os.path.join(RAIZ, "data", "callesconzonas.geojson")):
+        pytest.skip("Sin la red de calles no termina la carga")
+    m = _ejecutar(_SALUD)
+    assert (m["health"], m["ready_antes"], m["ready_despues"]) == (200, 503, 200)
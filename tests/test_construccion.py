@@ -0,0 +1,165 @@
+"""
+El constructor vectorizado del grafo (``construir_aristas``) produce
+exactamente la misma red que el constructor original con ``iterrows``, que se
+conserva aquí como referencia: misma topología, mismos atributos y mismo
+orden de adyacencia tras compilar ambos a CSR.
+
+    python -m pytest tests/test_construccion.py
+"""
+import os
+
+import numpy as np
+import pytest
+
+nx = pytest.importorskip("networkx")
+pytest.importorskip("geopandas")
+from shapely.geometry import LineString  # noqa: E402
+
+from grafo_compilado import ARRAYS, FORMATO_VERSION, RedCompilada, _nombre_highway, _nombre_zona  # noqa: E402
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GEOJSON = os.path.join(RAIZ, "data", "callesconzonas.geojson")
+
+
+# -------------------------
+# Referencia: constructor original
+# -------------------------
+def construir_grafo(gdf_edges):
+    """Constructor original: ``iterrows`` y un ``LineString`` por segmento."""
+    from callejero_mostoles_mod import interpret_oneway, speed_for_row
+    G = nx.DiGraph()
+    node_id_map = {} # Mapeo de coordenadas (x,y) -> ID entero
+
+    def get_node_id(coord):
+        # Redondeamos para asegurar que puntos muy cercanos se unan (conectar calles)
+        key = (round(coord[0], 3), round(coord[1], 3))
+        if key not in node_id_map:
+            node_id_map[key] = len(node_id_map)
+            # Guardamos coords reales para luego recuperar geometría
+            G.add_node(node_id_map[key], x=coord[0], y=coord[1])
+        return node_id_map[key]
+
+    for idx, row in gdf_edges.iterrows():
+        geom = row.geometry
+        speed_kph = speed_for_row(row)
+        zona = row['zona']
+        highway = row.get('highway')
+        
+        # 1. Analizar dirección
+        raw_oneway = row.get('oneway')
+        raw_junction = str(row.get('junction', '')).lower()
+        
+        # LÓGICA CORREGIDA:
+        # Si es rotonda, SIEMPRE es oneway 
+        if 'roundabout' in raw_junction:
+            oneway = 'yes'
+        else:
+            oneway = interpret_oneway(raw_oneway)
+
+        # Manejar MultiLineStrings si las hubiera
+        lines = [geom] if geom.geom_type == 'LineString' else list(geom.geoms)
+
+        for ls in lines:
+            coords = list(ls.coords)
+            # Iteramos segmento a segmento (Esto preserva las curvas)
+            for i in range(len(coords) - 1):
+                a, b = coords[i], coords[i+1]
+                u = get_node_id(a)
+                v = get_node_id(b)
+
+                # Distancia y tiempo base de este pequeño segmento
+                seg_len = LineString([a, b]).length
+                seg_time = seg_len / (speed_kph / 3.6)
+
+                attr = {
+                    'length_m': seg_len,
+                    'travel_time_s': seg_time,
+                    'zona': zona,
+                    'highway': highway
+                }
+
+                if oneway == 'yes':
+                    G.add_edge(u, v, **attr)
+                elif oneway == '-1':
+                    G.add_edge(v, u, **attr)
+                else:
+                    G.add_edge(u, v, **attr)
+                    G.add_edge(v, u, **attr)
+
+    return G
+
+
+def compilar_desde_grafo(G, source_hash):
+    """
+    Compila un DiGraph de NetworkX (nodos 0..n-1 con x/y) a CSR.
+    Se respeta el orden de adyacencia de NetworkX para que Dijkstra
+    desempate exactamente igual que ``nx.dijkstra_path``.
+    """
+    n = G.number_of_nodes()
+    zonas = sorted({_nombre_zona(d) for _, _, d in G.edges(data=True)})
+    cod = {z: i for i, z in enumerate(zonas)}
+    highways = sorted({_nombre_highway(d.get("highway")) for _, _, d in G.edges(data=True)})
+    cod_hw = {h: i for i, h in enumerate(highways)}
+
+    indptr = np.zeros(n + 1, dtype=ARRAYS["indptr"])
+    src, dst, length, time_s, zona, highway = [], [], [], [], [], []
+    for u in range(n):
+        for v, d in G._succ[u].items():
+            src.append(u)
+            dst.append(v)
+            length.append(d["length_m"])
+            time_s.append(d["travel_time_s"])
+            zona.append(cod[_nombre_zona(d)])
+            highway.append(cod_hw[_nombre_highway(d.get("highway"))])
+        indptr[u + 1] = len(dst)
+
+    arrays = {
+        "indptr": indptr,
+        "edge_src": np.asarray(src, dtype=ARRAYS["edge_src"]),
+        "edge_dst": np.asarray(dst, dtype=ARRAYS["edge_dst"]),
+        "edge_len": np.asarray(length, dtype=ARRAYS["edge_len"]),
+        "edge_time": np.asarray(time_s, dtype=ARRAYS["edge_time"]),
+        "edge_zona": np.asarray(zona, dtype=ARRAYS["edge_zona"]),
+        "edge_highway": np.asarray(highway, dtype=ARRAYS["edge_highway"]),
+        "node_x": np.asarray([G.nodes[u]["x"] for u in range(n)], dtype=ARRAYS["node_x"]),
+        "node_y": np.asarray([G.nodes[u]["y"] for u in range(n)], dtype=ARRAYS["node_y"]),
+    }
+    meta = {
+        "formato": FORMATO_VERSION,
+        "source_sha256": source_hash,
+        "n_nodos": n,
+        "n_aristas": len(dst),
+        "zonas": zonas,
+        "highways": highways,
+    }
+    return RedCompilada(arrays, meta)
+
+
+# -------------------------
+# Tests
+# -------------------------
+@pytest.fixture(scope="module")
+def cm():
+    if not os.path.exists(GEOJSON):
+        pytest.skip(f"No está {GEOJSON}")
+    cwd = os.getcwd()
+    os.chdir(RAIZ)  # callejero_mostoles_mod abre data/ con rutas relativas
+    try:
+        import callejero_mostoles_mod
+        yield callejero_mostoles_mod
+    finally:
+        os.chdir(cwd)
+
+
+def test_topologia_identica(cm):
+    import grafo_compilado
+
+    calles = cm.cargar_calles()
+    ref = compilar_desde_grafo(construir_grafo(calles), "")
+    nueva = grafo_compilado.compilar_desde_aristas(cm.construir_aristas(calles), "")
+
+    assert (nueva.n_nodos, nueva.n_aristas) == (ref.n_nodos, ref.n_aristas)
+    for nombre in ARRAYS:
+        np.testing.assert_array_equal(getattr(nueva, nombre), getattr(ref, nombre), err_msg=nombre)
+    assert nueva.zonas == ref.zonas
+    assert nueva.highways == ref.highways
@@ -0,0 +1,269 @@
+"""
+Modelo de tráfico por tramo (arista).
+
+El modelo por zona aplica el mismo factor (1.5x, 3x) a todas las aristas de la
+zona. Este predice el factor de cada tramo a partir del tipo de vía
+(``highway``), su velocidad, su posición y el nivel previsto para su zona.
+
+El nivel de la zona es la única entrada que cambia entre escenarios, así que
+la inferencia se hace una vez, por lotes, para los tres niveles y se guarda
+junto al artefacto de la red como tabla float32 ``factores[nivel, arista]``
+alineada con el orden de aristas del CSR (la última fila, para zonas sin
+predicción, vale 1). Materializar un escenario es un gather por arista y las
+predicciones nuevas de unos pocos tramos solo reescriben sus columnas
+(``TablaTramos.actualizar``), sin tocar el grafo.
+
+Esas predicciones nuevas se publican en un registro JSON compartido por todos
+los workers y procesos de cálculo (``ActualizacionesTramos``), que cada uno
+vuelve a mirar como mucho cada ``RECARGA_S``, igual que las incidencias.
+
+    python trafico_tramos.py [--forzar]   # regenera la tabla desde modelo_tramos.pkl
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+import grafo_compilado
+
+MODELO_TRAMOS_PATH = "modelo_tramos.pkl"
+SUBDIR = "tramos"
+TRAMOS_VERSION = 1
+NIVELES = 3  # 0=Fluido, 1=Moderado, 2=Denso
+SIN_PREDICCION = NIVELES  # fila de la tabla para zonas sin predicción (factor 1)
+LOTE_INFERENCIA = 1 << 18  # filas por llamada a predict
+RECARGA_S = 0.5  # las actualizaciones llegan a todos los procesos en menos de un segundo
+
+COLUMNAS = ["nivel_zona", "jerarquia", "velocidad_kmh", "x", "y", "zona"]
+# Jerarquía de vías de OSM (los *_link cuentan como su vía); el resto va al final
+JERARQUIA_VIAS = ["motorway", "trunk", "primary", "secondary", "tertiary", "unclassified",
+                  "residential", "living_street", "service"]
+
+
+def jerarquia(highways):
+    """Posición de cada tipo de vía en ``JERARQUIA_VIAS`` (desconocidas al final)."""
+    bases = [h[:-len("_link")] if h.endswith("_link") else h for h in highways]
+    return np.array([JERARQUIA_VIAS.index(b) if b in JERARQUIA_VIAS else len(JERARQUIA_VIAS) for b in bases],
+                    dtype=np.float32)
+
+
+def features_estaticas(red):
+    """Features de cada arista que no dependen del escenario (n_aristas x 5, float32)."""
+    tiempo = np.asarray(red.edge_time)
+    velocidad = np.divide(np.asarray(red.edge_len) * 3.6, tiempo, out=np.full(len(tiempo), 30.0),
+                          where=tiempo > 0)
+    src, dst = np.asarray(red.edge_src), np.asarray(red.edge_dst)
+    return np.column_stack([
+        jerarquia(red.highways)[red.edge_highway],
+        velocidad,
+        (red.node_x[src] + red.node_x[dst]) / 2,
+        (red.node_y[src] + red.node_y[dst]) / 2,
+        red.edge_zona,
+    ]).astype(np.float32)
+
+
+def matriz_features(estaticas, nivel):
+    """Features del modelo para todas las aristas con su zona en ``nivel``."""
+    return np.column_stack([np.full(len(estaticas), nivel, dtype=np.float32), estaticas])
+
+
+def predecir_tabla(modelo, red):
+    """Tabla ``(NIVELES + 1) x n_aristas`` float32: inferencia por lotes, un nivel cada vez."""
+    estaticas = features_estaticas(red)
+    factores = np.ones((NIVELES + 1, red.n_aristas), dtype=np.float32)
+    for nivel in range(NIVELES):
+        for ini in range(0, red.n_aristas, LOTE_INFERENCIA):
+            X = matriz_features(estaticas[ini:ini + LOTE_INFERENCIA], nivel)
+            factores[nivel, ini:ini + LOTE_INFERENCIA] = modelo.predict(X)
+    # El tráfico nunca hace el tramo más rápido que a flujo libre
+    np.maximum(factores, 1.0, out=factores)
+    return factores
+
+
+class TablaTramos:
+    """Factores de tráfico por (nivel de la zona, arista), modificables por tramos."""
+
+    def __init__(self, factores, meta):
+        self.factores = factores
+        self.meta = meta
+
+    @property
+    def n_aristas(self):
+        return self.factores.shape[1]
+
+    def factores_escenario(self, clave, edge_zona, aristas=None):
+        """
+        Factor de cada arista (o solo de ``aristas``) para ``clave``, el nivel de
+        cada zona en el orden de sus códigos (None = sin predicción).
+        """
+        niveles = np.array([n if n in range(NIVELES) else SIN_PREDICCION for n in clave], dtype=np.intp)
+        if aristas is None:
+            return self.factores[niveles[edge_zona], np.arange(self.n_aristas)]
+        return self.factores[niveles[edge_zona[aristas]], aristas]
+
+    def normalizar(self, aristas, factores):
+        """
+        Valida una actualización: ``factores`` tiene uno por arista (el mismo
+        para todos los niveles) o una fila de ``NIVELES`` por arista. Devuelve
+        las aristas y una matriz ``(len(aristas), NIVELES)``.
+        """
+        aristas = np.asarray(aristas, dtype=np.int64)
+        f = np.asarray(factores, dtype=np.float32)
+        if f.ndim == 1:
+            f = np.repeat(f[:, None], NIVELES, axis=1)
+        if f.shape != (len(aristas), NIVELES):
+            raise ValueError(f"Se esperan {len(aristas)} factores o {len(aristas)} x {NIVELES}")
+        if len(aristas) and (aristas.min() < 0 or aristas.max() >= self.n_aristas):
+            raise ValueError("Arista fuera de la red")
+        if not np.all(np.isfinite(f) & (f > 0)):
+            raise ValueError("Los factores deben ser positivos y finitos")
+        return aristas, f
+
+    def actualizar(self, aristas, factores):
+        """Sustituye los factores de ``aristas`` (ver ``normalizar``)."""
+        aristas, f = self.normalizar(aristas, factores)
+        self.factores[:NIVELES, aristas] = f.T
+        return aristas
+
+
+class ActualizacionesTramos:
+    """
+    Registro de predicciones nuevas por tramo (``{arista: [factor por nivel]}``)
+    y su aplicación a la tabla y a una ``CacheEscenarios`` de este proceso.
+    """
+
+    def __init__(self, ruta, tabla, escenarios):
+        self.ruta = ruta
+        self.tabla = tabla
+        self.escenarios = escenarios
+        self._aplicado = {}  # arista -> factores del registro ya aplicados
+        self._originales = {}  # arista -> factores del modelo, por si sale del registro
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._revisado = 0.0
+        self.huella = ""  # identifica las actualizaciones aplicadas (igual en todos los procesos)
+        self.aplicaciones = 0
+        self.aristas_cambiadas = 0
+
+    # -------------------------
+    # Registro (JSON compartido entre workers)
+    # -------------------------
+    def _leer_registro(self):
+        if not os.path.exists(self.ruta):
+            return {}
+        with open(self.ruta, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _escribir_registro(self, registro):
+        directorio = os.path.dirname(self.ruta) or "."
+        os.makedirs(directorio, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".tramos_", dir=directorio)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(registro, f)
+        os.replace(tmp, self.ruta)
+
+    @contextmanager
+    def _bloqueo_registro(self):
+        """Leer, modificar y escribir el registro sin pisar a otro worker (flock en ``<ruta>.lock``)."""
+        os.makedirs(os.path.dirname(self.ruta) or ".", exist_ok=True)
+        with self._lock, open(self.ruta + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield  # al cerrar el fichero se suelta el bloqueo
+
+    def sincronizar(self, forzar=False):
+        """Aplica los cambios del registro (como mucho una comprobación cada RECARGA_S)."""
+        ahora = time.monotonic()
+        if not forzar and ahora - self._revisado < RECARGA_S:
+            return
+        self._revisado = ahora
+        mtime = os.path.getmtime(self.ruta) if os.path.exists(self.ruta) else None
+        if not forzar and mtime == self._mtime:
+            return
+        with self._lock:
+            registro = self._leer_registro()
+            self._mtime = mtime
+            nuevo = {int(e): f for e, f in registro.items()}
+            # Solo las aristas cuyos factores cambian respecto a lo aplicado
+            cambian = sorted(e for e in nuevo.keys() | self._aplicado.keys() if nuevo.get(e) != self._aplicado.get(e))
+            if cambian:
+                for e in cambian:
+                    if e not in self._originales:
+                        self._originales[e] = self.tabla.factores[:NIVELES, e].tolist()
+                self.tabla.actualizar(cambian, [nuevo.get(e, self._originales[e]) for e in cambian])
+                self.escenarios.actualizar_aristas(cambian)
+                self.aplicaciones += 1
+                self.aristas_cambiadas += len(cambian)
+            self._aplicado = nuevo
+            self.huella = hashlib.sha1(json.dumps(registro, sort_keys=True).encode()).hexdigest()[:12] \
+                if registro else ""
+
+    def publicar(self, aristas, factores):
+        """Publica nuevos factores para ``aristas`` (ver ``TablaTramos.normalizar``); devuelve cuántas."""
+        aristas, f = self.tabla.normalizar(aristas, factores)
+        with self._bloqueo_registro():
+            registro = self._leer_registro()
+            # Si una arista viene repetida manda la última
+            registro.update((str(e), fila) for e, fila in zip(aristas.tolist(), f.tolist()))
+            self._escribir_registro(registro)
+        self.sincronizar(forzar=True)
+        return len(np.unique(aristas))
+
+    def stats(self):
+        with self._lock:
+            return {"aristas": len(self._aplicado), "aplicaciones": self.aplicaciones,
+                    "aristas_cambiadas": self.aristas_cambiadas}
+
+
+def _hash_modelo(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for bloque in iter(lambda: fh.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def cargar_tabla(red, modelo_path=MODELO_TRAMOS_PATH, forzar=False):
+    """
+    Tabla de factores por tramo de la red: se abre de disco si es de este
+    modelo y esta red, o se calcula con el modelo (joblib/sklearn solo en ese
+    caso) y se guarda junto al artefacto. None si no hay modelo.
+    """
+    if not os.path.exists(modelo_path):
+        print(f"⚠️  No encuentro {modelo_path}: se usan los factores por zona")
+        return None
+    modelo_sha = _hash_modelo(modelo_path)
+    directorio = os.path.join(red.meta["directorio"], SUBDIR)
+    if forzar and os.path.isdir(directorio):
+        shutil.rmtree(directorio)
+    # Copia privada en memoria (n_aristas x 4 x 4 bytes): las actualizaciones no tocan el disco
+    leido = grafo_compilado.cargar_arrays(directorio, ["factores"], mmap=False)
+    if leido is not None:
+        arrays, meta = leido
+        if (meta.get("tramos_version") == TRAMOS_VERSION and meta.get("modelo_sha256") == modelo_sha
+                and meta.get("source_sha256") == red.meta["source_sha256"]
+                and arrays["factores"].shape == (NIVELES + 1, red.n_aristas)):
+            return TablaTramos(arrays["factores"], meta)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    import joblib
+    print("⚙️ Prediciendo factores de tráfico por tramo...")
+    factores = predecir_tabla(joblib.load(modelo_path), red)
+    meta = {"tramos_version": TRAMOS_VERSION, "modelo_sha256": modelo_sha,
+            "source_sha256": red.meta["source_sha256"], "n_aristas_red": red.n_aristas}
+    grafo_compilado.guardar_arrays({"factores": factores}, meta, directorio)
+    print(f"✅ Factores por tramo: {NIVELES} niveles x {red.n_aristas} aristas")
+    return TablaTramos(factores, meta)
+
+
+if __name__ == "__main__":
+    import sys
+    import callejero_mostoles_mod as cm
+
+    cargar_tabla(cm.red, forzar="--forzar" in sys.argv)